@@ -0,0 +1,71 @@
+class CheckpointAncestry(object):
+    """Index over the tree of checkpoints, to answer ancestor queries in O(log n).
+
+    Each checkpoint keeps jump pointers to its ancestors (binary lifting):
+    self.jumps[h][k] is the hash of the 2^k-th checkpoint ancestor of h.
+    The index is updated incrementally, one checkpoint at a time, and a
+    checkpoint has to be added after its checkpoint parent.
+
+    Once pruned (see `prune`), the jump pointers may point below the new
+    root. They are only followed up to the depth of the ancestor queried,
+    which is in the index, so the queries stay the same.
+
+    Args:
+        root: genesis block
+    """
+    def __init__(self, root):
+        # Map {checkpoint_hash -> number of checkpoints between it and genesis}
+        self.depth = {root.hash: 0}
+        # Map {checkpoint_hash -> list of jump pointers}
+        self.jumps = {root.hash: []}
+        # Map {checkpoint_hash -> list of checkpoint children hashes}
+        self.children = {root.hash: []}
+
+    def __contains__(self, checkpoint_hash):
+        return checkpoint_hash in self.depth
+
+    def add(self, checkpoint_hash, parent_hash):
+        """Adds a checkpoint, given the hash of its checkpoint parent."""
+        jumps = [parent_hash]
+        # The 2^(k+1)-th ancestor is the 2^k-th ancestor of the 2^k-th ancestor
+        while jumps[-1] in self.jumps and len(self.jumps[jumps[-1]]) >= len(jumps):
+            jumps.append(self.jumps[jumps[-1]][len(jumps) - 1])
+        self.jumps[checkpoint_hash] = jumps
+        self.depth[checkpoint_hash] = self.depth[parent_hash] + 1
+        self.children[checkpoint_hash] = []
+        self.children[parent_hash].append(checkpoint_hash)
+
+    def prune(self, keep):
+        """Removes the checkpoints which are not in the set `keep`, a subtree of the index."""
+        for checkpoint_hash in list(self.depth):
+            if checkpoint_hash not in keep:
+                del self.depth[checkpoint_hash]
+                del self.jumps[checkpoint_hash]
+                del self.children[checkpoint_hash]
+
+    def descendants(self, checkpoint_hash):
+        """Returns the hashes of a checkpoint and of all its descendants."""
+        res = [checkpoint_hash]
+        i = 0
+        while i < len(res):
+            res.extend(self.children[res[i]])
+            i += 1
+        return res
+
+    def ancestor(self, checkpoint_hash, depth):
+        """Returns the hash of the ancestor of a checkpoint at a given depth."""
+        distance = self.depth[checkpoint_hash] - depth
+        assert distance >= 0, "No ancestor at depth {}".format(depth)
+        k = 0
+        while distance:
+            if distance & 1:
+                checkpoint_hash = self.jumps[checkpoint_hash][k]
+            distance >>= 1
+            k += 1
+        return checkpoint_hash
+
+    def is_ancestor(self, anc_hash, desc_hash):
+        """Is a given checkpoint an ancestor of another given checkpoint?"""
+        if self.depth[anc_hash] > self.depth[desc_hash]:
+            return False
+        return self.ancestor(desc_hash, self.depth[anc_hash]) == anc_hash
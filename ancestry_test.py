@@ -0,0 +1,31 @@
+"""Test that the checkpoint ancestry index agrees with the reference walk.
+"""
+import random
+
+from block import Block
+from network import Network
+from parameters import *
+from utils import exponential_latency
+from validator import ROOT, VoteValidator
+
+
+def test_is_ancestor_matches_walk():
+    """Build a random tree of blocks with many forks and compare every pair of checkpoints.
+    """
+    network = Network(exponential_latency(AVG_LATENCY))
+    validator = VoteValidator(network, 0)
+
+    blocks = [ROOT]
+    for _ in range(200):
+        # Favor the latest blocks so that the tree gets deep, with some forks
+        parent = blocks[-1 - min(int(random.expovariate(0.5)), len(blocks) - 1)]
+        block = Block(parent, validator.finalized_dynasties)
+        validator.on_receive(block)
+        blocks.append(block)
+
+    checkpoints = [b for b in blocks if b.height % EPOCH_SIZE == 0]
+    assert len(checkpoints) > 10
+    for anc in checkpoints:
+        for desc in checkpoints:
+            assert (validator.is_ancestor(anc, desc) ==
+                    validator.is_ancestor_walk(anc, desc))
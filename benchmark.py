@@ -0,0 +1,285 @@
+"""Benchmarks for the simulator.
+
+Run `python3 benchmark.py run` to run the scenarios of the suite and print
+their results, `python3 benchmark.py run --output baseline.json` to save them
+as a baseline, and `python3 benchmark.py compare baseline.json` to run the
+suite again and flag the regressions against the baseline.
+
+`python3 benchmark.py micro` runs the micro-benchmarks of the fork choice and
+of the memory of the processed objects.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+
+from block import Block
+from network import Network
+from parameters import *
+from rng import SimulationRNG
+from utils import exponential_latency
+from validator import ROOT, VoteValidator
+
+
+# Named scenarios of the suite. Each scenario runs VoteValidators on a Network:
+#     num_validators: number of validators, taken from VALIDATOR_IDS
+#     disconnected: fraction of these validators which are not connected
+#     latency: average latency of the network
+#     num_epochs: number of epochs simulated
+#     batched: if True, use the batched broadcast of the network
+SCENARIOS = {
+    'small': {'num_validators': 100, 'disconnected': 0.0, 'latency': 10,
+              'num_epochs': 10, 'batched': True},
+    'unbatched': {'num_validators': 100, 'disconnected': 0.0, 'latency': 10,
+                  'num_epochs': 10, 'batched': False},
+    'long': {'num_validators': 100, 'disconnected': 0.0, 'latency': 10,
+             'num_epochs': 40, 'batched': True},
+    'high_latency': {'num_validators': 100, 'disconnected': 0.0, 'latency': 100,
+                     'num_epochs': 10, 'batched': True},
+    'very_high_latency': {'num_validators': 100, 'disconnected': 0.0, 'latency': 300,
+                          'num_epochs': 10, 'batched': True},
+    'disconnected': {'num_validators': 100, 'disconnected': 0.3, 'latency': 100,
+                     'num_epochs': 10, 'batched': True},
+    'many_validators': {'num_validators': 200, 'disconnected': 0.0, 'latency': 10,
+                        'num_epochs': 10, 'batched': True},
+}
+
+# Metrics of a scenario, with True if higher is better
+BENCHMARK_METRICS = [
+    ('ticks_per_second', True),
+    ('messages_per_second', True),
+    ('on_receive_per_second', True),
+    ('seconds_per_epoch', False),
+    ('max_seconds_per_epoch', False),
+    ('peak_memory_mb', False),
+]
+
+
+def run_scenario(num_validators, disconnected, latency, num_epochs, batched, seed=0):
+    """Run one scenario and measure its performance.
+
+    The calls to on_receive are counted by wrapping the method of each
+    validator, which is negligible next to the processing of an object.
+
+    Returns:
+        dict {metric -> value}, with the metrics of BENCHMARK_METRICS and
+        the raw counts
+    """
+    rng = SimulationRNG(seed)
+    network = Network(exponential_latency(latency, rng), batched=batched, rng=rng)
+    num_connected = int((1.0 - disconnected) * num_validators)
+    validators = [VoteValidator(network, i) for i in VALIDATOR_IDS[:num_connected]]
+
+    calls = [0]
+    def counting(on_receive):
+        def wrapper(obj):
+            calls[0] += 1
+            return on_receive(obj)
+        return wrapper
+    for val in validators:
+        val.on_receive = counting(val.on_receive)
+
+    epoch_ticks = BLOCK_PROPOSAL_TIME * EPOCH_SIZE
+    epoch_times = []
+    for _ in range(num_epochs):
+        start = time.perf_counter()
+        network.run(epoch_ticks)
+        epoch_times.append(time.perf_counter() - start)
+    total = sum(epoch_times)
+
+    return {
+        'ticks_per_second': network.time / total,
+        'messages_per_second': network.num_delivered / total,
+        'on_receive_per_second': calls[0] / total,
+        'seconds_per_epoch': total / num_epochs,
+        'max_seconds_per_epoch': max(epoch_times),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_memory_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        'wall_time': total,
+        'messages': network.num_delivered,
+        'on_receive_calls': calls[0],
+        'objects': len(network.store),
+    }
+
+
+def run_suite(names=None, repeat=3):
+    """Run the scenarios, each in a fresh worker process so that its peak
+    memory is its own.
+
+    Args:
+        names: names of the scenarios to run (all of them if None)
+        repeat: number of runs of each scenario; the fastest is kept
+
+    Returns:
+        dict {scenario name -> metrics}
+    """
+    results = {}
+    for name in names or sorted(SCENARIOS):
+        best = None
+        for _ in range(repeat):
+            with ProcessPoolExecutor(1) as executor:
+                result = executor.submit(run_scenario, **SCENARIOS[name]).result()
+            if best is None or result['wall_time'] < best['wall_time']:
+                best = result
+        results[name] = best
+        print('{:18s} {:8.0f} ticks/s {:9.0f} msgs/s {:9.0f} on_receive/s '
+              '{:6.3f} s/epoch {:7.1f} MB'.format(
+                  name, best['ticks_per_second'], best['messages_per_second'],
+                  best['on_receive_per_second'], best['seconds_per_epoch'],
+                  best['peak_memory_mb']))
+    return results
+
+
+def save_baseline(results, filename):
+    baseline = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'scenarios': {name: {'parameters': SCENARIOS[name], 'metrics': metrics}
+                      for name, metrics in results.items()},
+    }
+    with open(filename, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+
+
+def compare(baseline, results, tolerance=0.1):
+    """Compare the results of the suite to a baseline.
+
+    Args:
+        baseline: baseline, as written by save_baseline
+        results: dict {scenario name -> metrics}, as returned by run_suite
+        tolerance: relative change allowed before flagging a regression
+
+    Returns:
+        list of (scenario, metric, baseline value, new value) of the regressions
+    """
+    regressions = []
+    for name, metrics in sorted(results.items()):
+        if name not in baseline['scenarios']:
+            print('{}: not in the baseline'.format(name))
+            continue
+        if baseline['scenarios'][name]['parameters'] != SCENARIOS[name]:
+            print('{}: the parameters changed since the baseline'.format(name))
+            continue
+        old_metrics = baseline['scenarios'][name]['metrics']
+        for metric, higher_is_better in BENCHMARK_METRICS:
+            old, new = old_metrics[metric], metrics[metric]
+            change = (new - old) / old
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            print('{:18s} {:22s} {:12.3f} -> {:12.3f} ({:+6.1%}){}'.format(
+                name, metric, old, new, change, '  REGRESSION' if regressed else ''))
+            if regressed:
+                regressions.append((name, metric, old, new))
+    return regressions
+
+
+def build_chain(validator, parent, length):
+    """Feed `length` blocks on top of `parent` to the validator, and return the last one."""
+    for _ in range(length):
+        parent = Block(parent, validator.finalized_dynasties)
+        validator.on_receive(parent)
+    return parent
+
+
+def benchmark_fork_choice(fork_counts, num_heads=1000):
+    """Measure the cost of selecting the head when a block arrives on a fork.
+
+    The validator sees a main chain of two epochs, whose last checkpoint is
+    the highest justified checkpoint, and `num_forks` forks from genesis which
+    each contain one checkpoint. Every block received on a fork makes the
+    validator select the head among the descendants of the highest justified
+    checkpoint.
+    """
+    print('Forks | check_head (us) | scan of the tails (us)')
+    for num_forks in fork_counts:
+        network = Network(exponential_latency(AVG_LATENCY))
+        validator = VoteValidator(network, 0)
+
+        checkpoint = build_chain(validator, ROOT, 2 * EPOCH_SIZE)
+        validator.justified.add(checkpoint.hash)
+        validator.set_highest_justified_checkpoint(checkpoint)
+        for _ in range(num_forks):
+            fork_block = build_chain(validator, ROOT, EPOCH_SIZE)
+
+        start = time.time()
+        for _ in range(num_heads):
+            validator.check_head(fork_block)
+        incremental = (time.time() - start) / num_heads
+        assert validator.head is validator.best_descendant
+
+        start = time.time()
+        for _ in range(num_heads):
+            validator.highest_descendant_scan()
+        scan = (time.time() - start) / num_heads
+
+        print('{:5d} | {:15.2f} | {:22.2f}'.format(num_forks, incremental * 1e6, scan * 1e6))
+
+
+def benchmark_memory(num_epochs=10, validator_set=VALIDATOR_IDS, seed=0):
+    """Measure the peak memory of a simulation, per validator.
+
+    Also compare the memory of the processed objects of the validators, kept
+    as bitsets over the shared store, with the memory of one dict per
+    validator (as before the shared store).
+    """
+    tracemalloc.start()
+    rng = SimulationRNG(seed)
+    network = Network(exponential_latency(AVG_LATENCY, rng), rng=rng)
+    validators = [VoteValidator(network, i) for i in validator_set]
+    network.run(BLOCK_PROPOSAL_TIME * EPOCH_SIZE * num_epochs)
+    peak = tracemalloc.get_traced_memory()[1]
+
+    bitsets = sum(sys.getsizeof(val.processed.bits) for val in validators)
+    before = tracemalloc.get_traced_memory()[0]
+    dicts = [(dict(val.processed.items()), dict(val.tail_membership)) for val in validators]
+    dicts_size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    print('Validators: {}, epochs: {}, objects in the store: {}'.format(
+        len(validators), num_epochs, len(network.store)))
+    print('Peak memory per validator: {:.1f} KB'.format(peak / len(validators) / 1024))
+    print('Processed objects per validator: {:.1f} KB as bitsets, {:.1f} KB as dicts'.format(
+        bitsets / len(validators) / 1024, dicts_size / len(validators) / 1024))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command')
+    run_parser = subparsers.add_parser('run', help='run the suite')
+    run_parser.add_argument('--output', help='save the results as a JSON baseline')
+    compare_parser = subparsers.add_parser('compare', help='run the suite and compare it to a baseline')
+    compare_parser.add_argument('baseline', help='JSON baseline written by `run --output`')
+    compare_parser.add_argument('--tolerance', type=float, default=0.1,
+                                help='relative change flagged as a regression (default: 0.1)')
+    for sub in [run_parser, compare_parser]:
+        sub.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS),
+                         help='scenarios to run (default: all)')
+        sub.add_argument('--repeat', type=int, default=3,
+                         help='runs of each scenario, the fastest is kept (default: 3)')
+    subparsers.add_parser('micro', help='run the micro-benchmarks')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = run_suite(args.scenarios, args.repeat)
+        if args.output:
+            save_baseline(results, args.output)
+    elif args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        results = run_suite(args.scenarios, args.repeat)
+        print('')
+        regressions = compare(baseline, results, args.tolerance)
+        print('')
+        print('{} regression(s)'.format(len(regressions)))
+        sys.exit(1 if regressions else 0)
+    elif args.command == 'micro':
+        benchmark_fork_choice([1, 10, 100, 1000])
+        print('')
+        benchmark_memory()
+    else:
+        parser.print_help()
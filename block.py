@@ -1,18 +1,21 @@
-import random
+import weakref
 
-from parameters import *
+from rng import DEFAULT_RNG
 
 
 class Block():
     """One node (roundrobin) adds a new block to the blockchain every
-    BLOCK_PROPOSAL_TIME iterations.
+    block_proposal_time iterations.
 
     Args:
         parent: parent block
         finalized_dynasties: dynasties which have been finalized.
                              Only a committed block's dynasty becomes finalized.
+        rng: SimulationRNG of the simulation (DEFAULT_RNG if None)
+        scenario: Scenario of a genesis block (scenario.DEFAULT_SCENARIO if
+                  None). The other blocks have the scenario of their parent.
     """
-    def __init__(self, parent=None, finalized_dynasties=None):
+    def __init__(self, parent=None, finalized_dynasties=None, rng=None, scenario=None):
         """A block contains the following arguments:
 
         self.hash: hash of the block
@@ -21,23 +24,32 @@ class Block():
         self.prev_dynasty: previous dynasty (2/3 have to commit)
         self.current_dynasty: current dynasty (2/3 have to commit)
         self.next_dynasty: next dynasty
+        self.scenario: parameters of the simulation
 
         The block needs to be signed by both the previous and current dynasties.
         The next dynasty is decided at this block so that it is public.
         """
-        self.hash = random.randint(1, 10**30)
+        rng = rng or DEFAULT_RNG
         # If we are genesis block, set initial values
         if not parent:
+            self.hash = rng.genesis_hash()
+            if scenario is None:
+                # Imported here since scenario.py creates genesis blocks
+                from scenario import DEFAULT_SCENARIO
+                scenario = DEFAULT_SCENARIO
+            self.scenario = scenario
             self.height = 0
             self.prev_hash = 0
-            self.prev_dynasty = self.current_dynasty = Dynasty(INITIAL_VALIDATORS)
-            self.next_dynasty = self.generate_next_dynasty(self.current_dynasty.id)
+            self.prev_dynasty = self.current_dynasty = Dynasty(scenario.initial_validators)
+            self.next_dynasty = self.generate_next_dynasty(self.current_dynasty.id, rng)
             return
+        self.hash = rng.block_hash.randint(1, 10**30)
+        self.scenario = parent.scenario
         # Set our block height and our prev_hash
         self.height = parent.height + 1
         self.prev_hash = parent.hash
         # Generate a random next dynasty
-        self.next_dynasty = self.generate_next_dynasty(parent.current_dynasty.id)
+        self.next_dynasty = self.generate_next_dynasty(parent.current_dynasty.id, rng)
         # If the current_dynasty was finalized, we advance to the next dynasty
         if parent.current_dynasty in finalized_dynasties:
             self.prev_dynasty = parent.current_dynasty
@@ -49,34 +61,58 @@ class Block():
 
     @property
     def epoch(self):
-        return self.height // EPOCH_SIZE
+        return self.height // self.scenario.epoch_size
 
-    def generate_next_dynasty(self, prev_dynasty_id):
-        # Fix the seed so that every validator can generate the same dynasty
-        random.seed(self.hash)
-        next_dynasty = Dynasty(random.sample(VALIDATOR_IDS, NUM_VALIDATORS), prev_dynasty_id + 1)
+    def generate_next_dynasty(self, prev_dynasty_id, rng):
+        # Use a generator keyed by the block hash so that every validator can
+        # generate the same dynasty
+        dynasty_rng = rng.dynasty(self.hash)
+        return Dynasty(dynasty_rng.sample(self.scenario.validator_ids, self.scenario.num_validators),
+                       prev_dynasty_id + 1)
 
-        # Remove the seed for other operations
-        random.seed()
-        return next_dynasty
 
-
-class Dynasty():
+class Dynasty(object):
     """A Dynasty is a certain set of validators.
 
     It will represent the set of valid validators for a certain block.
 
+    Dynasties are immutable and interned: creating a dynasty with the same id
+    and set of validators as a live one returns the same object, so all the
+    blocks sharing a dynasty share one object. The hash is computed once.
+
     Args:
         validators: set of validators in the dynasty
         id: id of the dynasty
     """
-    def __init__(self, validators, id_=0):
-        self.validators = validators
-        self.id = id_
+    __slots__ = ('validators', 'id', '_hash', '__weakref__')
+
+    # Map {(id, validators) -> Dynasty} of the live dynasties
+    _interned = weakref.WeakValueDictionary()
+
+    def __new__(cls, validators, id_=0):
+        # frozenset for O(1) membership tests
+        validators = frozenset(validators)
+        key = (id_, validators)
+        dynasty = cls._interned.get(key)
+        if dynasty is None:
+            dynasty = super(Dynasty, cls).__new__(cls)
+            object.__setattr__(dynasty, 'validators', validators)
+            object.__setattr__(dynasty, 'id', id_)
+            object.__setattr__(dynasty, '_hash', hash(key))
+            cls._interned[key] = dynasty
+        return dynasty
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Dynasty is immutable")
+
+    def __reduce__(self):
+        # Go through __new__ when unpickling, to intern the dynasty again
+        return (Dynasty, (sorted(self.validators), self.id))
 
     def __hash__(self):
-        return hash(str(self.id) + str(self.validators))
+        return self._hash
 
     def __eq__(self, other):
-        return (str(self.id) + str(self.validators)) == \
-               (str(other.id) + str(other.validators))
+        return self is other or (isinstance(other, Dynasty) and
+                                 self.id == other.id and
+                                 self.validators == other.validators)
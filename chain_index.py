@@ -0,0 +1,174 @@
+class ChainIndex(object):
+    """Typed indexes over the blocks and votes processed by a validator.
+
+    self.processed mixes the blocks and the votes, keyed by random hashes, so
+    any question about the chain would need a scan of every object. The
+    index answers them in O(size of the result) instead:
+    self.blocks_by_height: map {height -> list of blocks}
+    self.checkpoints_by_epoch: map {epoch -> list of checkpoints}
+    self.children: map {block hash -> list of child blocks}
+    self.votes_by_link: map {(source hash, target hash) -> list of votes}
+    self.height_counts: Fenwick tree of the number of blocks by height, so
+        that the number of blocks up to a height is a running prefix count
+
+    The index is updated by VoteValidator.accept_block and accept_vote, and
+    pruned with the history of the validator (see `prune`). The fork choice
+    (VoteValidator.set_highest_justified_checkpoint) and the vote tallies of
+    accept_vote query it.
+
+    Args:
+        root: genesis block
+    """
+    def __init__(self, root):
+        self.blocks_by_height = {0: [root]}
+        self.checkpoints_by_epoch = {0: [root]}
+        self.children = {root.hash: []}
+        self.votes_by_link = {}
+        self.num_blocks = 1
+        self.num_votes = 0
+        self.height_counts = [0] * 16
+        self.add_height_count(0, 1)
+
+    def add_block(self, block, is_checkpoint, parent_hash=None):
+        """Adds a block, once its parent is in the index.
+
+        Args:
+            block: block accepted
+            is_checkpoint: whether the block is a checkpoint
+            parent_hash: hash of the parent of the block in the index
+                (block.prev_hash if None). The light validators only index
+                the checkpoints, under their checkpoint parent.
+        """
+        if block.height in self.blocks_by_height:
+            self.blocks_by_height[block.height].append(block)
+        else:
+            self.blocks_by_height[block.height] = [block]
+        if is_checkpoint:
+            if block.epoch in self.checkpoints_by_epoch:
+                self.checkpoints_by_epoch[block.epoch].append(block)
+            else:
+                self.checkpoints_by_epoch[block.epoch] = [block]
+        self.children[block.hash] = []
+        self.children[block.prev_hash if parent_hash is None else parent_hash].append(block)
+        self.num_blocks += 1
+        self.add_height_count(block.height, 1)
+
+    def add_vote(self, vote):
+        """Adds a vote which was accepted.
+
+        Returns:
+            the number of votes accepted for the link of the vote
+        """
+        link = (vote.source, vote.target)
+        if link in self.votes_by_link:
+            self.votes_by_link[link].append(vote)
+        else:
+            self.votes_by_link[link] = [vote]
+        self.num_votes += 1
+        return len(self.votes_by_link[link])
+
+    def add_height_count(self, height, delta):
+        # Fenwick tree over the heights, 1-indexed, doubled when a block is
+        # higher than its capacity
+        i = height + 1
+        if i >= len(self.height_counts):
+            self.rebuild_height_counts(2 * i)
+            return
+        counts = self.height_counts
+        while i < len(counts):
+            counts[i] += delta
+            i += i & -i
+
+    def rebuild_height_counts(self, size):
+        counts = [0] * size
+        for height, blocks in self.blocks_by_height.items():
+            counts[height + 1] += len(blocks)
+        for i in range(1, size):
+            parent = i + (i & -i)
+            if parent < size:
+                counts[parent] += counts[i]
+        self.height_counts = counts
+
+    # Queries
+
+    def blocks_at(self, height):
+        """Returns the blocks at a height."""
+        return self.blocks_by_height.get(height, [])
+
+    def checkpoints_at(self, epoch):
+        """Returns the checkpoints of an epoch."""
+        return self.checkpoints_by_epoch.get(epoch, [])
+
+    def children_of(self, block_hash):
+        """Returns the child blocks of a block."""
+        return self.children.get(block_hash, [])
+
+    def votes_for(self, source, target):
+        """Returns the votes accepted for the link (source -> target), given their hashes."""
+        return self.votes_by_link.get((source, target), [])
+
+    def vote_count(self):
+        """Returns the number of votes accepted by link, as a map
+        {source hash -> {target hash -> count}}."""
+        count = {}
+        for (source, target), votes in self.votes_by_link.items():
+            count.setdefault(source, {})[target] = len(votes)
+        return count
+
+    def heights(self):
+        """Returns the heights with blocks, in increasing order."""
+        return sorted(self.blocks_by_height)
+
+    def epochs(self):
+        """Returns the epochs with checkpoints, in increasing order."""
+        return sorted(self.checkpoints_by_epoch)
+
+    def count_blocks(self, max_height):
+        """Returns the number of blocks at a height lower or equal to `max_height`,
+        in O(log(number of heights))."""
+        counts = self.height_counts
+        i = min(max_height + 1, len(counts) - 1)
+        total = 0
+        while i > 0:
+            total += counts[i]
+            i -= i & -i
+        return total
+
+    def highest_descendant(self, block):
+        """Returns the highest block of the subtree of `block` (the first one
+        found, breadth first, if there are several)."""
+        best = block
+        queue = [block]
+        i = 0
+        while i < len(queue):
+            for child in self.children[queue[i].hash]:
+                if child.height > best.height:
+                    best = child
+                queue.append(child)
+            i += 1
+        return best
+
+    def prune(self, keep_block, keep_checkpoint):
+        """Removes the blocks and the votes which are not kept.
+
+        Args:
+            keep_block: function returning True for the blocks to keep
+            keep_checkpoint: function returning True for the hashes of the
+                checkpoints to keep. A vote is kept if its source and target
+                are kept.
+        """
+        for index in [self.blocks_by_height, self.checkpoints_by_epoch]:
+            for key in list(index):
+                blocks = [block for block in index[key] if keep_block(block)]
+                if blocks:
+                    index[key] = blocks
+                else:
+                    del index[key]
+        kept = set(block.hash for blocks in self.blocks_by_height.values() for block in blocks)
+        self.num_blocks = len(kept)
+        self.rebuild_height_counts(len(self.height_counts))
+        self.children = {block_hash: [child for child in children if child.hash in kept]
+                         for block_hash, children in self.children.items() if block_hash in kept}
+        self.votes_by_link = {link: votes for link, votes in self.votes_by_link.items()
+                              if keep_checkpoint(link[0]) and keep_checkpoint(link[1])}
+        self.num_votes = sum(len(votes) for votes in self.votes_by_link.values())
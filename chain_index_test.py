@@ -0,0 +1,49 @@
+"""Test the typed indexes of the validators against scans of the processed objects."""
+
+from block import Block
+from message import Vote
+from network import Network
+from parameters import *
+from rng import SimulationRNG
+from utils import exponential_latency
+from validator import VoteValidator
+
+NUM_EPOCHS = 8
+
+
+def check_index(validator):
+    blocks = [obj for obj in validator.processed.values() if isinstance(obj, Block)]
+    index = validator.index
+    assert index.num_blocks == len(blocks)
+    for height in index.heights():
+        assert (sorted(b.hash for b in index.blocks_at(height)) ==
+                sorted(b.hash for b in blocks if b.height == height))
+    for epoch in index.epochs():
+        assert (sorted(b.hash for b in index.checkpoints_at(epoch)) ==
+                sorted(b.hash for b in blocks if b.height == epoch * EPOCH_SIZE))
+    for block in blocks:
+        assert (sorted(b.hash for b in index.children_of(block.hash)) ==
+                sorted(b.hash for b in blocks if b.prev_hash == block.hash))
+    for max_height in range(-1, max(b.height for b in blocks) + 2):
+        assert index.count_blocks(max_height) == sum(b.height <= max_height for b in blocks)
+
+    votes = [obj for obj in validator.processed.values() if isinstance(obj, Vote)]
+    for vote in votes:
+        assert vote in index.votes_for(vote.source, vote.target)
+    assert index.num_votes == len(votes)
+    assert sum(sum(targets.values()) for targets in validator.vote_count.values()) == len(votes)
+
+    # The fork choice through the children finds a block as high as the scan of the tails
+    assert validator.best_descendant.height == validator.highest_descendant_scan().height
+    assert validator.is_ancestor(validator.highest_justified_checkpoint,
+                                 validator.tail_membership[validator.best_descendant.hash])
+
+
+def test_index_matches_scans():
+    for prune_lag in [None, 1]:
+        rng = SimulationRNG(1)
+        network = Network(exponential_latency(AVG_LATENCY, rng), batched=True, rng=rng)
+        validators = [VoteValidator(network, i, prune_lag) for i in VALIDATOR_IDS]
+        network.run(BLOCK_PROPOSAL_TIME * EPOCH_SIZE * NUM_EPOCHS)
+        for validator in validators[:5]:
+            check_index(validator)
@@ -0,0 +1,436 @@
+"""Online metrics, maintained from the events of the simulation.
+
+The functions of metrics.py walk the chain of each validator once the
+simulation is over. OnlineMetrics listens to the events emitted by
+the network and the validators instead, and keeps running counters, so that
+the metrics are available at any tick without scanning anything.
+"""
+
+
+class NetworkListener(object):
+    """Base class for the listeners of a Network (see Network.emit).
+
+    Every event is a method, which does nothing by default.
+    """
+
+    def epoch_started(self, epoch):
+        """The network starts the first tick of `epoch`."""
+        pass
+
+    def block_accepted(self, validator, block):
+        """The validator processed a block, whose parent it already had."""
+        pass
+
+    def checkpoint_justified(self, validator, checkpoint):
+        """A checkpoint is justified for the first time for the validator."""
+        pass
+
+    def checkpoint_finalized(self, validator, checkpoint):
+        """A checkpoint is finalized for the first time for the validator."""
+        pass
+
+    def head_reorg(self, validator, old_head, new_head):
+        """The head of the validator moved to a block which is not a child of its old head."""
+        pass
+
+    def history_pruned(self, validator, horizon):
+        """The validator is about to drop its history below the checkpoint `horizon`
+        (see VoteValidator.prune)."""
+        pass
+
+
+def reorg_depth(validator, old_head, new_head):
+    """Number of blocks of the chain of `old_head` which are not in the chain of `new_head`."""
+    # Walk back from both heads to their common ancestor
+    old_block, new_block = old_head, new_head
+    while old_block.hash != new_block.hash:
+        if old_block.height >= new_block.height:
+            old_block = validator.get_parent(old_block)
+        else:
+            new_block = validator.get_parent(new_block)
+    return old_head.height - old_block.height
+
+
+class ValidatorMetrics(object):
+    """Running counters of one validator.
+
+    self.main_chain: set of the checkpoints from the highest justified
+        checkpoint back to genesis
+    self.count_justified, self.count_finalized: number of justified and
+        finalized checkpoints in self.main_chain
+    self.blocks_by_height: map {height -> number of blocks processed}
+    self.blocks_under: number of blocks processed with a height lower or
+        equal to the highest justified checkpoint
+    self.reorg_depths: map {depth -> number of reorgs}, where the depth of a
+        reorg is the number of blocks of the old head which left the chain
+    self.main_blocks: set of the blocks from the highest justified
+        checkpoint back to genesis (or to the horizon of the validator)
+    self.longest_fork: map {block of self.main_blocks -> length of its
+        longest fork}, for the blocks with forks, as in metrics.count_forks.
+        Only the blocks with a height lower or equal to the highest
+        justified checkpoint count.
+    self.fork_counts: map {length of the longest fork -> number of blocks of
+        the main chain}, without the blocks with no fork
+    self.num_pruned, self.pruned_justified, self.pruned_finalized: number of
+        checkpoints of the main chain below the horizon of a validator which
+        prunes its history, and how many of them are justified and finalized.
+        These checkpoints are counted, but not in self.main_chain.
+
+    The counters start from the current state of the validator, so the
+    collector can be attached at any time (before the validator prunes its
+    history).
+    """
+    def __init__(self, validator):
+        self.highest_justified = validator.highest_justified_checkpoint
+        self.main_chain = set()
+        self.count_justified = 0
+        self.count_finalized = 0
+        self.num_pruned = 0
+        self.pruned_justified = 0
+        self.pruned_finalized = 0
+        self.num_pruned_blocks = 0
+        self.rebuild_main_chain(validator)
+        self.main_blocks = set()
+        self.longest_fork = {}
+        self.fork_counts = {}
+        self.rebuild_forks(validator)
+
+        self.num_blocks = validator.index.num_blocks
+        self.blocks_by_height = {height: len(blocks) for height, blocks
+                                 in validator.index.blocks_by_height.items()}
+        self.blocks_under = validator.index.count_blocks(self.highest_justified.height)
+
+        self.num_reorgs = 0
+        self.reorg_depths = {}
+
+    def count_checkpoint(self, validator, checkpoint_hash):
+        self.main_chain.add(checkpoint_hash)
+        if checkpoint_hash in validator.justified:
+            self.count_justified += 1
+        if checkpoint_hash in validator.finalized:
+            self.count_finalized += 1
+
+    def rebuild_main_chain(self, validator):
+        """Recounts the main chain from the highest justified checkpoint to
+        genesis, or to the horizon of the validator."""
+        self.main_chain = set()
+        self.count_justified = self.pruned_justified
+        self.count_finalized = self.pruned_finalized
+        checkpoint = self.highest_justified
+        while True:
+            self.count_checkpoint(validator, checkpoint.hash)
+            if checkpoint.hash == validator.horizon.hash:
+                break
+            checkpoint = validator.get_checkpoint_parent(checkpoint)
+
+    def count_fork(self, validator, block):
+        """Counts a block off the main chain in the longest fork of its branch point."""
+        branch = block
+        while branch.hash not in self.main_blocks:
+            branch = validator.get_parent(branch)
+        length = block.height - branch.height
+        old_length = self.longest_fork.get(branch.hash, 0)
+        if length > old_length:
+            self.longest_fork[branch.hash] = length
+            if old_length:
+                self.fork_counts[old_length] -= 1
+            self.fork_counts[length] = self.fork_counts.get(length, 0) + 1
+
+    def extend_main_blocks(self, validator, block, stop_hash):
+        """Adds the blocks from `block` down to the block `stop_hash` (excluded) to the main chain."""
+        while block is not None and block.hash != stop_hash:
+            self.main_blocks.add(block.hash)
+            if block.hash == validator.horizon.hash:
+                break
+            block = validator.get_parent(block) if block.height else None
+
+    def rebuild_forks(self, validator):
+        """Recounts the forks of the main chain, above the horizon of the validator."""
+        for length in self.longest_fork.values():
+            self.fork_counts[length] -= 1
+        self.main_blocks = set()
+        self.longest_fork = {}
+        self.extend_main_blocks(validator, self.highest_justified, None)
+        for height in validator.index.heights():
+            if height > self.highest_justified.height:
+                break
+            for block in validator.index.blocks_at(height):
+                if block.hash not in self.main_blocks:
+                    self.count_fork(validator, block)
+
+    def prune(self, validator, horizon):
+        """Moves the checkpoints of the main chain below the horizon to the pruned counters."""
+        self.sync(validator)
+        # The blocks of the main chain below the horizon keep their forks in
+        # self.fork_counts, and can't get new ones
+        block = horizon
+        while block.hash != validator.horizon.hash:
+            block = validator.get_parent(block)
+            self.main_blocks.discard(block.hash)
+            self.longest_fork.pop(block.hash, None)
+            self.num_pruned_blocks += 1
+        checkpoint = horizon
+        while checkpoint.hash != validator.horizon.hash:
+            checkpoint = validator.get_checkpoint_parent(checkpoint)
+            self.main_chain.discard(checkpoint.hash)
+            self.num_pruned += 1
+            if checkpoint.hash in validator.justified:
+                self.pruned_justified += 1
+            if checkpoint.hash in validator.finalized:
+                self.pruned_finalized += 1
+        # The blocks at these heights are already counted in self.blocks_under
+        for height in list(self.blocks_by_height):
+            if height <= horizon.height:
+                del self.blocks_by_height[height]
+
+    def sync(self, validator):
+        """Follows the highest justified checkpoint of the validator.
+
+        When the new highest justified checkpoint descends from the old one,
+        only the checkpoints in between are counted. Otherwise, the main chain
+        is counted again from genesis.
+
+        Returns:
+            set of the checkpoints added to the main chain, whose state is
+            already counted
+        """
+        old = self.highest_justified
+        new = validator.highest_justified_checkpoint
+        if new is old:
+            return ()
+
+        # The highest justified checkpoint only moves up: count the blocks
+        # between the old and the new height
+        for height in range(old.height + 1, new.height + 1):
+            self.blocks_under += self.blocks_by_height.get(height, 0)
+
+        self.highest_justified = new
+        if validator.is_ancestor(old, new):
+            # The blocks between the old and the new height are now under the
+            # highest justified checkpoint
+            self.extend_main_blocks(validator, new, old.hash)
+            for height in range(old.height + 1, new.height + 1):
+                for block in validator.index.blocks_at(height):
+                    if block.hash not in self.main_blocks:
+                        self.count_fork(validator, block)
+            added = set()
+            checkpoint = new
+            while checkpoint.hash != old.hash:
+                added.add(checkpoint.hash)
+                self.count_checkpoint(validator, checkpoint.hash)
+                checkpoint = validator.get_checkpoint_parent(checkpoint)
+            return added
+        self.rebuild_main_chain(validator)
+        self.rebuild_forks(validator)
+        return self.main_chain
+
+    def count_forks(self):
+        """Returns a dict {length of the longest fork -> number of blocks of the main chain}."""
+        counts = {length: count for length, count in self.fork_counts.items() if count}
+        no_fork = len(self.main_blocks) + self.num_pruned_blocks - sum(counts.values())
+        if no_fork:
+            counts[0] = no_fork
+        return counts
+
+
+class OnlineMetrics(NetworkListener):
+    """Collects the metrics of every validator of a network, as events happen.
+
+    The queries have the same names and results as the functions of
+    metrics.py, and take O(1) per validator.
+
+    self.series: list of the summaries at the start of each epoch (see
+        `summary`), with their epoch
+
+    Args:
+        network: network to listen to, once its validators are connected
+    """
+    def __init__(self, network):
+        self.network = network
+        self.states = {}
+        for validator in network.nodes:
+            self.states[validator.id] = ValidatorMetrics(validator)
+        self.series = []
+        network.listeners.append(self)
+
+    def state(self, validator):
+        return self.states[validator.id]
+
+    # Events
+
+    def epoch_started(self, epoch):
+        summary = self.summary()
+        summary['epoch'] = epoch
+        self.series.append(summary)
+
+    def block_accepted(self, validator, block):
+        state = self.state(validator)
+        state.sync(validator)
+        state.num_blocks += 1
+        state.blocks_by_height[block.height] = state.blocks_by_height.get(block.height, 0) + 1
+        if block.height <= state.highest_justified.height:
+            state.blocks_under += 1
+            # The blocks of the main chain were all accepted before
+            state.count_fork(validator, block)
+
+    def checkpoint_justified(self, validator, checkpoint):
+        state = self.state(validator)
+        added = state.sync(validator)
+        if checkpoint.hash in state.main_chain and checkpoint.hash not in added:
+            state.count_justified += 1
+
+    def checkpoint_finalized(self, validator, checkpoint):
+        state = self.state(validator)
+        added = state.sync(validator)
+        if checkpoint.hash in state.main_chain and checkpoint.hash not in added:
+            state.count_finalized += 1
+
+    def head_reorg(self, validator, old_head, new_head):
+        state = self.state(validator)
+        depth = reorg_depth(validator, old_head, new_head)
+        state.num_reorgs += 1
+        state.reorg_depths[depth] = state.reorg_depths.get(depth, 0) + 1
+
+    def history_pruned(self, validator, horizon):
+        self.state(validator).prune(validator, horizon)
+
+    # Queries
+
+    def fraction_justified_and_finalized(self, validator):
+        """Same as metrics.fraction_justified_and_finalized."""
+        state = self.state(validator)
+        state.sync(validator)
+        count_total = float(len(state.main_chain) + state.num_pruned)
+        count_forked_justified = (len(validator.justified) + validator.num_pruned_justified -
+                                  state.count_justified)
+        return (state.count_justified / count_total,
+                state.count_finalized / count_total,
+                count_forked_justified / count_total)
+
+    def main_chain_size(self, validator):
+        """Same as metrics.main_chain_size."""
+        return validator.highest_justified_checkpoint.height + 1
+
+    def blocks_under_highest_justified(self, validator):
+        """Same as metrics.blocks_under_highest_justified."""
+        state = self.state(validator)
+        state.sync(validator)
+        return state.blocks_under
+
+    def total_height_blocks(self, validator):
+        """Same as metrics.total_height_blocks."""
+        return self.state(validator).num_blocks
+
+    def reorg_depths(self, validator):
+        """Returns a dict {depth of the reorg -> number of reorgs} for the validator."""
+        return dict(self.state(validator).reorg_depths)
+
+    def validator_summary(self, validator):
+        """Returns the metrics of one validator, to be averaged by `summarize`."""
+        jf, ff, jff = self.fraction_justified_and_finalized(validator)
+        return {
+            'justified': jf,
+            'finalized': ff,
+            'justified_in_forks': jff,
+            'main_chain_size': self.main_chain_size(validator),
+            'blocks_under_main_justified': self.blocks_under_highest_justified(validator),
+            'reorgs': self.state(validator).num_reorgs,
+        }
+
+    def summary(self):
+        """Returns the metrics averaged over the validators of the network.
+
+        Returns:
+            dict {metric name -> value}, with the keys of metrics.run_simulation
+            (except main_chain_fraction) and the number of reorgs per validator
+        """
+        return summarize([self.validator_summary(val) for val in self.network.nodes])
+
+    def count_forks(self, validator):
+        """Same as metrics.count_forks."""
+        state = self.state(validator)
+        state.sync(validator)
+        return state.count_forks()
+
+    def fork_histogram(self):
+        """Returns a dict {length of the longest fork -> number of blocks of the
+        main chain} over all the validators."""
+        histogram = {}
+        for validator in self.network.nodes:
+            for length, count in self.count_forks(validator).items():
+                histogram[length] = histogram.get(length, 0) + count
+        return histogram
+
+    def reorg_histogram(self):
+        """Returns a dict {depth of the reorg -> number of reorgs} over all the validators."""
+        histogram = {}
+        for state in self.states.values():
+            for depth, count in state.reorg_depths.items():
+                histogram[depth] = histogram.get(depth, 0) + count
+        return histogram
+
+
+def summarize(rows):
+    """Averages the metrics of the validators (see OnlineMetrics.validator_summary).
+
+    The rows are summed in order, so the same rows give the same floats
+    whichever process computed them (see parallel.py).
+    """
+    jfsum = 0.0
+    ffsum = 0.0
+    jffsum = 0.0
+    mcsum = 0.0
+    busum = 0.0
+    reorgs = 0
+    for row in rows:
+        jfsum += row['justified']
+        ffsum += row['finalized']
+        jffsum += row['justified_in_forks']
+        mcsum += row['main_chain_size']
+        busum += row['blocks_under_main_justified']
+        reorgs += row['reorgs']
+
+    return {
+        'justified': jfsum / len(rows),
+        'finalized': ffsum / len(rows),
+        'justified_in_forks': jffsum / len(rows),
+        'main_chain_size': mcsum / len(rows),
+        'blocks_under_main_justified': busum / len(rows),
+        'reorgs': float(reorgs) / len(rows),
+    }
+
+
+class FinalityDelay(NetworkListener):
+    """Measures how long after its proposal a checkpoint is justified and
+    finalized by the validators.
+
+    The proposal time of a checkpoint is the first time a validator accepts
+    it, which is when its proposer creates it.
+
+    Args:
+        network: network to listen to
+    """
+    def __init__(self, network):
+        self.network = network
+        # Map {checkpoint hash -> time of its proposal}
+        self.proposed = {}
+        # Delays of every (validator, checkpoint) justified or finalized
+        self.justification_delays = []
+        self.finalization_delays = []
+        network.listeners.append(self)
+
+    def block_accepted(self, validator, block):
+        if block.height % validator.scenario.epoch_size == 0 and block.hash not in self.proposed:
+            self.proposed[block.hash] = self.network.time
+
+    def checkpoint_justified(self, validator, checkpoint):
+        self.justification_delays.append(self.network.time - self.proposed[checkpoint.hash])
+
+    def checkpoint_finalized(self, validator, checkpoint):
+        self.finalization_delays.append(self.network.time - self.proposed[checkpoint.hash])
+
+    def mean_delays(self):
+        """Returns the mean delays (in ticks) of justification and finalization."""
+        def mean(values):
+            return float(sum(values)) / len(values) if values else float('nan')
+        return mean(self.justification_delays), mean(self.finalization_delays)
@@ -0,0 +1,53 @@
+"""Test that the online metrics match the scans of metrics.py."""
+
+from collector import OnlineMetrics
+import metrics
+from network import Network
+from parameters import *
+from rng import SimulationRNG
+from scenario import Scenario
+from utils import exponential_latency
+from validator import VoteValidator
+
+NUM_EPOCHS = 3
+
+
+def test_online_metrics_match_scans():
+    rng = SimulationRNG(4)
+    network = Network(exponential_latency(AVG_LATENCY, rng), batched=True, rng=rng)
+    validators = [VoteValidator(network, i) for i in VALIDATOR_IDS]
+    collector = OnlineMetrics(network)
+    network.run(BLOCK_PROPOSAL_TIME * EPOCH_SIZE * NUM_EPOCHS)
+
+    for val in validators:
+        assert (collector.fraction_justified_and_finalized(val) ==
+                metrics.fraction_justified_and_finalized(val))
+        assert collector.main_chain_size(val) == metrics.main_chain_size(val)
+        assert (collector.blocks_under_highest_justified(val) ==
+                metrics.blocks_under_highest_justified(val))
+        assert collector.total_height_blocks(val) == metrics.total_height_blocks(val)
+        assert collector.count_forks(val) == metrics.count_forks(val)
+
+    # One summary per epoch started (the first tick of epoch 0 included)
+    assert [s['epoch'] for s in collector.series] == list(range(NUM_EPOCHS))
+
+
+def test_fork_counts_match_scan():
+    # Blocks every 10 ticks with a latency of 30: forks, and reorgs of the
+    # highest justified checkpoint
+    scenario = Scenario(num_validators=8, epoch_size=5, block_proposal_time=10, genesis_seed=2)
+    rng = SimulationRNG(0)
+    network = Network(exponential_latency(30, rng), batched=True, rng=rng, scenario=scenario)
+    validators = [VoteValidator(network, i) for i in scenario.validator_ids]
+    collector = OnlineMetrics(network)
+    network.run(scenario.epoch_ticks * 6)
+    # A collector attached during the simulation counts the forks so far
+    late_collector = OnlineMetrics(network)
+    network.run(scenario.epoch_ticks * 6)
+
+    for val in validators:
+        assert collector.count_forks(val) == metrics.count_forks(val)
+        assert late_collector.count_forks(val) == metrics.count_forks(val)
+    histogram = collector.fork_histogram()
+    assert max(histogram) > 1
+    assert sum(histogram.values()) == sum(metrics.main_chain_size(val) for val in validators)
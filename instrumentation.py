@@ -0,0 +1,254 @@
+"""Opt-in instrumentation of the hot paths of the simulation.
+
+Instrumentation wraps the methods of one network and of its validators on
+the instances themselves, so the classes are untouched and a simulation
+without instrumentation runs exactly the same code as before.
+
+Example:
+    instrumentation = Instrumentation(network)
+    network.run(num_ticks)
+    instrumentation.finish()
+    instrumentation.write_csv('report.csv')
+"""
+
+import csv
+import cProfile
+import json
+import pstats
+import time
+
+from collector import NetworkListener, reorg_depth
+
+
+def new_counters(epoch):
+    """Counters of one epoch."""
+    return {
+        'epoch': epoch,
+        'wall_time': 0.0,
+        # Network.broadcast
+        'broadcasts': 0,
+        'broadcast_time': 0.0,
+        # Network.deliver: number of messages delivered at each tick with deliveries
+        'delivery_ticks': 0,
+        'delivered': 0,
+        'max_batch': 0,
+        # Messages in flight in msg_arrivals, when a tick is delivered
+        'max_queue_depth': 0,
+        'max_arrival_times': 0,
+        # Validator.on_receive, by type of message
+        'on_receive': {},
+        'on_receive_time': {},
+        # Validator.is_ancestor: number of checkpoints between the two
+        # checkpoints (the length of a walk from one to the other)
+        'is_ancestor_calls': 0,
+        'is_ancestor_distance': 0,
+        'max_is_ancestor_distance': 0,
+        # Reorgs of the head (see VoteValidator.check_head)
+        'reorgs': 0,
+        'max_reorg_depth': 0,
+        # Objects waiting in self.dependencies and self.pending_votes, at the
+        # end of the epoch
+        'mean_dependencies': 0.0,
+        'max_dependencies': 0,
+        'mean_pending_votes': 0.0,
+    }
+
+
+def num_receivers(network, entry):
+    """Returns the number of receivers of an entry of network.msg_arrivals.
+
+    The batched networks schedule an array of receivers in the entry before
+    the message, the others one receiver per entry.
+    """
+    if network.batched:
+        return len(entry[-2])
+    return 1
+
+
+class Instrumentation(NetworkListener):
+    """Counters and timers of a network and its validators, reported per epoch.
+
+    self.reports: list of the counters of the epochs which are over
+
+    Args:
+        network: network to instrument, once its validators are connected
+    """
+    def __init__(self, network):
+        self.network = network
+        self.reports = []
+        self.counters = new_counters(network.time // network.scenario.epoch_ticks)
+        self.epoch_start = time.perf_counter()
+        # Messages scheduled and not delivered yet
+        self.queue_depth = self.count_in_flight()
+
+        self.wrap(network, 'broadcast', self.wrap_broadcast)
+        self.wrap(network, 'add_arrival', self.wrap_add_arrival)
+        self.wrap(network, 'deliver', self.wrap_deliver)
+        self.wrap(network, 'discard_stale_arrivals', self.wrap_discard_stale_arrivals)
+        for validator in network.nodes:
+            self.wrap(validator, 'on_receive', self.wrap_on_receive)
+            self.wrap(validator, 'is_ancestor', self.wrap_is_ancestor)
+        network.listeners.append(self)
+
+    def wrap(self, obj, name, wrapper):
+        # The wrapper is an attribute of the instance, which hides the method
+        # of the class
+        setattr(obj, name, wrapper(obj, getattr(obj, name)))
+
+    def count_in_flight(self):
+        """Returns the number of messages in flight, by receiver."""
+        return sum(num_receivers(self.network, entry)
+                   for arrivals in self.network.msg_arrivals.values() for entry in arrivals)
+
+    def uninstall(self):
+        """Removes the wrappers and stops listening to the network."""
+        for obj in [self.network] + self.network.nodes:
+            for name in ['broadcast', 'add_arrival', 'deliver', 'discard_stale_arrivals',
+                         'on_receive', 'is_ancestor']:
+                obj.__dict__.pop(name, None)
+        self.network.listeners.remove(self)
+
+    # Wrappers
+
+    def wrap_broadcast(self, network, broadcast):
+        def wrapper(msg, sender=None):
+            start = time.perf_counter()
+            broadcast(msg, sender)
+            self.counters['broadcast_time'] += time.perf_counter() - start
+            self.counters['broadcasts'] += 1
+        return wrapper
+
+    def wrap_add_arrival(self, network, add_arrival):
+        # The messages in flight are counted when they are scheduled, since
+        # a broadcast does not always reach every node at once: a gossip
+        # network only sends to the peers of the sender, and the light nodes
+        # only get the checkpoints
+        def wrapper(arrival_time, entry):
+            add_arrival(arrival_time, entry)
+            self.queue_depth += num_receivers(network, entry)
+        return wrapper
+
+    def wrap_deliver(self, network, deliver):
+        def wrapper():
+            if network.time in network.msg_arrivals:
+                counters = self.counters
+                counters['max_queue_depth'] = max(counters['max_queue_depth'], self.queue_depth)
+                counters['max_arrival_times'] = max(counters['max_arrival_times'],
+                                                    len(network.msg_arrivals))
+                batch = sum(num_receivers(network, entry)
+                            for entry in network.msg_arrivals[network.time])
+                counters['delivery_ticks'] += 1
+                counters['delivered'] += batch
+                counters['max_batch'] = max(counters['max_batch'], batch)
+                self.queue_depth -= batch
+            deliver()
+        return wrapper
+
+    def wrap_discard_stale_arrivals(self, network, discard_stale_arrivals):
+        def wrapper():
+            discard_stale_arrivals()
+            self.queue_depth = self.count_in_flight()
+        return wrapper
+
+    def wrap_on_receive(self, validator, on_receive):
+        def wrapper(obj):
+            start = time.perf_counter()
+            res = on_receive(obj)
+            elapsed = time.perf_counter() - start
+            name = type(obj).__name__
+            counters = self.counters
+            counters['on_receive'][name] = counters['on_receive'].get(name, 0) + 1
+            counters['on_receive_time'][name] = counters['on_receive_time'].get(name, 0.0) + elapsed
+            return res
+        return wrapper
+
+    def wrap_is_ancestor(self, validator, is_ancestor):
+        def wrapper(anc, desc):
+            res = is_ancestor(anc, desc)
+            depth = validator.ancestry.depth
+            distance = abs(depth[getattr(desc, 'hash', desc)] - depth[getattr(anc, 'hash', anc)])
+            counters = self.counters
+            counters['is_ancestor_calls'] += 1
+            counters['is_ancestor_distance'] += distance
+            counters['max_is_ancestor_distance'] = max(counters['max_is_ancestor_distance'],
+                                                       distance)
+            return res
+        return wrapper
+
+    # Events
+
+    def head_reorg(self, validator, old_head, new_head):
+        self.counters['reorgs'] += 1
+        self.counters['max_reorg_depth'] = max(self.counters['max_reorg_depth'],
+                                               reorg_depth(validator, old_head, new_head))
+
+    def epoch_started(self, epoch):
+        if epoch != self.counters['epoch']:
+            self.finish()
+            self.counters = new_counters(epoch)
+
+    def finish(self):
+        """Closes the report of the current epoch."""
+        counters = self.counters
+        now = time.perf_counter()
+        counters['wall_time'] = now - self.epoch_start
+        self.epoch_start = now
+
+        validators = self.network.nodes
+        dependencies = [sum(len(objs) for objs in val.dependencies.values())
+                        for val in validators]
+        pending = [sum(len(votes) for votes in val.pending_votes.values())
+                   for val in validators]
+        counters['mean_dependencies'] = float(sum(dependencies)) / len(validators)
+        counters['max_dependencies'] = max(dependencies)
+        counters['mean_pending_votes'] = float(sum(pending)) / len(validators)
+        self.reports.append(counters)
+
+    # Output
+
+    def rows(self):
+        """Returns the reports as flat dicts, with one column per type of message."""
+        names = sorted(set(name for report in self.reports for name in report['on_receive']))
+        rows = []
+        for report in self.reports:
+            row = dict(report)
+            del row['on_receive']
+            del row['on_receive_time']
+            for name in names:
+                row['on_receive_' + name] = report['on_receive'].get(name, 0)
+                row['on_receive_time_' + name] = report['on_receive_time'].get(name, 0.0)
+            rows.append(row)
+        return rows
+
+    def write_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.reports, f, indent=2, sort_keys=True)
+
+    def write_csv(self, filename):
+        rows = self.rows()
+        if not rows:
+            return
+        with open(filename, 'w') as f:
+            writer = csv.DictWriter(f, fieldnames=sorted(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def profile(function, filename=None, num_lines=30):
+    """Runs `function` under cProfile.
+
+    Args:
+        function: function to profile, called without arguments
+        filename: if given, file where the raw profile is saved (for
+            snakeviz or pstats)
+        num_lines: number of functions printed, by cumulative time
+
+    Returns:
+        the result of `function`
+    """
+    profiler = cProfile.Profile()
+    res = profiler.runcall(function)
+    if filename is not None:
+        profiler.dump_stats(filename)
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(num_lines)
+    return res
@@ -0,0 +1,133 @@
+"""Test that the instrumentation counts what the network and the validators do."""
+
+import csv
+import json
+
+from block import Block
+from instrumentation import Instrumentation
+from network import GossipNetwork, Network
+from rng import SimulationRNG
+from scenario import Scenario
+import topology
+from utils import exponential_latency
+from validator import LightValidator, VoteValidator
+
+SCENARIO = Scenario(num_validators=6, epoch_size=5, block_proposal_time=20, genesis_seed=3)
+NUM_EPOCHS = 3
+
+
+def new_network(batched):
+    rng = SimulationRNG(2)
+    network = Network(exponential_latency(30, rng), batched=batched, rng=rng, scenario=SCENARIO)
+    for i in SCENARIO.validator_ids:
+        VoteValidator(network, i)
+    return network
+
+
+def in_flight(network):
+    if network.batched:
+        return sum(len(receivers) for arrivals in network.msg_arrivals.values()
+                   for receivers, _ in arrivals)
+    return sum(len(arrivals) for arrivals in network.msg_arrivals.values())
+
+
+def test_queue_depth_of_gossip_and_light_nodes():
+    # A gossip broadcast only reaches the peers of the sender
+    rng = SimulationRNG(4)
+    graph = topology.random_regular(len(SCENARIO.validator_ids), 3, rng.stream('topology'))
+    network = GossipNetwork(graph, exponential_latency(30, rng), rng=rng, scenario=SCENARIO)
+    for i in SCENARIO.validator_ids:
+        VoteValidator(network, i)
+    network.run(SCENARIO.epoch_ticks)
+    # Attached with messages already in flight
+    instrumentation = Instrumentation(network)
+    assert instrumentation.queue_depth == in_flight(network) > 0
+    network.run(SCENARIO.epoch_ticks * NUM_EPOCHS)
+    assert instrumentation.queue_depth == in_flight(network)
+    instrumentation.finish()
+    assert sum(report['delivered'] for report in instrumentation.reports) > 0
+
+    # The light nodes only get the checkpoints
+    for batched in [True, False]:
+        rng = SimulationRNG(4)
+        network = Network(exponential_latency(30, rng), batched=batched, rng=rng,
+                          scenario=SCENARIO)
+        for i in SCENARIO.validator_ids:
+            if i < SCENARIO.num_validators:
+                VoteValidator(network, i)
+            else:
+                LightValidator(network, i)
+        instrumentation = Instrumentation(network)
+        network.run(SCENARIO.epoch_ticks * NUM_EPOCHS)
+        assert instrumentation.queue_depth == in_flight(network)
+
+
+def test_counters_match_network():
+    for batched in [True, False]:
+        network = new_network(batched)
+        # Hashes of the messages broadcast, under the instrumentation
+        sent = []
+        broadcast = network.broadcast
+
+        def record(msg, sender=None):
+            sent.append(msg.hash)
+            broadcast(msg, sender)
+        network.broadcast = record
+        instrumentation = Instrumentation(network)
+        network.run(SCENARIO.epoch_ticks * NUM_EPOCHS)
+        instrumentation.finish()
+        reports = instrumentation.reports
+
+        assert [report['epoch'] for report in reports] == list(range(NUM_EPOCHS))
+        assert sum(report['delivered'] for report in reports) == network.num_delivered
+        # Every message is broadcast once, and every block and vote kept or
+        # in flight was broadcast, except the genesis block (the votes that
+        # no validator accepted are not kept)
+        assert sum(report['broadcasts'] for report in reports) == len(sent) == len(set(sent))
+        kept = set(obj.hash for obj in network.store.objects)
+        kept.update(entry[1].hash for arrivals in network.msg_arrivals.values()
+                    for entry in arrivals)
+        assert kept - set(sent) == {SCENARIO.genesis.hash}
+        assert instrumentation.queue_depth == in_flight(network)
+        for report in reports:
+            assert 0 < report['max_batch'] <= report['max_queue_depth']
+            assert report['broadcast_time'] > 0
+            assert report['is_ancestor_calls'] > 0
+
+        # Every delivery is received, and the proposers receive their own blocks
+        num_blocks = sum(1 for obj in network.store.objects if isinstance(obj, Block)) - 1
+        on_receive = sum(sum(report['on_receive'].values()) for report in reports)
+        assert on_receive == network.num_delivered + num_blocks
+        for name in ['Block', 'Vote']:
+            assert sum(report['on_receive_time'].get(name, 0.0) for report in reports) > 0
+
+
+def test_instrumentation_does_not_change_the_run():
+    network = new_network(True)
+    instrumentation = Instrumentation(network)
+    network.run(SCENARIO.epoch_ticks * NUM_EPOCHS)
+    instrumentation.uninstall()
+    assert not network.listeners
+    assert all('on_receive' not in val.__dict__ for val in network.nodes)
+
+    reference = new_network(True)
+    reference.run(SCENARIO.epoch_ticks * NUM_EPOCHS)
+    assert [val.head.hash for val in network.nodes] == [val.head.hash for val in reference.nodes]
+
+
+def test_write_reports(tmp_path):
+    network = new_network(True)
+    instrumentation = Instrumentation(network)
+    network.run(SCENARIO.epoch_ticks * NUM_EPOCHS)
+    instrumentation.finish()
+
+    instrumentation.write_json(str(tmp_path / 'report.json'))
+    with open(str(tmp_path / 'report.json')) as f:
+        assert json.load(f) == instrumentation.reports
+
+    instrumentation.write_csv(str(tmp_path / 'report.csv'))
+    with open(str(tmp_path / 'report.csv')) as f:
+        rows = list(csv.DictReader(f))
+    assert [int(row['epoch']) for row in rows] == list(range(NUM_EPOCHS))
+    assert [int(row['on_receive_Vote']) for row in rows] == \
+        [report['on_receive'].get('Vote', 0) for report in instrumentation.reports]
@@ -0,0 +1,110 @@
+"""Test the light validators, which only follow the checkpoints."""
+
+import pytest
+
+from collector import OnlineMetrics
+from loopback import LoopbackNetwork
+from message import CheckpointHeader
+from network import GossipNetwork, KeyedNetwork, Network
+from rng import SimulationRNG
+from scenario import Scenario
+import topology
+from utils import exponential_latency
+from validator import LightValidator, VoteValidator
+
+# 4 proposers, and 8 more validators which only vote
+SCENARIO = Scenario(num_validators=4, validator_ids=range(12), epoch_size=10,
+                    block_proposal_time=10, genesis_seed=5)
+
+
+def mixed_network(seed, batched=True, prune_lag=None):
+    rng = SimulationRNG(seed)
+    network = Network(exponential_latency(5, rng), batched=batched, rng=rng, scenario=SCENARIO)
+    for i in SCENARIO.validator_ids:
+        if i < SCENARIO.num_validators:
+            VoteValidator(network, i, prune_lag)
+        else:
+            LightValidator(network, i, prune_lag)
+    return network
+
+
+def test_light_validators_agree_with_heavy():
+    for batched in [True, False]:
+        network = mixed_network(1, batched)
+        collector = OnlineMetrics(network)
+        network.run(SCENARIO.epoch_ticks * 12)
+        heavy = [val for val in network.nodes if not val.light]
+        light = [val for val in network.nodes if val.light]
+
+        # The light validators only processed checkpoints
+        for val in light:
+            assert all(block.height % SCENARIO.epoch_size == 0
+                       for blocks in val.index.blocks_by_height.values() for block in blocks)
+            assert not val.checkpoint_parents
+
+        # Same justified and finalized checkpoints as the heavy validators,
+        # except the last ones, whose votes may still be in flight
+        epoch = min(val.highest_justified_checkpoint.epoch for val in network.nodes)
+
+        def settled(val, checkpoints):
+            return set(h for h in checkpoints if val.processed[h].epoch < epoch)
+
+        assert len(settled(heavy[0], heavy[0].finalized)) > 5
+        for val in network.nodes:
+            assert settled(val, val.justified) == settled(heavy[0], heavy[0].justified)
+            assert settled(val, val.finalized) == settled(heavy[0], heavy[0].finalized)
+        assert collector.summary()['finalized'] > 0.8
+
+
+def test_invalid_header_is_ignored():
+    network = mixed_network(2)
+    network.run(SCENARIO.epoch_ticks * 4)
+    heavy, light = network.nodes[0], network.nodes[-1]
+    checkpoint = heavy.highest_justified_checkpoint
+    assert checkpoint.epoch >= 2
+    header = network.checkpoint_header(checkpoint)
+    parent = heavy.get_checkpoint_parent(checkpoint)
+    assert header.parent_hash == parent.hash
+    assert light.processed[checkpoint.hash] is checkpoint
+
+    # A header whose checkpoint parent is not a checkpoint of the previous
+    # epoch is dropped, once the validator has the checkpoint parent
+    other = LightValidator(network, len(network.nodes))
+    ancestors = [parent]
+    while ancestors[-1].epoch > 1:
+        ancestors.append(heavy.get_checkpoint_parent(ancestors[-1]))
+    for ancestor in reversed(ancestors):
+        assert other.on_receive(network.checkpoint_header(ancestor))
+    grandparent = other.get_checkpoint_parent(parent)
+    assert not other.on_receive(CheckpointHeader(checkpoint, grandparent.hash))
+    assert checkpoint.hash not in other.processed
+    # Not a checkpoint
+    block = heavy.processed[checkpoint.prev_hash]
+    assert not other.on_receive(CheckpointHeader(block, grandparent.hash))
+    assert block.hash not in other.checkpoint_parents
+    # The valid header is still accepted
+    assert other.on_receive(header)
+    assert other.processed[checkpoint.hash] is checkpoint
+
+
+def test_networks_without_headers_refuse_light_validators():
+    rng = SimulationRNG(1)
+    graph = topology.random_regular(len(SCENARIO.validator_ids), 4, rng.stream('topology'))
+    networks = [GossipNetwork(graph, exponential_latency(5, rng), rng=rng, scenario=SCENARIO),
+                KeyedNetwork(exponential_latency(5, rng), rng, SCENARIO),
+                LoopbackNetwork(rng=rng, scenario=SCENARIO)]
+    for network in networks:
+        with pytest.raises(ValueError):
+            LightValidator(network, 0)
+        assert not network.nodes
+
+
+def test_light_validators_prune():
+    metrics = []
+    for prune_lag in [None, 2]:
+        network = mixed_network(3, prune_lag=prune_lag)
+        collector = OnlineMetrics(network)
+        network.run(SCENARIO.epoch_ticks * 15)
+        metrics.append(collector.summary())
+    assert metrics[0] == metrics[1]
+    assert all(val.horizon.height > 0 for val in network.nodes)
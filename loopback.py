@@ -0,0 +1,347 @@
+"""Run the validators on real sockets, over the TCP loopback of one machine.
+
+LoopbackNetwork has the interface of Network for the validators (nodes,
+broadcast, store, rng, scenario, listeners), but the messages are serialized
+and sent over local TCP connections, and the time is the wall-clock time
+scaled by `ticks_per_second`. Each validator gets its own server, a reader
+task for its incoming connection and a clock task calling its `tick` at
+every block proposal time, so the same `tick`/`on_receive` code runs on an
+asyncio event loop.
+
+This measures the real costs of the protocol code (serialization, event
+loop latency, message throughput), which the simulated Network does not
+have. Run `python3 loopback.py` to compare a loopback run to a simulation
+with the same average latency.
+
+Wire format: each message is a frame of a header (length of the payload,
+time at which it was broadcast) and the pickle of the Block or Vote. The
+scenario of the blocks is not written, since both ends share it.
+
+All the validators share one process, so the connections are pooled: there
+is one connection per receiving validator, shared by all the senders, and
+all the frames sent to a validator during one iteration of the event loop
+are written to its connection in one call.
+"""
+
+import argparse
+import asyncio
+import functools
+import io
+import pickle
+import struct
+import time
+
+import numpy as np
+
+from collector import OnlineMetrics
+from metrics import run_simulation
+from rng import SimulationRNG
+from scenario import DEFAULT_SCENARIO
+from store import ObjectStore
+from validator import VoteValidator
+
+# Header of a frame: length of the payload, and time of the broadcast (in
+# seconds of time.monotonic)
+HEADER = struct.Struct('!Id')
+# Number of bytes read from a connection at once
+READ_SIZE = 1 << 16
+
+
+class MessagePickler(pickle.Pickler):
+    """Pickler which does not write the scenario of the blocks."""
+    def __init__(self, file, scenario):
+        super(MessagePickler, self).__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.scenario = scenario
+
+    def persistent_id(self, obj):
+        if obj is self.scenario:
+            return 'scenario'
+        return None
+
+
+class MessageUnpickler(pickle.Unpickler):
+    """Unpickler which points the blocks to the scenario of the receiver."""
+    def __init__(self, file, scenario):
+        super(MessageUnpickler, self).__init__(file)
+        self.scenario = scenario
+
+    def persistent_load(self, pid):
+        assert pid == 'scenario'
+        return self.scenario
+
+
+class LoopbackNetwork(object):
+    """Network sending the messages over TCP loopback connections.
+
+    self.time: current time, in ticks since the start of `run`
+    self.delays: delays of the messages, from the broadcast to the read of
+        the frame by the receiver (in seconds)
+    self.loop_lags: delays between the time at which a clock task should
+        wake up and the time at which it does (in seconds)
+    self.encode_time, self.decode_time: time spent serializing the messages
+        (in seconds)
+
+    Args:
+        ticks_per_second: number of ticks per second of wall-clock time
+        rng: SimulationRNG used by the nodes (a new one if None)
+        scenario: parameters of the simulation (DEFAULT_SCENARIO if None)
+        host: address of the servers of the validators
+    """
+
+    # Every node gets the blocks (see LightValidator)
+    sends_headers = False
+
+    def __init__(self, ticks_per_second=100, rng=None, scenario=None, host='127.0.0.1'):
+        self.scenario = scenario or DEFAULT_SCENARIO
+        self.ticks_per_second = ticks_per_second
+        self.rng = rng or SimulationRNG()
+        self.host = host
+        self.nodes = []
+        self.store = ObjectStore()
+        self.listeners = []
+        self.start_time = None
+        # Pool of the connections to the validators, and the frames waiting
+        # to be written to each of them
+        self.writers = []
+        self.buffers = []
+        self.flush_scheduled = False
+        # Reader tasks of the servers, and whether the run is over
+        self.readers = []
+        self.stopped = False
+
+        self.num_broadcasts = 0
+        self.num_sent = 0
+        self.num_delivered = 0
+        self.num_writes = 0
+        self.bytes_sent = 0
+        self.encode_time = 0.0
+        self.decode_time = 0.0
+        self.delays = []
+        self.loop_lags = []
+
+    @property
+    def time(self):
+        if self.start_time is None:
+            return 0
+        return int((time.monotonic() - self.start_time) * self.ticks_per_second)
+
+    def node_rng(self, node_id):
+        return self.rng
+
+    def emit(self, event, *args):
+        """Calls the method `event` of every listener with `args`."""
+        for listener in self.listeners:
+            getattr(listener, event)(*args)
+
+    # Serialization
+
+    def encode(self, msg):
+        start = time.perf_counter()
+        buf = io.BytesIO()
+        MessagePickler(buf, self.scenario).dump(msg)
+        payload = buf.getvalue()
+        frame = HEADER.pack(len(payload), time.monotonic()) + payload
+        self.encode_time += time.perf_counter() - start
+        return frame
+
+    def decode(self, payload):
+        start = time.perf_counter()
+        msg = MessageUnpickler(io.BytesIO(payload), self.scenario).load()
+        # Every validator on this machine gets the object of the store, as
+        # in the simulation, instead of its own copy
+        id_ = self.store.ids.get(msg.hash)
+        if id_ is not None:
+            msg = self.store.objects[id_]
+        self.decode_time += time.perf_counter() - start
+        return msg
+
+    def maybe_compact(self):
+        """Compacts the store when the validators prune their history (see
+        Network.maybe_compact). The messages in flight are in the sockets."""
+        if self.store.needs_compaction():
+            self.store.compact()
+
+    # Sending
+
+    def broadcast(self, msg, sender=None):
+        """Sends a message to every node, including the sender (as Network.broadcast).
+
+        The message is serialized once, and written with the other frames of
+        this iteration of the event loop (see `flush`).
+        """
+        frame = self.encode(msg)
+        for buf in self.buffers:
+            buf += frame
+        self.num_broadcasts += 1
+        self.num_sent += len(self.buffers)
+        self.bytes_sent += len(frame) * len(self.buffers)
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        """Writes the frames waiting for each node in one call per connection."""
+        self.flush_scheduled = False
+        for writer, buf in zip(self.writers, self.buffers):
+            if buf:
+                writer.write(bytes(buf))
+                buf.clear()
+                self.num_writes += 1
+
+    # Receiving
+
+    async def serve(self, node, reader, writer):
+        """Reads the frames sent to a node, and gives it the messages of each read at once."""
+        self.readers.append(asyncio.current_task())
+        data = bytearray()
+        while True:
+            chunk = await reader.read(READ_SIZE)
+            if not chunk or self.stopped:
+                break
+            data += chunk
+            now = time.monotonic()
+            msgs = []
+            offset = 0
+            while len(data) - offset >= HEADER.size:
+                length, sent = HEADER.unpack_from(data, offset)
+                start = offset + HEADER.size
+                if len(data) - start < length:
+                    break
+                msgs.append(self.decode(bytes(data[start:start + length])))
+                self.delays.append(now - sent)
+                offset = start + length
+            del data[:offset]
+            if msgs:
+                self.num_delivered += len(msgs)
+                node.on_receive_batch(msgs)
+        writer.close()
+
+    # Clocks
+
+    async def sleep_until(self, tick):
+        """Sleeps until the given tick, and records how late the event loop woke up."""
+        wake_time = self.start_time + float(tick) / self.ticks_per_second
+        delay = wake_time - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.loop_lags.append(max(time.monotonic() - wake_time, 0.0))
+
+    async def node_clock(self, node, end_time):
+        """Calls `tick` on a node at every block proposal time before `end_time`."""
+        proposal_time = self.scenario.block_proposal_time
+        for tick in range(0, end_time, proposal_time):
+            await self.sleep_until(tick)
+            node.tick(tick)
+
+    async def epoch_clock(self, end_time):
+        """Notifies the listeners at the start of every epoch."""
+        epoch_ticks = self.scenario.epoch_ticks
+        for tick in range(0, end_time, epoch_ticks):
+            await self.sleep_until(tick)
+            if self.listeners:
+                self.emit('epoch_started', tick // epoch_ticks)
+
+    async def main(self, num_ticks):
+        servers = []
+        for node in self.nodes:
+            server = await asyncio.start_server(functools.partial(self.serve, node), self.host, 0)
+            servers.append(server)
+        for server in servers:
+            port = server.sockets[0].getsockname()[1]
+            _, writer = await asyncio.open_connection(self.host, port)
+            self.writers.append(writer)
+            self.buffers.append(bytearray())
+
+        self.start_time = time.monotonic()
+        clocks = [self.node_clock(node, num_ticks) for node in self.nodes]
+        clocks.append(self.epoch_clock(num_ticks))
+        await asyncio.gather(*clocks)
+        await self.sleep_until(num_ticks)
+
+        # The messages still in flight are dropped
+        self.stopped = True
+        for writer in self.writers:
+            writer.close()
+        await asyncio.gather(*self.readers)
+        for server in servers:
+            server.close()
+            await server.wait_closed()
+
+    def run(self, num_ticks):
+        """Runs the validators for `num_ticks` ticks of scaled wall-clock time."""
+        asyncio.run(self.main(num_ticks))
+
+
+def run_loopback(ticks_per_second=100, validator_set=None, seed=None, num_epochs=10,
+                 scenario=None):
+    """Run one simulation over loopback connections.
+
+    Returns:
+        dict with the metrics of metrics.run_simulation, and the measures of
+        the transport: messages delivered per second, mean and 99th
+        percentile of the delays (in ticks), mean and max lag of the event
+        loop (in ms), serialization time per message (in microseconds),
+        bytes per message and messages per write
+    """
+    scenario = scenario or DEFAULT_SCENARIO
+    if validator_set is None:
+        validator_set = scenario.validator_ids
+    network = LoopbackNetwork(ticks_per_second, SimulationRNG(seed), scenario)
+    for i in validator_set:
+        VoteValidator(network, i)
+    collector = OnlineMetrics(network)
+
+    start = time.monotonic()
+    network.run(scenario.epoch_ticks * num_epochs)
+    wall_time = time.monotonic() - start
+
+    result = collector.summary()
+    del result['reorgs']
+    result['main_chain_fraction'] = (result['main_chain_size'] /
+                                     (scenario.epoch_size * num_epochs + 1))
+    delays = np.array(network.delays) * ticks_per_second
+    lags = np.array(network.loop_lags) * 1000
+    result.update({
+        'wall_time': wall_time,
+        'messages_per_second': network.num_delivered / wall_time,
+        'mean_delay': float(delays.mean()) if len(delays) else 0.0,
+        'p99_delay': float(np.percentile(delays, 99)) if len(delays) else 0.0,
+        'mean_loop_lag': float(lags.mean()) if len(lags) else 0.0,
+        'max_loop_lag': float(lags.max()) if len(lags) else 0.0,
+        'encode_us': 1e6 * network.encode_time / max(network.num_broadcasts, 1),
+        'decode_us': 1e6 * network.decode_time / max(network.num_delivered, 1),
+        'bytes_per_message': float(network.bytes_sent) / max(network.num_sent, 1),
+        'messages_per_write': float(network.num_sent) / max(network.num_writes, 1),
+    })
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ticks-per-second', type=int, default=100,
+                        help='ticks per second of wall-clock time (default: 100)')
+    parser.add_argument('--epochs', type=int, default=10,
+                        help='number of epochs (default: 10)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    loopback = run_loopback(args.ticks_per_second, seed=args.seed, num_epochs=args.epochs)
+    print('Loopback: {} validators, {} ticks per second, {:.1f} seconds'.format(
+        len(DEFAULT_SCENARIO.validator_ids), args.ticks_per_second, loopback['wall_time']))
+    print('Messages delivered per second: {:.0f}'.format(loopback['messages_per_second']))
+    print('Delay: mean {:.2f} ticks, 99th percentile {:.2f} ticks'.format(
+        loopback['mean_delay'], loopback['p99_delay']))
+    print('Event loop lag: mean {:.2f} ms, max {:.2f} ms'.format(
+        loopback['mean_loop_lag'], loopback['max_loop_lag']))
+    print('Serialization: {:.1f} us to encode, {:.1f} us to decode, {:.0f} bytes per message'.format(
+        loopback['encode_us'], loopback['decode_us'], loopback['bytes_per_message']))
+    print('Messages per write: {:.1f}'.format(loopback['messages_per_write']))
+    print('')
+
+    # Simulation with the average latency measured on the loopback
+    latency = max(loopback['mean_delay'], 1.0)
+    simulated = run_simulation(latency, seed=args.seed, num_epochs=args.epochs)
+    print('Metric | loopback | simulated (latency {:.1f})'.format(latency))
+    for key in ['justified', 'finalized', 'justified_in_forks', 'main_chain_fraction']:
+        print('{} | {:.3f} | {:.3f}'.format(key, loopback[key], simulated[key]))
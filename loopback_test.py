@@ -0,0 +1,13 @@
+"""Test that the validators reach finality over loopback connections."""
+
+from loopback import run_loopback
+from scenario import Scenario
+
+
+def test_loopback_finalizes():
+    scenario = Scenario(num_validators=4, block_proposal_time=10, epoch_size=5)
+    result = run_loopback(ticks_per_second=200, seed=0, num_epochs=6, scenario=scenario)
+    assert result['finalized'] > 0
+    assert result['justified_in_forks'] == 0
+    assert result['mean_delay'] > 0
+    assert result['messages_per_write'] >= 1
@@ -1,4 +1,4 @@
-import random
+from rng import DEFAULT_RNG
 
 
 class Vote():
@@ -10,11 +10,29 @@ class Vote():
         epoch_source: epoch of the source block
         epoch_target: epoch of the target block
         sender: node sending the VOTE message
+        rng: SimulationRNG of the simulation (DEFAULT_RNG if None)
     """
-    def __init__(self, source, target, epoch_source, epoch_target, sender):
-        self.hash = random.randint(1, 10**30)
+    def __init__(self, source, target, epoch_source, epoch_target, sender, rng=None):
+        rng = rng or DEFAULT_RNG
+        self.hash = rng.vote_id.randint(1, 10**30)
         self.source = source
         self.target = target
         self.epoch_source = epoch_source
         self.epoch_target = epoch_target
         self.sender = sender
+
+
+class CheckpointHeader():
+    """Checkpoint sent to a light validator, with the hash of its checkpoint
+    parent (see validator.LightValidator).
+
+    Args:
+        block: checkpoint block
+        parent_hash: hash of the checkpoint parent of the block
+    """
+    def __init__(self, block, parent_hash):
+        # Same hash as the block, so that the header and the block are the
+        # same object for the validators
+        self.hash = block.hash
+        self.block = block
+        self.parent_hash = parent_hash
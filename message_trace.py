@@ -0,0 +1,285 @@
+"""Record the deliveries of a simulation in a binary trace, and replay them.
+
+A trace is a directory with three files:
+    header.json: ids of the validators (and of the light ones) and names of
+        the fields
+    deliveries.bin: append-only log of int32 records, one per delivery, with
+        the fields of FIELDS
+    messages.pickle: the blocks, votes and checkpoint headers, pickled one
+        after the other in order of their first delivery (the index of a
+        message in this stream is its message id)
+
+The deliveries are every call of Validator.on_receive made by the network,
+plus the blocks received by their proposer, in the order in which they
+happened. Replaying them in fresh validators gives the same state as the
+recorded simulation, without drawing latencies, proposing blocks or
+broadcasting votes.
+
+The deliveries can be read as a memory-mapped NumPy array
+(`deliveries_array`) or in chunks (`read_deliveries`), without loading the
+messages.
+
+Run `python3 message_trace.py` for an example.
+"""
+
+from array import array
+import json
+import os
+import pickle
+
+import numpy as np
+
+from block import Block
+from collector import NetworkListener
+from message import CheckpointHeader
+from network import Network
+from parameters import *
+from rng import SimulationRNG
+from snapshot import SnapshotPickler, SnapshotUnpickler
+from validator import ROOT, LightValidator, VoteValidator
+
+# Fields of a delivery record. For a vote, source and target are the message
+# ids of its source and target blocks. For a block, source is the message id
+# of its parent (or -1 if it was never delivered), target and epoch_source
+# are -1, and epoch_target is the epoch of the block. A checkpoint header
+# (sent to the light validators) has its own message id: its source is the
+# message id of the block of its checkpoint parent, target is the message id
+# of its block, and epoch_target is the epoch of the block.
+FIELDS = ('time', 'receiver', 'message', 'kind', 'source', 'target',
+          'epoch_source', 'epoch_target')
+BLOCK = 0
+VOTE = 1
+HEADER = 2
+
+# Number of records kept in memory before they are appended to the file
+FLUSH_RECORDS = 1 << 16
+
+
+class TraceRecorder(object):
+    """Records the deliveries of a network in a trace directory.
+
+    The recorder wraps on_receive on the instances of the validators, so a
+    simulation without recorder runs the same code as before.
+
+    Args:
+        network: network to record, once its validators are connected
+        path: directory of the trace
+    """
+    def __init__(self, network, path):
+        self.network = network
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        with open(os.path.join(path, 'header.json'), 'w') as f:
+            json.dump({'num_validators': len(network.nodes),
+                       'validator_ids': [validator.id for validator in network.nodes],
+                       'light_validators': [validator.id for validator in network.nodes
+                                            if validator.light],
+                       'fields': FIELDS}, f)
+
+        self.records = array('i')
+        self.deliveries_file = open(os.path.join(path, 'deliveries.bin'), 'wb')
+        self.messages_file = open(os.path.join(path, 'messages.pickle'), 'wb')
+        # The pickler keeps its memo between messages, so the dynasties
+        # shared by the blocks are written once
+        self.pickler = SnapshotPickler(self.messages_file, pickle.HIGHEST_PROTOCOL)
+        # Map {hash -> message id}
+        self.message_ids = {}
+
+        for validator in network.nodes:
+            validator.on_receive = self.wrap_on_receive(validator, validator.on_receive)
+
+    def message_id(self, msg):
+        # A header has the hash of its block, so it gets another key
+        key = (HEADER, msg.hash) if isinstance(msg, CheckpointHeader) else msg.hash
+        id_ = self.message_ids.get(key)
+        if id_ is None:
+            id_ = len(self.message_ids)
+            self.message_ids[key] = id_
+            self.pickler.dump(msg)
+        return id_
+
+    def wrap_on_receive(self, validator, on_receive):
+        def wrapper(obj):
+            self.record(validator, obj)
+            return on_receive(obj)
+        return wrapper
+
+    def record(self, validator, obj):
+        id_ = self.message_id(obj)
+        if isinstance(obj, Block):
+            self.records.extend((self.network.time, validator.id, id_, BLOCK,
+                                 self.message_ids.get(obj.prev_hash, -1), -1, -1, obj.epoch))
+        elif isinstance(obj, CheckpointHeader):
+            self.records.extend((self.network.time, validator.id, id_, HEADER,
+                                 self.message_ids.get(obj.parent_hash, -1),
+                                 self.message_ids.get(obj.hash, -1), -1, obj.block.epoch))
+        else:
+            self.records.extend((self.network.time, validator.id, id_, VOTE,
+                                 self.message_ids.get(obj.source, -1),
+                                 self.message_ids.get(obj.target, -1),
+                                 obj.epoch_source, obj.epoch_target))
+        if len(self.records) >= FLUSH_RECORDS * len(FIELDS):
+            self.flush()
+
+    def flush(self):
+        self.records.tofile(self.deliveries_file)
+        self.records = array('i')
+        self.deliveries_file.flush()
+        self.messages_file.flush()
+
+    def close(self):
+        """Writes the last records and removes the wrappers."""
+        self.flush()
+        self.deliveries_file.close()
+        self.messages_file.close()
+        for validator in self.network.nodes:
+            validator.__dict__.pop('on_receive', None)
+
+
+def read_header(path):
+    with open(os.path.join(path, 'header.json')) as f:
+        return json.load(f)
+
+
+def deliveries_array(path):
+    """Returns the deliveries of a trace as a memory-mapped array, with one row per delivery."""
+    filename = os.path.join(path, 'deliveries.bin')
+    if os.path.getsize(filename) == 0:
+        return np.zeros((0, len(FIELDS)), dtype=np.int32)
+    return np.memmap(filename, dtype=np.int32, mode='r').reshape(-1, len(FIELDS))
+
+
+def read_deliveries(path, chunk_records=FLUSH_RECORDS):
+    """Iterates over the deliveries of a trace, reading `chunk_records` records at a time.
+
+    Yields:
+        tuples with the fields of FIELDS
+    """
+    num_fields = len(FIELDS)
+    with open(os.path.join(path, 'deliveries.bin'), 'rb') as f:
+        while True:
+            chunk = array('i')
+            try:
+                chunk.fromfile(f, chunk_records * num_fields)
+            except EOFError:
+                # fromfile reads what is left before raising
+                pass
+            if not chunk:
+                return
+            for i in range(0, len(chunk), num_fields):
+                yield tuple(chunk[i:i + num_fields])
+
+
+def read_messages(path):
+    """Iterates over the messages of a trace, in order of message id."""
+    with open(os.path.join(path, 'messages.pickle'), 'rb') as f:
+        unpickler = SnapshotUnpickler(f)
+        while True:
+            try:
+                yield unpickler.load()
+            except EOFError:
+                return
+
+
+class ReplayNetwork(Network):
+    """Network of a replay: the messages broadcast by the validators are dropped,
+    since the trace already contains the messages they received."""
+    def __init__(self, rng=None, scenario=None):
+        super(ReplayNetwork, self).__init__(None, rng=rng, scenario=scenario)
+
+    def broadcast(self, msg, sender=None):
+        pass
+
+
+def replay(path, validator_class=VoteValidator, validator_ids=None, listeners=(),
+           scenario=None, light_class=LightValidator):
+    """Replays a trace in fresh validators.
+
+    The validators do not talk to each other during a replay, so replaying
+    only some of them takes a fraction of the time of the simulation.
+
+    Args:
+        path: directory of the trace
+        validator_class: class of the validators, to test another fork choice
+            against the recorded deliveries for instance
+        validator_ids: ids of the validators to replay (all the validators
+            of the recorded network if None)
+        listeners: listeners of the replay network (see collector.py),
+            attached once the validators are created
+        scenario: scenario of the recorded simulation (DEFAULT_SCENARIO if None)
+        light_class: class of the validators which were light validators in
+            the recorded simulation
+
+    Returns:
+        the replay network; its validators are network.nodes
+    """
+    header = read_header(path)
+    if validator_ids is None:
+        # The traces of older versions only have the number of validators
+        validator_ids = header.get('validator_ids', range(header['num_validators']))
+    light = set(header.get('light_validators', []))
+    network = ReplayNetwork(SimulationRNG(0), scenario)
+    validators = {i: (light_class if i in light else validator_class)(network, i)
+                  for i in validator_ids}
+    for listener in listeners:
+        network.listeners.append(listener)
+
+    epoch_ticks = network.scenario.epoch_ticks
+    messages = []
+    message_stream = read_messages(path)
+    deliveries = deliveries_array(path)
+    selected = np.isin(deliveries[:, 1], list(validators))
+    for start in range(0, len(deliveries), FLUSH_RECORDS):
+        chunk = deliveries[start:start + FLUSH_RECORDS]
+        chunk = chunk[selected[start:start + FLUSH_RECORDS]]
+        for time, receiver, message in chunk[:, :3].tolist():
+            # Load the messages as they are first delivered
+            while message >= len(messages):
+                messages.append(next(message_stream))
+            # Notify the listeners of the epochs, as Network.run does
+            while network.time < time:
+                network.time += 1
+                if network.listeners and network.time % epoch_ticks == 0:
+                    network.emit('epoch_started', network.time // epoch_ticks)
+            validators[receiver].on_receive(messages[message])
+    return network
+
+
+if __name__ == '__main__':
+    import shutil
+    import tempfile
+    import time as time_module
+
+    from utils import exponential_latency
+
+    path = tempfile.mkdtemp()
+    num_epochs = 10
+    try:
+        rng = SimulationRNG(0)
+        network = Network(exponential_latency(100, rng), batched=True, rng=rng)
+        validators = [VoteValidator(network, i) for i in VALIDATOR_IDS]
+        recorder = TraceRecorder(network, path)
+        start = time_module.time()
+        network.run(BLOCK_PROPOSAL_TIME * EPOCH_SIZE * num_epochs)
+        recorder.close()
+        print('Simulation: {:.2f} seconds'.format(time_module.time() - start))
+
+        deliveries = deliveries_array(path)
+        print('Trace: {} deliveries, {:.1f} MB of records, {:.1f} MB of messages'.format(
+            len(deliveries), os.path.getsize(os.path.join(path, 'deliveries.bin')) / 1e6,
+            os.path.getsize(os.path.join(path, 'messages.pickle')) / 1e6))
+        print('Votes delivered: {}'.format(int((deliveries[:, 3] == VOTE).sum())))
+
+        start = time_module.time()
+        replayed = replay(path)
+        print('Replay of all the validators: {:.2f} seconds'.format(time_module.time() - start))
+        assert [val.head.hash for val in replayed.nodes] == [val.head.hash for val in validators]
+        assert [val.justified for val in replayed.nodes] == [val.justified for val in validators]
+
+        start = time_module.time()
+        replayed = replay(path, validator_ids=[0])
+        print('Replay of validator 0: {:.2f} seconds'.format(time_module.time() - start))
+        assert replayed.nodes[0].head.hash == validators[0].head.hash
+    finally:
+        shutil.rmtree(path)
@@ -0,0 +1,78 @@
+"""Test that replaying a trace gives the state of the recorded simulation."""
+
+import message_trace
+from network import Network
+from parameters import *
+from rng import SimulationRNG
+from scenario import Scenario
+from utils import exponential_latency
+from validator import LightValidator, VoteValidator
+
+NUM_EPOCHS = 2
+
+
+def state(validator):
+    return (validator.head.hash, sorted(validator.justified), sorted(validator.finalized),
+            len(validator.processed), validator.vote_count)
+
+
+def test_replay_matches_recording(tmp_path):
+    path = str(tmp_path)
+    rng = SimulationRNG(7)
+    network = Network(exponential_latency(AVG_LATENCY, rng), batched=True, rng=rng)
+    validators = [VoteValidator(network, i) for i in VALIDATOR_IDS]
+    recorder = message_trace.TraceRecorder(network, path)
+    network.run(BLOCK_PROPOSAL_TIME * EPOCH_SIZE * NUM_EPOCHS)
+    recorder.close()
+
+    deliveries = message_trace.deliveries_array(path)
+    assert len(deliveries) == network.num_delivered + NUM_EPOCHS * EPOCH_SIZE
+    assert [tuple(row) for row in deliveries[:10].tolist()] == \
+        list(message_trace.read_deliveries(path, chunk_records=3))[:10]
+
+    replayed = message_trace.replay(path)
+    assert [state(val) for val in replayed.nodes] == [state(val) for val in validators]
+    replayed = message_trace.replay(path, validator_ids=[5])
+    assert state(replayed.nodes[0]) == state(validators[5])
+
+
+def test_replay_recorded_ids(tmp_path):
+    # Validators whose ids are not their indices in the network
+    scenario = Scenario(num_validators=4, validator_ids=[0, 1, 2, 3, 8, 9], epoch_size=5,
+                        block_proposal_time=10, genesis_seed=1)
+    path = str(tmp_path)
+    rng = SimulationRNG(2)
+    network = Network(exponential_latency(5, rng), batched=True, rng=rng, scenario=scenario)
+    validators = [VoteValidator(network, i) for i in scenario.validator_ids]
+    recorder = message_trace.TraceRecorder(network, path)
+    network.run(scenario.epoch_ticks * 3)
+    recorder.close()
+
+    replayed = message_trace.replay(path, scenario=scenario)
+    assert [val.id for val in replayed.nodes] == scenario.validator_ids
+    assert [state(val) for val in replayed.nodes] == [state(val) for val in validators]
+
+
+def test_record_light_validators(tmp_path):
+    # The validators 4 to 7 only get the checkpoint headers
+    scenario = Scenario(num_validators=4, epoch_size=5, block_proposal_time=10, genesis_seed=1)
+    path = str(tmp_path)
+    for batched in [True, False]:
+        rng = SimulationRNG(3)
+        network = Network(exponential_latency(5, rng), batched=batched, rng=rng,
+                          scenario=scenario)
+        validators = [VoteValidator(network, i) if i < 4 else LightValidator(network, i)
+                      for i in scenario.validator_ids]
+        recorder = message_trace.TraceRecorder(network, path)
+        network.run(scenario.epoch_ticks * 4)
+        recorder.close()
+
+        deliveries = message_trace.deliveries_array(path)
+        headers = deliveries[deliveries[:, 3] == message_trace.HEADER]
+        assert len(headers) and set(headers[:, 1].tolist()) == {4, 5, 6, 7}
+        assert all(epoch > 0 for epoch in headers[:, 7].tolist())
+
+        replayed = message_trace.replay(path, scenario=scenario)
+        assert [val.light for val in replayed.nodes] == [val.light for val in validators]
+        assert [state(val) for val in replayed.nodes] == [state(val) for val in validators]
+        assert len(validators[-1].finalized) > 1
@@ -4,8 +4,11 @@ import numpy as np
 from parameters import *
 from block import Block
 from utils import exponential_latency
-from network import Network
-from validator import VoteValidator
+from network import KeyedNetwork, Network
+from validator import LightValidator, VoteValidator
+from rng import SimulationRNG
+from collector import OnlineMetrics
+from scenario import DEFAULT_SCENARIO
 from plot_graph import plot_node_blockchains
 
 
@@ -43,22 +46,13 @@ def main_chain_size(validator):
 
 def blocks_under_highest_justified(validator):
     """Computes the height of blocks below the checkpoint of highest height."""
-    res = 0
-    for bhash, b in validator.processed.items():
-        if isinstance(b, Block):
-            if b.height <= validator.highest_justified_checkpoint.height:
-                res += 1
-    return res
+    return validator.index.count_blocks(validator.highest_justified_checkpoint.height)
 
 
 def total_height_blocks(validator):
     """Total height of blocks processed by the validator.
     """
-    res = 0
-    for bhash, b in validator.processed.items():
-        if isinstance(b, Block):
-            res += 1
-    return res
+    return validator.index.num_blocks
 
 
 def count_forks(validator):
@@ -74,9 +68,11 @@ def count_forks(validator):
 
     # Stop when we reach the genesis block
     while block.height > 0:
-        block_hash = block.prevhash
+        block_hash = block.prev_hash
         block = validator.processed[block_hash]
         main_blocks.append(block_hash)
+    # Set of the same hashes, for the membership tests
+    main_set = set(main_blocks)
 
     # Check that we reached the genesis block
     assert block.height == 0
@@ -84,17 +80,17 @@ def count_forks(validator):
 
     # Now iterate through the blocks with height below highest_justified
     longest_fork = {}
-    for block_hash, block in validator.processed.items():
-        if isinstance(block, Block):
-            if block.height <= validator.highest_justified_checkpoint.height:
-                # Get the closest parent of block from the main blockchain
-                fork_length = 0
-                while block_hash not in main_blocks:
-                    fork_length += 1
-                    block_hash = block.prevhash
-                    block = validator.processed[block_hash]
-                assert block_hash in main_blocks
-                longest_fork[block_hash] = max(longest_fork.get(block_hash, 0), fork_length)
+    for height in range(validator.highest_justified_checkpoint.height + 1):
+        for block in validator.index.blocks_at(height):
+            block_hash = block.hash
+            # Get the closest parent of block from the main blockchain
+            fork_length = 0
+            while block_hash not in main_set:
+                fork_length += 1
+                block_hash = block.prev_hash
+                block = validator.processed[block_hash]
+            assert block_hash in main_set
+            longest_fork[block_hash] = max(longest_fork.get(block_hash, 0), fork_length)
 
     count_forks = {}
     for block_hash in main_blocks:
@@ -105,47 +101,127 @@ def count_forks(validator):
     return count_forks
 
 
-def print_metrics_latency(latencies, num_tries, validator_set=VALIDATOR_IDS):
+def run_simulation(latency, validator_set=None, seed=None, num_epochs=50, scenario=None,
+                   steady_tolerance=None, steady_window=5, min_epochs=10, prune_lag=None,
+                   light_validators=(), keyed=False):
+    """Run one simulation and return its metrics, averaged over the validators.
+
+    This is a top-level function so that it can be sent to worker processes
+    (see sweep.py).
+
+    Args:
+        latency: average latency of the network
+        validator_set: ids of the validators taking part in the simulation
+            (all the validators of the scenario if None)
+        seed: seed of the simulation
+        num_epochs: number of epochs to simulate
+        scenario: parameters of the simulation (DEFAULT_SCENARIO if None)
+        steady_tolerance: if given, stop before `num_epochs` once the
+            simulation is in a steady state: after `min_epochs` epochs, when
+            none of the STEADY_METRICS moved by more than `steady_tolerance`
+            over the last `steady_window` epochs
+        steady_window: number of epochs of the steady state
+        min_epochs: number of epochs run before looking for a steady state
+        prune_lag: if given, the validators prune their history below the
+            checkpoint `prune_lag` epochs under their last finalized
+            checkpoint (see VoteValidator.prune)
+        light_validators: ids of the validators which only follow the
+            checkpoints (see validator.LightValidator). Their block counts
+            are numbers of checkpoints.
+        keyed: if True, each validator draws its blocks, votes and delays
+            from its own random streams (see network.KeyedNetwork), so the
+            results are the same as a run split between processes by
+            parallel.run_sharded with the same seed (which can't be None).
+            The draws differ from the default ones, so the results differ
+            for a given seed.
+
+    Returns:
+        dict {metric name -> value}, and the number of epochs run under
+        'epochs' if steady_tolerance is given
+    """
+    scenario = scenario or DEFAULT_SCENARIO
+    if validator_set is None:
+        validator_set = scenario.validator_ids
+    rng = SimulationRNG(seed)
+    if keyed:
+        network = KeyedNetwork(exponential_latency(latency, rng), rng, scenario)
+    else:
+        network = Network(exponential_latency(latency, rng), batched=True, rng=rng,
+                          scenario=scenario)
+    validators = [(LightValidator if i in light_validators else VoteValidator)(network, i, prune_lag)
+                  for i in validator_set]
+    # Metrics maintained during the simulation, instead of scanning the
+    # processed objects of every validator at the end
+    collector = OnlineMetrics(network)
+
+    if steady_tolerance is None:
+        # Event-driven: same results as calling network.tick() for every tick
+        network.run(scenario.epoch_ticks * num_epochs)
+        return simulation_metrics(collector, num_epochs)
+
+    # Run one epoch at a time, and keep the metrics at the end of each epoch
+    history = []
+    for epoch in range(1, num_epochs + 1):
+        network.run(scenario.epoch_ticks)
+        history.append(simulation_metrics(collector, epoch))
+        if epoch >= min_epochs and is_steady(history[-steady_window - 1:], steady_tolerance):
+            break
+    result = history[-1]
+    result['epochs'] = epoch
+    return result
+
+
+def simulation_metrics(collector, num_epochs):
+    """Returns the metrics of run_simulation, after `num_epochs` epochs."""
+    result = collector.summary()
+    del result['reorgs']
+    result['main_chain_fraction'] = (result['main_chain_size'] /
+                                     (collector.network.scenario.epoch_size * num_epochs + 1))
+    return result
+
+
+# Metrics which must be stable for a simulation to be in a steady state
+STEADY_METRICS = ['justified', 'finalized', 'main_chain_fraction']
+
+
+def is_steady(history, tolerance):
+    """Returns True if none of the STEADY_METRICS moved by more than `tolerance` in the history.
+
+    Args:
+        history: list of the metrics at the end of consecutive epochs
+        tolerance: absolute tolerance on the metrics, which are fractions
+    """
+    for metric in STEADY_METRICS:
+        values = [result[metric] for result in history]
+        if max(values) - min(values) > tolerance:
+            return False
+    return True
+
+
+# Names of the metrics returned by run_simulation, as printed
+METRIC_NAMES = [
+    ('justified', 'Justified'),
+    ('finalized', 'Finalized'),
+    ('justified_in_forks', 'Justified in forks'),
+    ('main_chain_size', 'Main chain size'),
+    ('blocks_under_main_justified', 'Blocks under main justified'),
+    ('main_chain_fraction', 'Main chain fraction'),
+]
+
+
+def try_seed(seed, i):
+    """Seed of the i-th try of every set of parameters."""
+    return None if seed is None else seed + i
+
+
+def print_metrics_latency(latencies, num_tries, validator_set=None, seed=SEED, scenario=None):
     for latency in latencies:
-        jfsum = 0.0
-        ffsum = 0.0
-        jffsum = 0.0
-        mcsum = 0.0
-        busum = 0.0
-        #fcsum = {}
-        for i in range(num_tries):
-            network = Network(exponential_latency(latency))
-            validators = [VoteValidator(network, i) for i in validator_set]
-
-            for t in range(BLOCK_PROPOSAL_TIME * EPOCH_SIZE * 50):
-                network.tick()
-                # if t % (BLOCK_PROPOSAL_TIME * EPOCH_SIZE) == 0:
-                #     filename = os.path.join(LOG_DIR, 'plot_{:03d}.png'.format(t))
-                #     plot_node_blockchains(validators, filename)
-
-            for val in validators:
-                jf, ff, jff = fraction_justified_and_finalized(val)
-                jfsum += jf
-                ffsum += ff
-                jffsum += jff
-                mcsum += main_chain_size(val)
-                busum += blocks_under_highest_justified(val)
-                #fc = count_forks(val)
-                #for l in fc.keys():
-                    #fcsum[l] = fcsum.get(l, 0) + fc[l]
+        results = [run_simulation(latency, validator_set, try_seed(seed, i), scenario=scenario)
+                   for i in range(num_tries)]
 
         print('Latency: {}'.format(latency))
-        print('Justified: {}'.format(jfsum / len(validators) / num_tries))
-        print('Finalized: {}'.format(ffsum / len(validators) / num_tries))
-        print('Justified in forks: {}'.format(jffsum / len(validators) / num_tries))
-        print('Main chain size: {}'.format(mcsum / len(validators) / num_tries))
-        print('Blocks under main justified: {}'.format(busum / len(validators) / num_tries))
-        print('Main chain fraction: {}'.format(
-            mcsum / (len(validators) * num_tries * (EPOCH_SIZE * 50 + 1))))
-        #for l in sorted(fcsum.keys()):
-            #if l > 0:
-                #frac = float(fcsum[l]) / float(fcsum[0])
-                #print('Fraction of forks of size {}: {}'.format(l, frac))
+        for key, name in METRIC_NAMES:
+            print('{}: {}'.format(name, sum(r[key] for r in results) / num_tries))
         print('')
 
 
@@ -1,32 +1,180 @@
+import copy
+import heapq
+
+import numpy as np
+
+from block import Block
+from message import CheckpointHeader
+from rng import DEFAULT_RNG
+from scenario import DEFAULT_SCENARIO
+from store import ObjectStore
+
+
 class Network(object):
     """Networking layer controlling the delivery of messages between nodes.
 
     self.msg_arrivals is a table where the keys are the time of arrival of
         messages and the values is a list of the objects received at that time
+    self.arrival_times is a heap of the keys of self.msg_arrivals, used by
+        the event-driven mode (see `run`) to jump to the next delivery
+    self.store is the store of the blocks and votes, shared by the nodes
+    self.num_delivered counts the messages delivered to the nodes
+    self.listeners is a list of objects notified of the events of the
+        simulation (see collector.NetworkListener). The nodes only emit
+        events when there is at least one listener.
+
+    In batched mode, the delays of a broadcast are drawn in one call to
+    `latency_fn.sample` and self.msg_arrivals stores one (receivers, msg)
+    entry per arrival time, where receivers is an array of node indices.
+
+    The light nodes (see validator.LightValidator) get the headers of the
+    checkpoints instead of the blocks (see `light_filter`). The delays are
+    drawn for every node as usual, so a network without light nodes is not
+    changed.
+
+    Args:
+        latency_fn: latency model (see utils), called to draw one delay
+        batched: if True, use the batched broadcast
+        rng: SimulationRNG used by the nodes (DEFAULT_RNG if None)
+        scenario: parameters of the simulation (DEFAULT_SCENARIO if None)
     """
-    def __init__(self, latency_fn):
+
+    # Whether the network sends checkpoint headers to the light nodes
+    # (LightValidator refuses the networks which don't)
+    sends_headers = True
+
+    def __init__(self, latency_fn, batched=False, rng=None, scenario=None):
+        self.scenario = scenario or DEFAULT_SCENARIO
         self.nodes = []
         self.time = 0
         self.msg_arrivals = {}
+        self.arrival_times = []
         self.latency_fn = latency_fn
+        self.batched = batched
+        self.rng = rng or DEFAULT_RNG
+        self.store = ObjectStore()
+        self.num_delivered = 0
+        self.listeners = []
+        # Mask of the light nodes, by node index (see `light_filter`)
+        self.light_mask = np.zeros(0, dtype=bool)
 
-    def broadcast(self, msg):
+    def emit(self, event, *args):
+        """Calls the method `event` of every listener with `args`."""
+        for listener in self.listeners:
+            getattr(listener, event)(*args)
+
+    def node_rng(self, node_id):
+        """Returns the random streams used by a node: the same for every node."""
+        return self.rng
+
+    def start_tick(self):
+        """Notifies the listeners when the current tick starts a new epoch."""
+        epoch_ticks = self.scenario.epoch_ticks
+        if self.listeners and self.time % epoch_ticks == 0:
+            self.emit('epoch_started', self.time // epoch_ticks)
+
+    def add_arrival(self, arrival_time, entry):
+        if arrival_time not in self.msg_arrivals:
+            self.msg_arrivals[arrival_time] = []
+            heapq.heappush(self.arrival_times, arrival_time)
+        self.msg_arrivals[arrival_time].append(entry)
+
+    def broadcast(self, msg, sender=None):
         """Broadcasts a message to all nodes in the network. (with latency)
 
         Inputs:
             msg: the message to be broadcastes (PREPARE or COMMIT).
+            sender: index of the node sending the message (unused, every
+                node is connected to every other node)
 
         Returns:
             None
         """
+        if self.batched:
+            self.broadcast_batch(msg)
+            return
+        light, light_msg = self.light_filter(msg)
         for node in self.nodes:
             # Create a different delay for every receiving node i
             # Delays need to be at least 1
             delay = self.latency_fn()
             assert delay >= 1, "delay is 0, which will lose some messages !"
-            if self.time + delay not in self.msg_arrivals:
-                self.msg_arrivals[self.time + delay] = []
-            self.msg_arrivals[self.time + delay].append((node.id, msg))
+            if light is not None and node.light:
+                if light_msg is not None:
+                    self.add_arrival(self.time + delay, (node.id, light_msg))
+                continue
+            self.add_arrival(self.time + delay, (node.id, msg))
+
+    def broadcast_batch(self, msg):
+        """Broadcasts a message to all nodes, drawing all the delays at once.
+
+        The nodes receiving the message at the same time are grouped in a
+        single array, which shares the reference to the message.
+        """
+        delays = self.latency_fn.sample(len(self.nodes))
+        assert delays.min() >= 1, "delay is 0, which will lose some messages !"
+        # Sort the receivers by delay and split them in groups of equal delay
+        order = np.argsort(delays, kind='stable')
+        unique_delays, starts = np.unique(delays[order], return_index=True)
+        light, light_msg = self.light_filter(msg)
+        for delay, receivers in zip(unique_delays.tolist(), np.split(order, starts[1:])):
+            if light is not None:
+                is_light = light[receivers]
+                if light_msg is not None and is_light.any():
+                    self.add_arrival(self.time + delay, (receivers[is_light], light_msg))
+                receivers = receivers[~is_light]
+                if not len(receivers):
+                    continue
+            self.add_arrival(self.time + delay, (receivers, msg))
+
+    def light_filter(self, msg):
+        """Light nodes (see validator.LightValidator) only get the checkpoints,
+        as CheckpointHeaders, and none of the other blocks.
+
+        Returns:
+            (mask of the light nodes by node index, message sent to the light
+            nodes instead of `msg`, or None if they don't get it), or
+            (None, None) if every node gets `msg`
+        """
+        if not isinstance(msg, Block):
+            return None, None
+        if len(self.light_mask) != len(self.nodes):
+            self.light_mask = np.array([node.light for node in self.nodes], dtype=bool)
+        if not self.light_mask.any():
+            return None, None
+        if msg.height % self.scenario.epoch_size:
+            return self.light_mask, None
+        return self.light_mask, self.checkpoint_header(msg)
+
+    def checkpoint_header(self, block):
+        """Returns the header of a checkpoint, with the hash of its checkpoint
+        parent, found by walking up the blocks of the store."""
+        parent_hash = block.prev_hash
+        for _ in range(self.scenario.epoch_size - 1):
+            parent_hash = self.store.objects[self.store.ids[parent_hash]].prev_hash
+        return CheckpointHeader(block, parent_hash)
+
+    def deliver(self):
+        """Each node deals with receiving messages of time t."""
+        if self.time not in self.msg_arrivals:
+            return
+        if self.batched:
+            # Group the messages by receiver, so that every receiver gets its
+            # whole batch at once
+            batches = {}
+            for receivers, msg in self.msg_arrivals[self.time]:
+                self.num_delivered += len(receivers)
+                for node_index in receivers.tolist():
+                    if node_index not in batches:
+                        batches[node_index] = []
+                    batches[node_index].append(msg)
+            for node_index, msgs in batches.items():
+                self.nodes[node_index].on_receive_batch(msgs)
+        else:
+            self.num_delivered += len(self.msg_arrivals[self.time])
+            for node_index, msg in self.msg_arrivals[self.time]:
+                self.nodes[node_index].on_receive(msg)
+        del self.msg_arrivals[self.time]
 
     def tick(self):
         """Simulates a tick of time.
@@ -34,10 +182,248 @@ class Network(object):
         Each node deals with receiving messages of time t.
         Increments the time of each node, and of the network.
         """
-        if self.time in self.msg_arrivals:
-            for node_index, msg in self.msg_arrivals[self.time]:
-                self.nodes[node_index].on_receive(msg)
-            del self.msg_arrivals[self.time]
+        self.start_tick()
+        self.deliver()
         for n in self.nodes:
             n.tick(self.time)
         self.time += 1
+
+    def maybe_compact(self):
+        """Called by the validators when they prune their history: compacts
+        the network once the store doubled since the last compaction."""
+        if self.store.needs_compaction():
+            self.compact()
+
+    def compact(self):
+        """Removes the objects which no node processed any more from the store,
+        and the messages in flight which every receiver would ignore."""
+        self.store.compact()
+        self.discard_stale_arrivals()
+
+    def discard_stale_arrivals(self):
+        """Drops the messages in flight which are below the horizon of their
+        receivers (see Validator.is_stale)."""
+        for arrival_time, arrivals in self.msg_arrivals.items():
+            if self.batched:
+                arrivals = [(receivers, msg) for receivers, msg in arrivals
+                            if not all(self.nodes[i].is_stale(msg) for i in receivers.tolist())]
+            else:
+                arrivals = [(node_index, msg) for node_index, msg in arrivals
+                            if not self.nodes[node_index].is_stale(msg)]
+            self.msg_arrivals[arrival_time] = arrivals
+
+    def next_event_time(self):
+        """Returns the time of the next event: a message delivery or a block proposal.
+
+        Validators only act in `tick` when a block is proposed (every
+        block_proposal_time ticks), so every tick between two events is a no-op.
+        """
+        # Drop the arrival times which were already delivered by `tick`
+        while self.arrival_times and self.arrival_times[0] not in self.msg_arrivals:
+            heapq.heappop(self.arrival_times)
+        proposal_time = self.scenario.block_proposal_time
+        next_proposal = -(-self.time // proposal_time) * proposal_time
+        if self.arrival_times:
+            return min(self.arrival_times[0], next_proposal)
+        return next_proposal
+
+    def run(self, num_ticks):
+        """Simulates `num_ticks` ticks of time in discrete-event mode.
+
+        Instead of stepping one tick at a time, jump straight to the next time
+        at which a message is delivered or a block is proposed. This gives the
+        same results as calling `tick` `num_ticks` times.
+        """
+        end_time = self.time + num_ticks
+        proposal_time = self.scenario.block_proposal_time
+        while True:
+            event_time = self.next_event_time()
+            if event_time >= end_time:
+                break
+            self.time = event_time
+            self.start_tick()
+            self.deliver()
+            if self.time % proposal_time == 0:
+                for n in self.nodes:
+                    n.tick(self.time)
+            self.time += 1
+        self.time = end_time
+
+
+class GossipNetwork(Network):
+    """Network where each node only talks to its peers in a topology.
+
+    A node relays every message it sees for the first time to its peers
+    (except the one it got it from), so a message reaches every node of a
+    connected topology after a few hops, instead of being sent directly to
+    every node. Each directed link has its own latency, drawn once.
+
+    self.peers: list, for each node index, of the (peer index, latency) of its links
+    self.seen: for each node, the set of messages it has seen, as a view of
+        the store (like the processed objects of the validators)
+    self.num_broadcasts counts the messages broadcast by the nodes,
+        self.num_sent the messages sent on the links, and
+        self.num_duplicates the messages received by a node which had
+        already seen them
+
+    The entries of self.msg_arrivals are (receiver, msg, sender) tuples. A
+    node also gets the messages it broadcasts, one tick later, as with
+    Network. The nodes relay the blocks, so they can't be light nodes.
+
+    Args:
+        topology: undirected graph over the node indices (see topology.py),
+            with a `neighbors` method such as a networkx graph
+        latency_fn: latency model, called to draw the latency of each link
+        rng: SimulationRNG used by the nodes (DEFAULT_RNG if None)
+        scenario: parameters of the simulation (DEFAULT_SCENARIO if None)
+    """
+
+    sends_headers = False
+
+    def __init__(self, topology, latency_fn, rng=None, scenario=None):
+        super(GossipNetwork, self).__init__(latency_fn, rng=rng, scenario=scenario)
+        self.peers = []
+        for node_index in range(topology.number_of_nodes()):
+            links = []
+            for peer in sorted(topology.neighbors(node_index)):
+                delay = latency_fn()
+                assert delay >= 1, "delay is 0, which will lose some messages !"
+                links.append((peer, delay))
+            self.peers.append(links)
+        self.seen = [self.store.view() for _ in self.peers]
+        self.num_broadcasts = 0
+        self.num_sent = 0
+        self.num_duplicates = 0
+
+    def relay(self, node_index, msg, sender):
+        """Sends a message to the peers of a node, except the one it came from."""
+        for peer, delay in self.peers[node_index]:
+            if peer != sender:
+                self.add_arrival(self.time + delay, (peer, msg, node_index))
+                self.num_sent += 1
+
+    def broadcast(self, msg, sender=None):
+        """Sends a message from a node to its peers.
+
+        Inputs:
+            msg: the message
+            sender: index of the node sending the message
+        """
+        assert sender is not None, "A gossip broadcast needs the sender"
+        self.num_broadcasts += 1
+        self.seen[sender][msg.hash] = msg
+        self.relay(sender, msg, None)
+        # The sender gets its own message, without relaying it again
+        self.add_arrival(self.time + 1, (sender, msg, sender))
+
+    def deliver(self):
+        """Each node deals with receiving messages of time t, and relays the new ones."""
+        if self.time not in self.msg_arrivals:
+            return
+        # Messages relayed at time t arrive at a later time, so the list of
+        # time t does not change during the loop
+        for node_index, msg, sender in self.msg_arrivals[self.time]:
+            if sender != node_index:
+                seen = self.seen[node_index]
+                if msg.hash in seen:
+                    self.num_duplicates += 1
+                    continue
+                seen[msg.hash] = msg
+                self.relay(node_index, msg, sender)
+            self.num_delivered += 1
+            self.nodes[node_index].on_receive(msg)
+        del self.msg_arrivals[self.time]
+
+    def discard_stale_arrivals(self):
+        # A node relays the messages it receives, even if it ignores them,
+        # so the messages in flight are all kept
+        pass
+
+
+class KeyedNetwork(Network):
+    """Batched network whose results don't depend on the order of the nodes.
+
+    Each node has its own random streams and latency model, and the
+    entries of self.msg_arrivals are (key, receivers, msg) tuples, where
+    key = (sender, number of the broadcast of the sender) orders the
+    deliveries of a tick. The validators can then be split between
+    processes and give the same results (see parallel.py); this is the
+    network of metrics.run_simulation with keyed=True.
+
+    Args:
+        latency_fn: latency model (see utils), copied for each node
+        rng: SimulationRNG of the simulation, with a seed
+        scenario: parameters of the simulation (DEFAULT_SCENARIO if None)
+        num_nodes: total number of nodes of the simulation (the number of
+            nodes of the network if None)
+    """
+
+    # Every node gets the blocks (see LightValidator)
+    sends_headers = False
+
+    def __init__(self, latency_fn, rng, scenario=None, num_nodes=None):
+        super(KeyedNetwork, self).__init__(latency_fn, batched=True, rng=rng, scenario=scenario)
+        self.num_nodes = num_nodes
+        self.node_rngs = {}
+        self.latency_fns = {}
+        self.num_broadcasts = {}
+        # Map {node id -> node}, for the networks which only have some of the nodes
+        self.nodes_by_id = {}
+
+    def node_rng(self, node_id):
+        if node_id not in self.node_rngs:
+            self.node_rngs[node_id] = self.rng.node(node_id)
+            latency_fn = copy.copy(self.latency_fn)
+            latency_fn.rng = self.node_rngs[node_id]
+            self.latency_fns[node_id] = latency_fn
+            self.num_broadcasts[node_id] = 0
+        return self.node_rngs[node_id]
+
+    def broadcast(self, msg, sender=None):
+        """Broadcasts a message to all the nodes, with the delays drawn by the sender."""
+        assert sender is not None, "A keyed broadcast needs the sender"
+        self.node_rng(sender)
+        key = (sender, self.num_broadcasts[sender])
+        self.num_broadcasts[sender] += 1
+        delays = self.latency_fns[sender].sample(self.num_nodes or len(self.nodes))
+        assert delays.min() >= 1, "delay is 0, which will lose some messages !"
+        order = np.argsort(delays, kind='stable')
+        unique_delays, starts = np.unique(delays[order], return_index=True)
+        for delay, receivers in zip(unique_delays.tolist(), np.split(order, starts[1:])):
+            self.send(self.time + delay, key, receivers, msg)
+
+    def send(self, arrival_time, key, receivers, msg):
+        self.add_arrival(arrival_time, (key, receivers, msg))
+
+    def deliver(self):
+        """Delivers the messages of time t, by receiver and in the order of their keys."""
+        if self.time not in self.msg_arrivals:
+            return
+        batches = {}
+        for key, receivers, msg in sorted(self.msg_arrivals.pop(self.time), key=lambda e: e[0]):
+            self.num_delivered += len(receivers)
+            for node_id in receivers.tolist():
+                if node_id not in batches:
+                    batches[node_id] = []
+                batches[node_id].append(msg)
+        for node_id in sorted(batches):
+            self.node(node_id).on_receive_batch(batches[node_id])
+
+    def node(self, node_id):
+        return self.nodes[node_id]
+
+    def discard_stale_arrivals(self):
+        for arrival_time, arrivals in self.msg_arrivals.items():
+            self.msg_arrivals[arrival_time] = [
+                (key, receivers, msg) for key, receivers, msg in arrivals
+                if not all(self.node(i).is_stale(msg) for i in receivers.tolist())]
+
+    def step(self, event_time):
+        """Runs the events of one time (see Network.run)."""
+        self.time = event_time
+        self.start_tick()
+        self.deliver()
+        if self.time % self.scenario.block_proposal_time == 0:
+            for n in self.nodes:
+                n.tick(self.time)
+        self.time += 1
@@ -0,0 +1,111 @@
+"""Test that the simulation is reproducible, that the event-driven mode
+gives the same results as stepping tick by tick, that gossip reaches
+every node, and that only the votes of the dynasties count.
+"""
+
+from block import Block
+from message import Vote
+from network import GossipNetwork, Network
+from parameters import *
+from rng import SimulationRNG
+from scenario import DEFAULT_SCENARIO, Scenario
+import topology
+from utils import exponential_latency
+from validator import VoteValidator
+
+NUM_EPOCHS = 3
+
+
+def run(seed, event_driven=True, batched=False):
+    """Run a simulation and return the state of every validator."""
+    rng = SimulationRNG(seed)
+    network = Network(exponential_latency(AVG_LATENCY, rng), batched=batched, rng=rng)
+    validators = [VoteValidator(network, i) for i in VALIDATOR_IDS]
+
+    num_ticks = BLOCK_PROPOSAL_TIME * EPOCH_SIZE * NUM_EPOCHS
+    if event_driven:
+        network.run(num_ticks)
+    else:
+        for _ in range(num_ticks):
+            network.tick()
+    assert network.time == num_ticks
+
+    return [(val.head.hash, sorted(val.justified), sorted(val.finalized), val.main_chain_size)
+            for val in validators]
+
+
+def test_same_seed_same_run():
+    assert run(1) == run(1)
+    assert run(1, batched=True) == run(1, batched=True)
+    assert run(1) != run(2)
+
+
+def test_event_driven_matches_ticks():
+    assert run(3, event_driven=True) == run(3, event_driven=False)
+
+
+def test_gossip_reaches_every_node():
+    rng = SimulationRNG(8)
+    graph = topology.random_regular(len(VALIDATOR_IDS), 4, rng.stream('topology'))
+    network = GossipNetwork(graph, exponential_latency(AVG_LATENCY, rng), rng=rng)
+    validators = [VoteValidator(network, i) for i in VALIDATOR_IDS]
+    network.run(BLOCK_PROPOSAL_TIME * EPOCH_SIZE * 2)
+
+    # The blocks of the first epoch had an epoch to reach every node
+    first_blocks = [obj.hash for obj in network.store.objects
+                    if isinstance(obj, Block) and obj.height <= EPOCH_SIZE]
+    assert len(first_blocks) == EPOCH_SIZE + 1
+    for val in validators:
+        assert all(block_hash in val.processed for block_hash in first_blocks)
+    # Each node relays a message at most once to each of its peers
+    assert network.num_sent <= network.num_broadcasts * len(VALIDATOR_IDS) * 4
+
+
+def test_blocks_never_get_the_genesis_hash():
+    # Including the seed of the genesis block of the default scenario
+    for seed in [0, 1, DEFAULT_SCENARIO.genesis_seed]:
+        rng = SimulationRNG(seed)
+        network = Network(exponential_latency(AVG_LATENCY, rng), batched=True, rng=rng)
+        for i in VALIDATOR_IDS:
+            VoteValidator(network, i)
+        network.run(BLOCK_PROPOSAL_TIME * EPOCH_SIZE * NUM_EPOCHS)
+        # Every block proposed is in the store, besides the genesis block
+        blocks = [obj for obj in network.store.objects if isinstance(obj, Block)]
+        assert len(blocks) == EPOCH_SIZE * NUM_EPOCHS + 1
+
+
+def test_votes_out_of_dynasty_are_ignored():
+    # Only the validators 0 to 3 are in the genesis dynasty
+    scenario = Scenario(num_validators=4, validator_ids=range(8), epoch_size=5,
+                        block_proposal_time=10, genesis_seed=2)
+    rng = SimulationRNG(1)
+    network = Network(exponential_latency(5, rng), batched=True, rng=rng, scenario=scenario)
+    validators = [VoteValidator(network, i) for i in scenario.validator_ids]
+    val = validators[0]
+    # The votes broadcast, and whether their sender is in the dynasties of
+    # their target
+    broadcasts = []
+    broadcast = network.broadcast
+
+    def record(msg, sender=None):
+        if isinstance(msg, Vote):
+            voter = validators[msg.sender]
+            broadcasts.append(voter.in_dynasty(msg.sender, voter.processed[msg.target]))
+        broadcast(msg, sender)
+    network.broadcast = record
+    network.run(scenario.epoch_ticks * 6)
+
+    # The validators vote whether or not they are in the dynasties of the
+    # target, but only the votes of the dynasties are counted
+    assert True in broadcasts and False in broadcasts
+    assert len(val.finalized) > 2
+    votes = [obj for obj in network.store.objects if isinstance(obj, Vote)]
+    blocks = dict((obj.hash, obj) for obj in network.store.objects if isinstance(obj, Block))
+    counted = {}
+    for vote in votes:
+        if val.in_dynasty(vote.sender, blocks[vote.target]):
+            counted[(vote.source, vote.target)] = counted.get((vote.source, vote.target), 0) + 1
+    for validator in validators:
+        for source, targets in validator.vote_count.items():
+            for target, count in targets.items():
+                assert count <= counted[(source, target)]
@@ -0,0 +1,337 @@
+"""Run one simulation on several cores, with the validators split in shards.
+
+Every message takes at least one tick to arrive (see Network.broadcast), so
+what a validator does at time t can't change what another validator does
+before t + 1: this is the lookahead of a conservative parallel simulation.
+The shards run in worker processes, in rounds. At the start of a round,
+the shards exchange the messages sent to validators of other shards
+through shared memory buffers, and the times of their next events, behind
+one barrier. Then each shard runs its events on its own, up to the time at
+which another shard could send it a message: one tick after the next event
+of the other shards, or one tick after a message it sends to them arrives.
+
+The results can't depend on the shards, so the randomness and the order of
+the deliveries don't depend on the order in which the validators run:
+- each validator draws its blocks, votes and delays from its own random
+  streams (see SimulationRNG.node)
+- the messages received at the same tick are delivered in a canonical
+  order, by sender and by number of the broadcast of the sender
+This is network.KeyedNetwork, which metrics.run_simulation uses with
+keyed=True: a sharded run gives exactly the same metrics as
+`run_simulation(..., keyed=True)` with the same seed.
+
+Run `python3 parallel.py` to compare the single-process and sharded runs.
+"""
+
+import argparse
+import io
+import multiprocessing
+from multiprocessing import shared_memory
+import queue
+import struct
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from collector import OnlineMetrics, summarize
+from loopback import MessagePickler, MessageUnpickler
+from metrics import run_simulation
+from network import KeyedNetwork
+from rng import SimulationRNG
+from scenario import DEFAULT_SCENARIO, Scenario
+from utils import exponential_latency
+from validator import VoteValidator
+
+# Size of the buffer of the messages sent by a shard in one round
+BUFFER_SIZE = 1 << 24
+# Header of a buffer: offset of the messages to each shard
+OFFSET = struct.Struct('<q')
+# Time of the shards without any event
+NEVER = np.iinfo(np.int64).max
+
+
+class ShardNetwork(KeyedNetwork):
+    """KeyedNetwork of the validators of one shard.
+
+    The messages sent to the validators of other shards wait in
+    self.outgoing until the end of the round (see `write_outgoing`).
+
+    Args:
+        bounds: ids of the first validator of each shard, and the total
+            number of validators
+        shard: index of the shard
+    """
+    def __init__(self, latency_fn, rng, scenario, bounds, shard):
+        super(ShardNetwork, self).__init__(latency_fn, rng, scenario, num_nodes=bounds[-1])
+        self.bounds = np.array(bounds)
+        self.shard = shard
+        self.outgoing = [[] for _ in range(len(bounds) - 1)]
+        # Earliest arrival of the messages in self.outgoing
+        self.outgoing_time = None
+
+    def node(self, node_id):
+        return self.nodes_by_id[node_id]
+
+    def send(self, arrival_time, key, receivers, msg):
+        # Split the receivers by shard (they are sorted by delay, not by id)
+        receivers = np.sort(receivers)
+        splits = np.searchsorted(receivers, self.bounds[1:-1])
+        for shard, part in enumerate(np.split(receivers, splits)):
+            if not len(part):
+                continue
+            if shard == self.shard:
+                self.add_arrival(arrival_time, (key, part, msg))
+            else:
+                self.outgoing[shard].append((arrival_time, key, part, msg))
+                if self.outgoing_time is None or arrival_time < self.outgoing_time:
+                    self.outgoing_time = arrival_time
+
+    def write_outgoing(self, buf):
+        """Writes the messages to the other shards in a shared buffer, and empties self.outgoing.
+
+        The buffer starts with the offsets of the pickled messages of each
+        shard, followed by the pickles.
+        """
+        num_shards = len(self.outgoing)
+        offset = OFFSET.size * (num_shards + 1)
+        for shard, messages in enumerate(self.outgoing):
+            OFFSET.pack_into(buf, OFFSET.size * shard, offset)
+            if messages and shard != self.shard:
+                data = io.BytesIO()
+                MessagePickler(data, self.scenario).dump(messages)
+                data = data.getbuffer()
+                assert offset + len(data) <= len(buf), "The shared buffer is too small"
+                buf[offset:offset + len(data)] = data
+                offset += len(data)
+        OFFSET.pack_into(buf, OFFSET.size * num_shards, offset)
+        self.outgoing = [[] for _ in range(num_shards)]
+        self.outgoing_time = None
+
+    def read_incoming(self, buf):
+        """Adds the messages sent to this shard in the shared buffer of another shard."""
+        start = OFFSET.unpack_from(buf, OFFSET.size * self.shard)[0]
+        end = OFFSET.unpack_from(buf, OFFSET.size * (self.shard + 1))[0]
+        if start == end:
+            return
+        messages = MessageUnpickler(io.BytesIO(bytes(buf[start:end])), self.scenario).load()
+        for arrival_time, key, receivers, msg in messages:
+            # The validators of this shard share the objects of the store
+            id_ = self.store.ids.get(msg.hash)
+            if id_ is not None:
+                msg = self.store.objects[id_]
+            self.add_arrival(arrival_time, (key, receivers, msg))
+
+    def run_until(self, end_time):
+        """Runs the events before `end_time`, and before one tick after the
+        arrival of the messages sent to other shards."""
+        while True:
+            event_time = self.next_event_time()
+            if self.outgoing_time is not None:
+                end_time = min(end_time, self.outgoing_time + 1)
+            if event_time >= end_time:
+                return
+            self.step(event_time)
+
+
+def shard_worker(shard, bounds, latency, seed, scenario, num_ticks, prune_lag, buffer_names,
+                 times_name, barrier, results):
+    """Runs the validators of one shard, in rounds with the other shards.
+
+    Every round, the shard writes its outgoing messages, the time of its
+    next event and the earliest arrival of these messages in the buffers of
+    the parity of the round, and waits at the barrier. It then reads the
+    messages sent to it, and runs its events (see ShardNetwork.run_until)
+    until one tick after the earliest time at which another shard can act:
+    its next event, or the arrival of a message sent to it. The buffers
+    alternate, so a shard can't overwrite a buffer which another shard is
+    still reading.
+    """
+    num_shards = len(bounds) - 1
+    buffers = [[shared_memory.SharedMemory(name) for name in names] for names in buffer_names]
+    times_shm = shared_memory.SharedMemory(times_name)
+    # times[parity, 0] are the next event times of the shards, and
+    # times[parity, 1] the earliest arrivals of the messages they sent
+    times = np.ndarray((2, 2, num_shards), dtype=np.int64, buffer=times_shm.buf)
+    others = [other for other in range(num_shards) if other != shard]
+
+    try:
+        rng = SimulationRNG(seed)
+        network = ShardNetwork(exponential_latency(latency, rng), rng, scenario, bounds, shard)
+        for i in range(bounds[shard], bounds[shard + 1]):
+            network.nodes_by_id[i] = VoteValidator(network, i, prune_lag)
+        collector = OnlineMetrics(network)
+
+        round_ = 0
+        while True:
+            parity = round_ % 2
+            times[parity, 0, shard] = network.next_event_time()
+            times[parity, 1, shard] = (NEVER if network.outgoing_time is None
+                                       else network.outgoing_time)
+            network.write_outgoing(buffers[parity][shard].buf)
+            barrier.wait()
+            for other in others:
+                network.read_incoming(buffers[parity][other].buf)
+            # Earliest time at which each shard can act: its next event, or
+            # the arrival of a message sent by another shard
+            event_times, sent = times[parity].tolist()
+            next_times = [min([event_times[i]] + sent[:i] + sent[i + 1:])
+                          for i in range(num_shards)]
+            if min(next_times) >= num_ticks:
+                break
+            end_time = min([num_ticks] + [next_times[other] + 1 for other in others])
+            network.run_until(end_time)
+            round_ += 1
+
+        network.time = num_ticks
+        rows = [(val.id, collector.validator_summary(val)) for val in network.nodes]
+        # The time spent waiting at the barrier is not CPU time
+        results.put((shard, rows, time.process_time(), round_))
+    except threading.BrokenBarrierError:
+        # Another shard failed
+        results.put((shard, None, None, None))
+    except Exception:
+        # Release the other shards, which would wait at the barrier forever,
+        # and send the traceback to run_sharded (the exception itself may
+        # not be picklable)
+        barrier.abort()
+        results.put((shard, None, traceback.format_exc(), None))
+    finally:
+        del times
+        times_shm.close()
+        for names in buffers:
+            for shm in names:
+                shm.close()
+
+
+def metrics_from_rows(rows, scenario, num_epochs):
+    """Metrics of run_simulation, from the summaries of the validators sorted by id."""
+    result = summarize([row for _, row in sorted(rows, key=lambda r: r[0])])
+    del result['reorgs']
+    result['main_chain_fraction'] = (result['main_chain_size'] /
+                                     (scenario.epoch_size * num_epochs + 1))
+    return result
+
+
+def get_result(results, processes, poll_time=1.0):
+    """Waits for the next result of a shard worker.
+
+    Raises:
+        RuntimeError if a worker exited without sending its result (killed,
+        or out of memory for instance), instead of waiting forever
+    """
+    while True:
+        try:
+            return results.get(timeout=poll_time)
+        except queue.Empty:
+            pass
+        # A worker which exited may still have a result on its way
+        exited = [p for p in processes if p.exitcode is not None and p.exitcode != 0]
+        if exited and results.empty():
+            raise RuntimeError('Shard worker {} exited with code {}'.format(
+                processes.index(exited[0]), exited[0].exitcode))
+
+
+def run_sharded(latency, seed=0, num_epochs=50, scenario=None, num_shards=2, prune_lag=None,
+                buffer_size=BUFFER_SIZE):
+    """Runs a simulation with the validators split in `num_shards` worker processes.
+
+    The arguments are those of metrics.run_simulation, which runs the same
+    simulation in one process with keyed=True.
+
+    Returns:
+        dict {metric name -> value}, the same as
+        `metrics.run_simulation(latency, seed=seed, num_epochs=num_epochs,
+        scenario=scenario, prune_lag=prune_lag, keyed=True)`, and the number
+        of rounds of the shards under 'rounds' and the largest CPU time of
+        a shard, in seconds, under 'cpu_time'. With a core per shard, the
+        run can't take less than this CPU time.
+
+    Raises:
+        RuntimeError if a worker fails, with the traceback of the worker
+    """
+    scenario = scenario or DEFAULT_SCENARIO
+    num_validators = len(scenario.validator_ids)
+    assert scenario.validator_ids == list(range(num_validators)), \
+        "The ids of the validators need to be their indices"
+    bounds = [num_validators * shard // num_shards for shard in range(num_shards + 1)]
+    num_ticks = scenario.epoch_ticks * num_epochs
+
+    buffers = [[shared_memory.SharedMemory(create=True, size=buffer_size)
+                for _ in range(num_shards)] for _ in range(2)]
+    times_shm = shared_memory.SharedMemory(create=True, size=2 * 2 * num_shards * 8)
+    barrier = multiprocessing.Barrier(num_shards)
+    results = multiprocessing.Queue()
+    buffer_names = [[shm.name for shm in parity] for parity in buffers]
+    processes = [multiprocessing.Process(
+        target=shard_worker,
+        args=(shard, bounds, latency, seed, scenario, num_ticks, prune_lag, buffer_names,
+              times_shm.name, barrier, results))
+        for shard in range(num_shards)]
+    try:
+        for process in processes:
+            process.start()
+        rows = []
+        num_rounds = 0
+        cpu_time = 0.0
+        errors = []
+        for _ in processes:
+            shard, shard_rows, info, shard_rounds = get_result(results, processes)
+            if shard_rows is None:
+                # The shards stopped by the aborted barrier have no traceback
+                if info is not None:
+                    errors.append('Shard {} failed:\n{}'.format(shard, info))
+                continue
+            rows.extend(shard_rows)
+            num_rounds = shard_rounds
+            cpu_time = max(cpu_time, info)
+        if errors or len(rows) < num_validators:
+            raise RuntimeError('\n'.join(errors) or 'The barrier of the shards was aborted')
+        for process in processes:
+            process.join()
+    finally:
+        barrier.abort()
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        for shm in [times_shm] + buffers[0] + buffers[1]:
+            shm.close()
+            shm.unlink()
+
+    result = metrics_from_rows(rows, scenario, num_epochs)
+    result['rounds'] = num_rounds
+    result['cpu_time'] = cpu_time
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', type=int, nargs='+', default=[2, 4],
+                        help='numbers of shards to try (default: 2 4)')
+    parser.add_argument('--latency', type=int, default=100)
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--validators', type=int,
+                        help='number of validators of the dynasties (default: NUM_VALIDATORS)')
+    args = parser.parse_args()
+    scenario = DEFAULT_SCENARIO if args.validators is None else Scenario(args.validators)
+
+    print('Cores: {}'.format(multiprocessing.cpu_count()))
+    start = time.time()
+    reference = run_simulation(args.latency, seed=args.seed, num_epochs=args.epochs,
+                               scenario=scenario, keyed=True)
+    reference_time = time.time() - start
+    print('1 process: {:.1f} seconds'.format(reference_time))
+    for num_shards in args.shards:
+        start = time.time()
+        result = run_sharded(args.latency, args.seed, args.epochs, scenario, num_shards)
+        elapsed = time.time() - start
+        rounds = result.pop('rounds')
+        cpu_time = result.pop('cpu_time')
+        print('{} shards: {:.1f} seconds, speedup {:.2f}, {} rounds, same results: {}, '
+              'CPU time of the busiest shard {:.1f} seconds'.format(
+                  num_shards, elapsed, reference_time / elapsed, rounds, result == reference,
+                  cpu_time))
@@ -0,0 +1,52 @@
+"""Test that a sharded simulation gives the results of the single-process one,
+and that it fails cleanly when a worker fails."""
+
+import multiprocessing
+import os
+
+import pytest
+
+from metrics import run_simulation
+from parallel import get_result, run_sharded
+from scenario import Scenario
+
+
+def test_sharded_equals_keyed():
+    scenario = Scenario(num_validators=6, epoch_size=5, block_proposal_time=20, genesis_seed=4)
+    for prune_lag in [None, 1]:
+        reference = run_simulation(50, seed=3, num_epochs=6, scenario=scenario,
+                                   prune_lag=prune_lag, keyed=True)
+        assert reference['finalized'] > 0
+        for num_shards in [1, 2, 3]:
+            result = run_sharded(50, seed=3, num_epochs=6, scenario=scenario,
+                                 num_shards=num_shards, prune_lag=prune_lag)
+            rounds = result.pop('rounds')
+            assert result.pop('cpu_time') > 0
+            assert result == reference
+        # The shards run several event times per round
+        assert 0 < rounds < scenario.epoch_ticks * 6
+
+
+def test_keyed_is_reproducible():
+    scenario = Scenario(num_validators=4, epoch_size=5, block_proposal_time=20, genesis_seed=4)
+    assert run_simulation(30, seed=1, num_epochs=4, scenario=scenario, keyed=True) == \
+        run_simulation(30, seed=1, num_epochs=4, scenario=scenario, keyed=True)
+
+
+def test_worker_failure_raises():
+    scenario = Scenario(num_validators=4, epoch_size=5, block_proposal_time=20, genesis_seed=4)
+    before = set(os.listdir('/dev/shm'))
+    # The messages between the shards don't fit in the shared buffers
+    with pytest.raises(RuntimeError) as error:
+        run_sharded(30, seed=1, num_epochs=4, scenario=scenario, buffer_size=64)
+    assert 'The shared buffer is too small' in str(error.value)
+    assert set(os.listdir('/dev/shm')) <= before
+
+
+def test_killed_worker_raises():
+    process = multiprocessing.Process(target=os._exit, args=(3,))
+    process.start()
+    process.join()
+    with pytest.raises(RuntimeError) as error:
+        get_result(multiprocessing.Queue(), [process], poll_time=0.1)
+    assert 'exited with code 3' in str(error.value)
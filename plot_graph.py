@@ -1,13 +1,46 @@
-import random
+"""Plot the checkpoint trees of the validators.
+
+Validators often see the same checkpoint tree, so the trees are grouped and
+each distinct view is drawn once. The positions of the checkpoints are kept
+between epochs by a Layout, since the trees only grow: a checkpoint is
+drawn at the height of its epoch, and keeps its horizontal position.
+
+The trees are extracted as lightweight data (see `checkpoint_views`), which
+can be drawn in a background process (see PlotWorker) or written as JSON or
+DOT for offline rendering.
+"""
+
+import json
+import multiprocessing
 
 import matplotlib.pyplot as plt
 import networkx as nx
-import pygraphviz  # used in the layout
 
-from block import Block
 from parameters import *
 
 
+def checkpoint_tree(node):
+    """Get the checkpoint tree of a node, from its indexes of the checkpoints.
+
+    Args:
+        node: Node
+
+    Returns:
+        tuple of (checkpoint hash, parent hash, epoch, finalized), sorted by
+        epoch and hash. The parent of the genesis block (or of the horizon of
+        a validator which prunes its history) is None.
+    """
+    ancestry = node.ancestry
+    tree = []
+    for epoch in node.index.epochs():
+        for block_hash in sorted(block.hash for block in node.index.checkpoints_at(epoch)):
+            jumps = ancestry.jumps[block_hash]
+            # The parent of the horizon of a pruned validator is not in the index
+            parent_hash = jumps[0] if jumps and jumps[0] in ancestry else None
+            tree.append((block_hash, parent_hash, epoch, block_hash in node.finalized))
+    return tuple(tree)
+
+
 def node_checkpoints(node):
     """Get all the checkpoints of a given node, i.e. all the blocks with height % EPOCH_LENGHT == 0
 
@@ -17,70 +50,181 @@ def node_checkpoints(node):
     Returns:
         G: networkx directed graph of the checkpoints
     """
-    G = nx.DiGraph()
-
-    # Use node.get_checkpoint_parent(block)
-    for block_hash in node.processed:
-        if isinstance(node.processed[block_hash], Block):
-            block = node.processed[block_hash]
-            # Check that the block is a checkpoint
-            if block.height % EPOCH_SIZE == 0:
-                G.add_node(block_hash)
+    return tree_graph(checkpoint_tree(node))
 
-                # Check if this is not the genesis block
-                if block.height > 0:
-                    previous_checkpoint = node.get_checkpoint_parent(block)
-                    previous_checkpoint_hash = previous_checkpoint.hash
 
-                    G.add_edge(block_hash, previous_checkpoint_hash)
+def tree_graph(tree):
+    """Returns the networkx graph of a checkpoint tree, with edges to the parents."""
+    G = nx.DiGraph()
+    for block_hash, parent_hash, _, _ in tree:
+        G.add_node(block_hash)
+        if parent_hash is not None:
+            G.add_edge(block_hash, parent_hash)
 
     # Check that G is a tree
     assert G.number_of_nodes() == G.number_of_edges() + 1
     return G
 
 
-def plot_node_blockchains(nodes, image_file):
-    """Plot each node's blockchain in a subplot
-    """
-    num_nodes = len(nodes)
+def checkpoint_views(nodes):
+    """Group the nodes which have the same checkpoint tree.
 
-    graphs = []
+    Returns:
+        list of (ids of the nodes, checkpoint tree), by order of the first
+        node of each group
+    """
+    groups = {}
     for node in nodes:
-        graphs.append(node_checkpoints(node))
-
-    #sqrt = int(num_nodes ** 0.5) + 1
-    nrows = 1
-    ncols = num_nodes
-
-    plt.figure(figsize=(40, 20))
-    for i in range(num_nodes):
-        node = nodes[i]
-        G = graphs[i]
-
-        # Create list of committable nodes
-        colors = []
-        pos = {}
-        labels = {}
-        for block_hash in list(G.nodes()):
-            block = node.processed[block_hash]
-            # FOR PREPARE-COMMIT
-            # if block_hash in node.committable:
-            # FOR VOTE
-            if node.is_finalized(block_hash):
-                color = 'r'
-            # TODO: add color for PREPARED checkpoints
+        tree = checkpoint_tree(node)
+        if tree not in groups:
+            groups[tree] = []
+        groups[tree].append(node.id)
+    return [(ids, tree) for tree, ids in groups.items()]
+
+
+def format_ids(ids, max_length=40):
+    """Formats a list of ids compactly, e.g. "0-4, 7", cut after `max_length` characters."""
+    ranges = []
+    for i in sorted(ids):
+        if ranges and ranges[-1][1] == i - 1:
+            ranges[-1][1] = i
+        else:
+            ranges.append([i, i])
+    res = ', '.join(str(a) if a == b else '{}-{}'.format(a, b) for a, b in ranges)
+    if len(res) > max_length:
+        res = res[:max_length - 3] + '...'
+    return res
+
+
+class Layout(object):
+    """Positions of the checkpoints, kept between plots.
+
+    A checkpoint is placed at y = -epoch. The first child of a checkpoint
+    gets the column of its parent, and each other child a new column, so a
+    checkpoint never moves once placed and the same checkpoint has the same
+    position in every view.
+    """
+    def __init__(self):
+        # Map {checkpoint hash -> (x, y)}
+        self.positions = {}
+        # Set of the checkpoints which already have a child in their column
+        self.column_taken = set()
+        self.num_columns = 0
+
+    def update(self, tree):
+        """Places the new checkpoints of a tree, and returns the positions of its checkpoints."""
+        for block_hash, parent_hash, epoch, _ in tree:
+            if block_hash in self.positions:
+                continue
+            if parent_hash is None or parent_hash in self.column_taken:
+                x = self.num_columns
+                self.num_columns += 1
             else:
-                color = 'b'
-            colors.append(color)
+                x = self.positions[parent_hash][0]
+            if parent_hash is not None:
+                self.column_taken.add(parent_hash)
+            self.positions[block_hash] = (x, -epoch)
+        return {block_hash: self.positions[block_hash] for block_hash, _, _, _ in tree}
 
-            height = block.height // EPOCH_SIZE
-            pos[block_hash] = (random.gauss(0, 1), height)
 
-        ax = plt.subplot(nrows, ncols, i + 1)
-        ax.set_title("Node %d" % node.id)
+def draw_views(views, image_file, layout=None):
+    """Plot each distinct checkpoint tree in a subplot.
 
-        pos = nx.drawing.nx_agraph.pygraphviz_layout(G, prog='dot')
-        nx.draw(G, arrows=True, pos=pos, node_color=colors, labels=labels)
+    Args:
+        views: list of (ids of the nodes, checkpoint tree), see checkpoint_views
+        image_file: file of the image
+        layout: Layout kept between plots (a new one if None)
+    """
+    layout = layout or Layout()
+    ncols = len(views)
+    plt.figure(figsize=(min(4 * ncols, 40), 10))
+    for i, (ids, tree) in enumerate(views):
+        G = tree_graph(tree)
+        pos = layout.update(tree)
+        # Finalized checkpoints in red, the others in blue
+        finalized = {block_hash: is_finalized for block_hash, _, _, is_finalized in tree}
+        colors = ['r' if finalized[block_hash] else 'b' for block_hash in G.nodes()]
+
+        ax = plt.subplot(1, ncols, i + 1)
+        ax.set_title("{} nodes: {}".format(len(ids), format_ids(ids, 4 * 80 // ncols)))
+        nx.draw(G, arrows=True, pos=pos, node_color=colors, node_size=50, ax=ax)
 
     plt.savefig(image_file)
     plt.close()
+
+
+def plot_node_blockchains(nodes, image_file, layout=None):
+    """Plot the checkpoint tree of the nodes, once per distinct tree."""
+    draw_views(checkpoint_views(nodes), image_file, layout)
+
+
+def views_to_json(views):
+    return {'views': [{'nodes': list(ids),
+                       'checkpoints': [{'hash': str(block_hash),
+                                        'parent': None if parent_hash is None else str(parent_hash),
+                                        'epoch': epoch,
+                                        'finalized': is_finalized}
+                                       for block_hash, parent_hash, epoch, is_finalized in tree]}
+                      for ids, tree in views]}
+
+
+def views_to_dot(views):
+    """Returns the views in the DOT language, one cluster per view."""
+    lines = ['digraph checkpoints {', '  rankdir=BT;']
+    for i, (ids, tree) in enumerate(views):
+        lines.append('  subgraph cluster_{} {{'.format(i))
+        lines.append('    label="Nodes {}";'.format(format_ids(ids)))
+        for block_hash, parent_hash, epoch, is_finalized in tree:
+            lines.append('    v{}_{} [label="{}", color={}];'.format(
+                i, block_hash, epoch, 'red' if is_finalized else 'blue'))
+            if parent_hash is not None:
+                lines.append('    v{}_{} -> v{}_{};'.format(i, block_hash, i, parent_hash))
+        lines.append('  }')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_views(views, filename):
+    """Writes the views for offline rendering, as DOT if filename ends with .dot, else as JSON."""
+    with open(filename, 'w') as f:
+        if filename.endswith('.dot'):
+            f.write(views_to_dot(views))
+        else:
+            json.dump(views_to_json(views), f)
+
+
+def plot_worker(queue):
+    # Render without a display, and keep the layout between the plots
+    plt.switch_backend('Agg')
+    layout = Layout()
+    while True:
+        job = queue.get()
+        if job is None:
+            return
+        views, image_file = job
+        draw_views(views, image_file, layout)
+
+
+class PlotWorker(object):
+    """Draws the checkpoint trees in a background process.
+
+    `plot` only extracts the checkpoint trees of the nodes and sends them to
+    the worker, so the simulation does not wait for matplotlib.
+
+    Args:
+        max_pending: maximum number of plots waiting in the queue, after
+            which `plot` waits for the worker
+    """
+    def __init__(self, max_pending=4):
+        self.queue = multiprocessing.Queue(max_pending)
+        self.process = multiprocessing.Process(target=plot_worker, args=(self.queue,))
+        self.process.daemon = True
+        self.process.start()
+
+    def plot(self, nodes, image_file):
+        self.queue.put((checkpoint_views(nodes), image_file))
+
+    def close(self):
+        """Waits for the plots in the queue to be drawn and stops the worker."""
+        self.queue.put(None)
+        self.process.join()
@@ -0,0 +1,123 @@
+"""Test the extraction, grouping, layout and export of the checkpoint trees."""
+
+import json
+import os
+
+from network import Network
+import plot_graph
+from plot_graph import Layout, checkpoint_tree, checkpoint_views, format_ids
+from rng import SimulationRNG
+from scenario import Scenario
+from utils import exponential_latency
+from validator import VoteValidator
+
+SCENARIO = Scenario(num_validators=6, epoch_size=5, block_proposal_time=10, genesis_seed=3)
+
+# Checkpoint trees as (hash, parent hash, epoch, finalized): genesis 1 with a
+# chain 1 <- 2 <- 4, and a fork 1 <- 3
+TREE = ((1, None, 0, True), (2, 1, 1, True), (4, 2, 2, False))
+FORKED_TREE = ((1, None, 0, True), (2, 1, 1, True), (3, 1, 1, False), (4, 2, 2, False))
+
+
+def new_network(latency, seed=1):
+    rng = SimulationRNG(seed)
+    network = Network(exponential_latency(latency, rng), batched=True, rng=rng, scenario=SCENARIO)
+    for i in SCENARIO.validator_ids:
+        VoteValidator(network, i)
+    return network
+
+
+def test_layout_keeps_positions():
+    layout = Layout()
+    positions = layout.update(TREE[:2])
+    assert positions == {1: (0, 0), 2: (0, -1)}
+    # The new checkpoints don't move the ones already placed
+    positions = layout.update(FORKED_TREE)
+    assert positions == {1: (0, 0), 2: (0, -1), 3: (1, -1), 4: (0, -2)}
+    # Another view of the same checkpoints gets the same positions
+    assert layout.update(((1, None, 0, True), (3, 1, 1, True))) == {1: (0, 0), 3: (1, -1)}
+
+
+def test_identical_trees_are_grouped_once():
+    network = new_network(5)
+    # Before any block, every validator only has the genesis block
+    views = checkpoint_views(network.nodes)
+    assert len(views) == 1
+    assert views[0][0] == list(SCENARIO.validator_ids)
+
+    network = new_network(40)
+    network.run(SCENARIO.epoch_ticks * 4)
+    views = checkpoint_views(network.nodes)
+    trees = [tree for _, tree in views]
+    assert len(set(trees)) == len(trees)
+    assert sorted(i for ids, _ in views for i in ids) == list(SCENARIO.validator_ids)
+    for ids, tree in views:
+        for i in ids:
+            assert checkpoint_tree(network.nodes[i]) == tree
+
+
+def test_checkpoint_tree_of_a_validator():
+    network = new_network(5)
+    network.run(SCENARIO.epoch_ticks * 3)
+    val = network.nodes[0]
+    tree = checkpoint_tree(val)
+    assert tree[0] == (SCENARIO.genesis.hash, None, 0, True)
+    for block_hash, parent_hash, epoch, is_finalized in tree[1:]:
+        assert val.processed[block_hash].epoch == epoch
+        assert val.get_checkpoint_parent(val.processed[block_hash]).hash == parent_hash
+        assert is_finalized == (block_hash in val.finalized)
+    plot_graph.tree_graph(tree)
+
+
+def test_export_views(tmp_path):
+    views = [([0, 1, 2, 4], TREE), ([3], FORKED_TREE)]
+    assert format_ids([0, 1, 2, 4]) == '0-2, 4'
+
+    assert views_json(views) == {'views': [
+        {'nodes': [0, 1, 2, 4], 'checkpoints': [
+            {'hash': '1', 'parent': None, 'epoch': 0, 'finalized': True},
+            {'hash': '2', 'parent': '1', 'epoch': 1, 'finalized': True},
+            {'hash': '4', 'parent': '2', 'epoch': 2, 'finalized': False}]},
+        {'nodes': [3], 'checkpoints': [
+            {'hash': '1', 'parent': None, 'epoch': 0, 'finalized': True},
+            {'hash': '2', 'parent': '1', 'epoch': 1, 'finalized': True},
+            {'hash': '3', 'parent': '1', 'epoch': 1, 'finalized': False},
+            {'hash': '4', 'parent': '2', 'epoch': 2, 'finalized': False}]}]}
+    plot_graph.write_views(views, str(tmp_path / 'views.json'))
+    with open(str(tmp_path / 'views.json')) as f:
+        assert json.load(f) == views_json(views)
+
+    dot = plot_graph.views_to_dot(views[:1])
+    assert dot == '\n'.join([
+        'digraph checkpoints {',
+        '  rankdir=BT;',
+        '  subgraph cluster_0 {',
+        '    label="Nodes 0-2, 4";',
+        '    v0_1 [label="0", color=red];',
+        '    v0_2 [label="1", color=red];',
+        '    v0_2 -> v0_1;',
+        '    v0_4 [label="2", color=blue];',
+        '    v0_4 -> v0_2;',
+        '  }',
+        '}']) + '\n'
+    plot_graph.write_views(views, str(tmp_path / 'views.dot'))
+    with open(str(tmp_path / 'views.dot')) as f:
+        assert f.read() == plot_graph.views_to_dot(views)
+
+
+def views_json(views):
+    # Through a JSON round trip, as written by write_views
+    return json.loads(json.dumps(plot_graph.views_to_json(views)))
+
+
+def test_plot_worker(tmp_path):
+    network = new_network(40)
+    network.run(SCENARIO.epoch_ticks * 2)
+    worker = plot_graph.PlotWorker()
+    image_files = [str(tmp_path / 'plot_{}.png'.format(i)) for i in range(2)]
+    for image_file in image_files:
+        worker.plot(network.nodes, image_file)
+        network.run(SCENARIO.epoch_ticks)
+    worker.close()
+    assert worker.process.exitcode == 0
+    assert all(os.path.getsize(image_file) > 0 for image_file in image_files)
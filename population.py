@@ -0,0 +1,428 @@
+"""Vectorized simulation of a population of identical honest validators.
+
+Instead of one VoteValidator object per validator, the state of all the
+validators is kept in NumPy arrays of shape (validators, checkpoints) or
+(validators, links), and the deliveries of each tick are processed as array
+operations.
+
+The latency of utils.exponential_latency, 1 + int(Exp(1) * avg_latency), is a
+geometric distribution: after the first tick, a message in flight arrives at
+each tick with probability q = 1 - exp(-1 / avg_latency), whatever the time
+it already spent in flight. So instead of drawing the delay of every vote for
+every receiver, the engine keeps for each receiver the number of votes in
+flight for each link (source -> target), and draws the number of votes
+arriving between two ticks with a binomial distribution.
+
+The engine follows the rules of VoteValidator:
+- the proposer builds its block on the highest block it has seen which
+  descends from its highest justified checkpoint
+- a validator votes (highest justified checkpoint -> checkpoint) when it first
+  sees a checkpoint of a higher epoch, if the checkpoint descends from its
+  highest justified checkpoint
+- a checkpoint is justified once a validator received strictly more than
+  `threshold` votes from a justified source, and has seen the checkpoint
+- the source of a supermajority link to a direct child is finalized
+
+The fork choice is simpler than VoteValidator.check_head, which builds on
+the last block processed rather than on the highest one. The two engines
+agree while the latency stays under the block proposal time; above it,
+forks are frequent and the PopulationEngine overestimates the finalized
+fraction and the main chain (see `compare_engines`). The engine warns when
+it is run outside this range (see MAX_LATENCY_RATIO).
+"""
+
+import heapq
+import math
+import time
+import warnings
+
+import numpy as np
+
+from parameters import *
+from rng import SimulationRNG
+from scenario import DEFAULT_SCENARIO
+
+NEVER = np.iinfo(np.int64).max
+# Highest average latency, as a multiple of the block proposal time, at which
+# the PopulationEngine gives the metrics of the object-based engine
+MAX_LATENCY_RATIO = 1.0
+
+
+def grow(array, size, axis, fill):
+    """Returns `array` with at least `size` entries along `axis`, doubling its capacity."""
+    capacity = array.shape[axis]
+    if size <= capacity:
+        return array
+    shape = list(array.shape)
+    shape[axis] = max(size, 2 * capacity)
+    new_array = np.full(shape, fill, dtype=array.dtype)
+    index = [slice(None)] * array.ndim
+    index[axis] = slice(0, capacity)
+    new_array[tuple(index)] = array
+    return new_array
+
+
+class PopulationEngine(object):
+    """Simulation of `num_validators` validators with NumPy arrays.
+
+    The epoch size and the block proposal time are those of the scenario.
+
+    Args:
+        num_validators: number of validators
+        avg_latency: average latency of the network (see
+                     utils.exponential_latency), the one of the scenario if None
+        voters: ids of the validators whose votes count (all the validators if None)
+        threshold: a link is a supermajority link with strictly more than
+                   `threshold` votes (2/3 of the voters if None)
+        num_proposers: validators 0 to num_proposers - 1 propose the blocks in
+                       round robin (all the validators if None)
+        seed: seed of the simulation
+        resolution: number of ticks between two draws of the votes in flight
+                    (and at every block proposal). 1 is exact, higher values
+                    trade accuracy for speed.
+        scenario: parameters of the simulation (DEFAULT_SCENARIO if None)
+
+    Warns:
+        RuntimeWarning if avg_latency is above MAX_LATENCY_RATIO times the
+        block proposal time, where the fork choice of the engine makes its
+        metrics diverge from VoteValidator's
+    """
+    def __init__(self, num_validators, avg_latency=None, voters=None, threshold=None,
+                 num_proposers=None, seed=None, resolution=1, scenario=None):
+        V = num_validators
+        self.num_validators = V
+        self.scenario = scenario or DEFAULT_SCENARIO
+        self.epoch_size = self.scenario.epoch_size
+        self.proposal_time = self.scenario.block_proposal_time
+        if avg_latency is None:
+            avg_latency = self.scenario.avg_latency
+        if avg_latency > MAX_LATENCY_RATIO * self.proposal_time:
+            warnings.warn('PopulationEngine: the latency {} is above the block proposal time {}, '
+                          'the metrics overestimate the finalized fraction and the main chain '
+                          '(see population.MAX_LATENCY_RATIO)'.format(
+                              avg_latency, self.proposal_time), RuntimeWarning, stacklevel=2)
+        self.q = 1.0 - math.exp(-1.0 / avg_latency)
+        self.rng = SimulationRNG(seed).latency_np
+        self.eligible = np.zeros(V, dtype=bool)
+        self.eligible[list(range(V)) if voters is None else list(voters)] = True
+        if threshold is None:
+            threshold = (int(self.eligible.sum()) * 2) // 3
+        self.threshold = threshold
+        self.num_proposers = V if num_proposers is None else num_proposers
+        self.resolution = resolution
+        # Next tick to simulate, and last tick at which the votes in flight were drawn
+        self.time = 0
+        self.last_update = 0
+
+        # Blocks, indexed from genesis = 0
+        self.parent = [-1]
+        self.height = np.zeros(16, dtype=np.int64)
+        self.checkpoint_of = np.zeros(16, dtype=np.int64)  # closest checkpoint ancestor
+        self.num_blocks = 1
+        # Time at which each validator processes each block
+        self.arrival = np.full((V, 16), NEVER, dtype=np.int64)
+        self.arrival[:, 0] = 0
+
+        # Checkpoints, indexed from genesis = 0
+        self.cp_block = [0]
+        self.cp_epoch = [0]
+        # self.cp_ancestor[c, e]: checkpoint ancestor of c at epoch e (-1 if none)
+        self.cp_ancestor = np.full((4, 4), -1, dtype=np.int64)
+        self.cp_ancestor[0, 0] = 0
+        self.seen = np.zeros((V, 4), dtype=bool)
+        self.justified = np.zeros((V, 4), dtype=bool)
+        self.finalized = np.zeros((V, 4), dtype=bool)
+        self.seen[:, 0] = self.justified[:, 0] = self.finalized[:, 0] = True
+        self.highest_justified = np.zeros(V, dtype=np.int64)
+        self.highest_justified_epoch = np.zeros(V, dtype=np.int64)
+        self.current_epoch = np.zeros(V, dtype=np.int64)
+        # Heap of the times at which some validators see a new checkpoint,
+        # and map {time -> checkpoints seen at that time}
+        self.sighting_times = []
+        self.sightings = {}
+
+        # Links (source -> target), with the votes received and in flight per validator
+        self.links = {}
+        self.link_source = []
+        self.link_target = []
+        self.arrived = np.zeros((V, 4), dtype=np.int64)
+        self.in_flight = np.zeros((V, 4), dtype=np.int64)
+        # Links which may still justify their target for some validators
+        self.live = set()
+
+    def add_block(self, parent, arrival):
+        b = self.num_blocks
+        self.num_blocks += 1
+        self.parent.append(parent)
+        self.height = grow(self.height, b + 1, 0, 0)
+        self.checkpoint_of = grow(self.checkpoint_of, b + 1, 0, 0)
+        self.arrival = grow(self.arrival, b + 1, 1, NEVER)
+        self.height[b] = self.height[parent] + 1
+        self.arrival[:, b] = arrival
+        if self.height[b] % self.epoch_size == 0:
+            self.checkpoint_of[b] = self.add_checkpoint(b, self.checkpoint_of[parent])
+        else:
+            self.checkpoint_of[b] = self.checkpoint_of[parent]
+        return b
+
+    def add_checkpoint(self, block, parent_checkpoint):
+        c = len(self.cp_block)
+        epoch = self.height[block] // self.epoch_size
+        self.cp_block.append(block)
+        self.cp_epoch.append(epoch)
+        self.cp_ancestor = grow(grow(self.cp_ancestor, c + 1, 0, -1), epoch + 1, 1, -1)
+        self.cp_ancestor[c] = self.cp_ancestor[parent_checkpoint]
+        self.cp_ancestor[c, epoch] = c
+        for name in ('seen', 'justified', 'finalized'):
+            setattr(self, name, grow(getattr(self, name), c + 1, 1, False))
+        return c
+
+    def get_link(self, source, target):
+        if (source, target) not in self.links:
+            l = len(self.link_source)
+            self.links[(source, target)] = l
+            self.link_source.append(source)
+            self.link_target.append(target)
+            self.arrived = grow(self.arrived, l + 1, 1, 0)
+            self.in_flight = grow(self.in_flight, l + 1, 1, 0)
+        return self.links[(source, target)]
+
+    def head(self, v, t):
+        """Highest block seen by validator v which descends from its highest justified checkpoint."""
+        n = self.num_blocks
+        candidates = self.arrival[v, :n] <= t
+        checkpoints = self.checkpoint_of[:n]
+        candidates &= (self.cp_ancestor[checkpoints, self.highest_justified_epoch[v]] ==
+                       self.highest_justified[v])
+        heights = np.where(candidates, self.height[:n], -1)
+        return int(np.argmax(heights))
+
+    def propose(self, t):
+        proposer = (t // self.proposal_time) % self.num_proposers
+        if proposer >= self.num_validators:
+            return
+        parent = self.head(proposer, t)
+        # The block is processed after its parent, and immediately by the proposer
+        arrival = np.maximum(t + self.rng.geometric(self.q, self.num_validators),
+                             self.arrival[:, parent])
+        arrival[proposer] = t
+        b = self.add_block(parent, arrival)
+        if self.height[b] % self.epoch_size == 0:
+            c = self.checkpoint_of[b]
+            self.see_checkpoint(c, np.array([proposer]))
+            for sighting_time in np.unique(arrival).tolist():
+                if sighting_time > t:
+                    if sighting_time not in self.sightings:
+                        self.sightings[sighting_time] = []
+                        heapq.heappush(self.sighting_times, sighting_time)
+                    self.sightings[sighting_time].append(c)
+
+    def see_checkpoint(self, c, validators):
+        """The validators see checkpoint c for the first time, and maybe vote."""
+        self.seen[validators, c] = True
+        epoch = self.cp_epoch[c]
+        validators = validators[self.current_epoch[validators] < epoch]
+        self.current_epoch[validators] = epoch
+        # Vote if the checkpoint descends from the highest justified checkpoint
+        sources = self.highest_justified[validators]
+        on_chain = self.cp_ancestor[c, self.highest_justified_epoch[validators]] == sources
+        sources = sources[on_chain & self.eligible[validators]]
+        for source, count in zip(*np.unique(sources, return_counts=True)):
+            l = self.get_link(int(source), c)
+            # Every validator receives the votes
+            self.in_flight[:, l] += count
+            self.live.add(l)
+
+    def update_votes(self, t):
+        """Draw the votes in flight which arrived between the last update and t."""
+        dt = t - self.last_update
+        self.last_update = t
+        if dt == 0 or not self.live:
+            return
+        links = np.array(sorted(self.live))
+        in_flight = self.in_flight[:, links]
+        rows, cols = np.nonzero(in_flight)
+        if len(rows) == 0:
+            return
+        arrived = self.rng.binomial(in_flight[rows, cols], 1.0 - (1.0 - self.q) ** dt)
+        self.in_flight[rows, links[cols]] -= arrived
+        self.arrived[rows, links[cols]] += arrived
+        # Once a validator received a supermajority for a link, the next votes
+        # don't change anything: stop following them
+        done = self.arrived[rows, links[cols]] > self.threshold
+        self.in_flight[rows[done], links[cols[done]]] = 0
+
+    def justify(self):
+        """Justify and finalize the checkpoints with a supermajority link from a justified source."""
+        while self.live:
+            links = np.array(sorted(self.live))
+            sources = np.array(self.link_source)[links]
+            targets = np.array(self.link_target)[links]
+            ok = ((self.arrived[:, links] > self.threshold) & self.seen[:, targets] &
+                  self.justified[:, sources] & ~self.justified[:, targets])
+            if not ok.any():
+                break
+            for j in np.flatnonzero(ok.any(axis=0)):
+                validators = np.flatnonzero(ok[:, j])
+                source, target = sources[j], targets[j]
+                self.justified[validators, target] = True
+                epoch = self.cp_epoch[target]
+                higher = validators[self.highest_justified_epoch[validators] < epoch]
+                self.highest_justified[higher] = target
+                self.highest_justified_epoch[higher] = epoch
+                if self.cp_epoch[source] == epoch - 1:
+                    self.finalized[validators, source] = True
+
+        # Stop following the links which can't justify their target anymore
+        for l in list(self.live):
+            target = self.link_target[l]
+            if (not self.in_flight[:, l].any() and
+                    not ((self.arrived[:, l] > self.threshold) & ~self.justified[:, target]).any()):
+                self.live.discard(l)
+
+    def step(self, t):
+        """Simulates tick t: deliveries, then block proposal."""
+        proposal = t % self.proposal_time == 0
+        if proposal or t >= self.last_update + self.resolution:
+            self.update_votes(t)
+        if t in self.sightings:
+            for c in self.sightings.pop(t):
+                self.see_checkpoint(c, np.flatnonzero(self.arrival[:, self.cp_block[c]] == t))
+        self.justify()
+        if proposal:
+            self.propose(t)
+
+    def next_event_time(self):
+        while self.sighting_times and self.sighting_times[0] not in self.sightings:
+            heapq.heappop(self.sighting_times)
+        times = [-(-self.time // self.proposal_time) * self.proposal_time]
+        if self.sighting_times:
+            times.append(self.sighting_times[0])
+        if any(self.in_flight[:, l].any() for l in self.live):
+            times.append(self.last_update + self.resolution)
+        return max(min(times), self.time)
+
+    def run(self, num_ticks):
+        """Simulates `num_ticks` ticks, jumping between the ticks where something happens."""
+        end_time = self.time + num_ticks
+        while True:
+            t = self.next_event_time()
+            if t >= end_time:
+                break
+            self.step(t)
+            self.time = t + 1
+        # Deliver the votes up to the last tick
+        if self.last_update < end_time - 1:
+            self.update_votes(end_time - 1)
+            self.justify()
+        self.time = end_time
+
+    def metrics(self, num_epochs):
+        """Same metrics as metrics.run_simulation, averaged over the validators."""
+        V = self.num_validators
+        C = len(self.cp_block)
+        chains = self.cp_ancestor[self.highest_justified]
+        on_chain = chains >= 0
+        rows = np.arange(V)[:, None]
+        count_total = self.highest_justified_epoch + 1
+        count_justified = (self.justified[rows, np.maximum(chains, 0)] & on_chain).sum(axis=1)
+        count_finalized = (self.finalized[rows, np.maximum(chains, 0)] & on_chain).sum(axis=1)
+        count_forked_justified = self.justified[:, :C].sum(axis=1) - count_justified
+
+        main_chain_size = self.highest_justified_epoch * self.epoch_size + 1
+        n = self.num_blocks
+        blocks_under = ((self.arrival[:, :n] < self.time) &
+                        (self.height[None, :n] < main_chain_size[:, None])).sum(axis=1)
+        return {
+            'justified': float(np.mean(count_justified / count_total)),
+            'finalized': float(np.mean(count_finalized / count_total)),
+            'justified_in_forks': float(np.mean(count_forked_justified / count_total)),
+            'main_chain_size': float(np.mean(main_chain_size)),
+            'blocks_under_main_justified': float(np.mean(blocks_under)),
+            'main_chain_fraction': (float(np.mean(main_chain_size)) /
+                                    (self.epoch_size * num_epochs + 1)),
+        }
+
+
+def run_population(latency, num_validators, seed=None, num_epochs=50, scenario=None, **kwargs):
+    """Run one simulation with the PopulationEngine and return its metrics
+    (same as metrics.run_simulation).
+
+    Other keyword arguments are passed to the PopulationEngine.
+    """
+    engine = PopulationEngine(num_validators, latency, seed=seed, scenario=scenario, **kwargs)
+    engine.run(engine.scenario.epoch_ticks * num_epochs)
+    return engine.metrics(num_epochs)
+
+
+def scenario_config(scenario, num_validators):
+    """Keyword arguments of the PopulationEngine configured like the
+    VoteValidators of a scenario.
+
+    The votes count if the sender is in the dynasties of the blocks after
+    genesis (initial validators and next dynasty of genesis), the threshold
+    is the one of the scenario, and validators 0 to num_validators - 1 of
+    the scenario propose the blocks.
+    """
+    genesis = scenario.genesis
+    voters = (genesis.current_dynasty.validators | genesis.next_dynasty.validators) & \
+        set(range(num_validators))
+    return {
+        'voters': voters,
+        'threshold': scenario.threshold,
+        'num_proposers': scenario.num_validators,
+        'scenario': scenario,
+    }
+
+
+def compare_engines(latency, num_tries, validator_set=None, seed=0, num_epochs=20,
+                    scenario=None):
+    """Runs the same simulations with the object-based engine and the PopulationEngine.
+
+    Returns:
+        (list of the metrics of run_simulation, list of the metrics of
+        run_population), one entry per try
+    """
+    from metrics import run_simulation, try_seed
+
+    scenario = scenario or DEFAULT_SCENARIO
+    if validator_set is None:
+        validator_set = scenario.validator_ids
+    config = scenario_config(scenario, len(validator_set))
+    objects = [run_simulation(latency, validator_set, try_seed(seed, i), num_epochs,
+                              scenario=scenario)
+               for i in range(num_tries)]
+    population = [run_population(latency, len(validator_set), try_seed(seed, i), num_epochs,
+                                 **config)
+                  for i in range(num_tries)]
+    return objects, population
+
+
+def cross_check(latencies, num_tries, validator_set=None, seed=0, num_epochs=20, scenario=None):
+    """Print the metrics of the PopulationEngine next to the object-based engine
+    (see `compare_engines`)."""
+    from metrics import METRIC_NAMES
+    from sweep import confidence_interval
+
+    for latency in latencies:
+        objects, population = compare_engines(latency, num_tries, validator_set, seed,
+                                              num_epochs, scenario)
+        print('Latency: {}'.format(latency))
+        print('{:28s} | {:22s} | {:22s}'.format('', 'objects', 'population'))
+        for key, name in METRIC_NAMES:
+            print('{:28s} | {:10.4f} +/- {:7.4f} | {:10.4f} +/- {:7.4f}'.format(
+                name, *(confidence_interval([r[key] for r in objects]) +
+                        confidence_interval([r[key] for r in population]))))
+        print('')
+
+
+if __name__ == '__main__':
+    cross_check([10, 100, 300], num_tries=5)
+
+    for num_validators in [1000, 10000]:
+        for resolution in [1, 5]:
+            start = time.time()
+            res = run_population(AVG_LATENCY, num_validators, seed=0, resolution=resolution)
+            print('{} validators, 50 epochs, resolution {}: {:.1f} seconds, justified {:.3f}, '
+                  'finalized {:.3f}'.format(num_validators, resolution, time.time() - start,
+                                            res['justified'], res['finalized']))
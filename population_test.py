@@ -0,0 +1,44 @@
+"""Test that the PopulationEngine gives the metrics of the object-based engine."""
+
+import warnings
+
+import pytest
+
+from population import PopulationEngine, compare_engines, scenario_config
+from scenario import Scenario
+
+SCENARIO = Scenario(num_validators=20, epoch_size=5, block_proposal_time=20, genesis_seed=3)
+
+
+def mean(results, key):
+    return sum(r[key] for r in results) / len(results)
+
+
+def test_population_matches_objects():
+    # Up to the limit of the engine: a latency of the block proposal time
+    for latency in [5, 15, 20]:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            objects, population = compare_engines(latency, 8, seed=0, num_epochs=15,
+                                                   scenario=SCENARIO)
+        for key in ['justified', 'finalized']:
+            assert abs(mean(objects, key) - mean(population, key)) < 0.03
+        assert abs(mean(objects, 'main_chain_fraction') -
+                   mean(population, 'main_chain_fraction')) < 0.1
+
+
+def test_population_warns_above_its_limit():
+    with pytest.warns(RuntimeWarning):
+        PopulationEngine(len(SCENARIO.validator_ids), SCENARIO.block_proposal_time + 1,
+                         scenario=SCENARIO)
+
+
+def test_population_uses_the_scenario():
+    config = scenario_config(SCENARIO, len(SCENARIO.validator_ids))
+    assert config['threshold'] == SCENARIO.threshold
+    engine = PopulationEngine(len(SCENARIO.validator_ids), 5, seed=1, **config)
+    engine.run(SCENARIO.epoch_ticks * 4)
+    # One block every block_proposal_time ticks, and a checkpoint every epoch_size blocks
+    assert engine.num_blocks == 4 * SCENARIO.epoch_size + 1
+    assert len(engine.cp_block) > 1
+    assert all(engine.height[block] % SCENARIO.epoch_size == 0 for block in engine.cp_block)
@@ -0,0 +1,40 @@
+"""Test that pruning the history below finality does not change the simulation."""
+
+from collector import OnlineMetrics
+from network import Network
+from rng import SimulationRNG
+from scenario import Scenario
+from utils import exponential_latency
+from validator import VoteValidator
+
+SCENARIO = Scenario(num_validators=10)
+
+
+def run(prune_lag, num_epochs=40):
+    rng = SimulationRNG(4)
+    network = Network(exponential_latency(20, rng), batched=True, rng=rng, scenario=SCENARIO)
+    for i in SCENARIO.validator_ids:
+        VoteValidator(network, i, prune_lag)
+    collector = OnlineMetrics(network)
+    network.run(SCENARIO.epoch_ticks * num_epochs)
+    return network, collector
+
+
+def test_pruned_simulation_matches():
+    network, collector = run(None)
+    pruned_network, pruned_collector = run(2)
+    assert pruned_collector.summary() == collector.summary()
+    assert pruned_collector.fork_histogram() == collector.fork_histogram()
+    for val, pruned in zip(network.nodes, pruned_network.nodes):
+        assert pruned.head.hash == val.head.hash
+        assert pruned.finalized <= val.finalized
+        assert pruned.horizon.epoch > 30
+        assert pruned.horizon.hash in pruned.finalized
+        assert len(pruned.tails) < 10
+        assert len(pruned.processed) < len(val.processed) // 4
+        assert not pruned.slashings
+    # Once compacted, the store only keeps the last epochs
+    pruned_network.compact()
+    assert len(pruned_network.store) < len(network.store) // 4
+    pruned_network.run(SCENARIO.epoch_ticks * 5)
+    assert all(val.horizon.epoch > 35 for val in pruned_network.nodes)
@@ -0,0 +1,70 @@
+import random
+
+import numpy as np
+
+
+class SimulationRNG(object):
+    """Random number generators of one simulation.
+
+    Each use of randomness gets its own stream, derived from the seed of the
+    simulation, so that a run can be reproduced from its seed and drawing
+    more latencies does not change the hashes of the blocks for instance.
+
+    self.block_hash: stream for the hashes of the blocks
+    self.vote_id: stream for the hashes of the votes
+    self.latency: stream for the network latencies
+    self.latency_np: NumPy stream for the batched network latencies
+    self.dynasty_key: key for the dynasty sampled at each block (see `dynasty`)
+
+    Args:
+        seed: seed of the simulation (non-negative integer).
+              If None, the streams are seeded from the OS entropy.
+    """
+    def __init__(self, seed=None):
+        self.seed = seed
+        self.block_hash = self.stream('block_hash')
+        self.vote_id = self.stream('vote_id')
+        self.latency = self.stream('latency')
+        if seed is None:
+            self.latency_np = np.random.default_rng()
+        else:
+            self.latency_np = np.random.default_rng(np.random.SeedSequence(seed).spawn(1)[0])
+        self.dynasty_key = self.stream('dynasty').getrandbits(64)
+
+    def stream(self, name):
+        """Returns a new random stream, seeded by the seed of the simulation and its name."""
+        if self.seed is None:
+            return random.Random()
+        return random.Random('{}:{}'.format(self.seed, name))
+
+    def genesis_hash(self):
+        """Returns the hash of a genesis block.
+
+        It is drawn from its own stream, so the blocks of a simulation with
+        the same seed as the genesis block don't get its hash.
+        """
+        return self.stream('genesis').randint(1, 10**30)
+
+    def node(self, node_id):
+        """Returns the random streams of one node, derived from the seed of the simulation.
+
+        The draws of a node then only depend on what the node does, and not
+        on the order in which the nodes run (see network.KeyedNetwork). The
+        streams of the nodes share the dynasty key of the simulation.
+        """
+        assert self.seed is not None, "The streams of the nodes need a seed"
+        rng = SimulationRNG(self.stream('node:{}'.format(node_id)).getrandbits(63))
+        rng.dynasty_key = self.dynasty_key
+        return rng
+
+    def dynasty(self, block_hash):
+        """Returns the generator used to sample the next dynasty at a block.
+
+        It only depends on the block hash (and the key of the simulation), so
+        that every validator can generate the same dynasty.
+        """
+        return random.Random(block_hash ^ self.dynasty_key)
+
+
+# Streams used when no SimulationRNG is given
+DEFAULT_RNG = SimulationRNG()
@@ -0,0 +1,84 @@
+"""Configuration of a simulation.
+
+A Scenario holds the parameters of a simulation and its genesis block. The
+blocks, the validators and the network of a simulation all refer to the same
+scenario, so simulations with different parameters can run side by side in
+the same process (in a sweep on a pool of workers for instance).
+
+The default values come from parameters.py, and DEFAULT_SCENARIO is the
+scenario of the simulations which are not given one.
+"""
+
+import random
+
+from block import Block
+from parameters import *
+from rng import SimulationRNG
+
+
+class Scenario(object):
+    """Parameters of a simulation.
+
+    Args:
+        num_validators: number of validators at each checkpoint
+        validator_ids: set of validators (2 * num_validators ids if None)
+        initial_validators: validators of the genesis dynasty
+            (num_validators ids if None)
+        block_proposal_time: a block is proposed every block_proposal_time ticks
+        epoch_size: a checkpoint every epoch_size blocks
+        avg_latency: average latency of the network (in number of ticks)
+        genesis_seed: seed of the genesis block of the scenario. If None, it
+            is derived from the other parameters, so that scenarios with
+            different parameters get different genesis blocks, while the
+            same parameters give the same genesis block in every process.
+    """
+    def __init__(self, num_validators=NUM_VALIDATORS, validator_ids=None,
+                 initial_validators=None, block_proposal_time=BLOCK_PROPOSAL_TIME,
+                 epoch_size=EPOCH_SIZE, avg_latency=AVG_LATENCY, genesis_seed=None):
+        self.num_validators = num_validators
+        if validator_ids is None:
+            validator_ids = range(0, num_validators * 2)
+        self.validator_ids = list(validator_ids)
+        if initial_validators is None:
+            initial_validators = range(0, num_validators)
+        self.initial_validators = list(initial_validators)
+        self.block_proposal_time = block_proposal_time
+        self.epoch_size = epoch_size
+        self.avg_latency = avg_latency
+        # A checkpoint is justified by more than `threshold` votes
+        self.threshold = (num_validators * 2) // 3
+        # Number of ticks of an epoch
+        self.epoch_ticks = block_proposal_time * epoch_size
+        if genesis_seed is None:
+            genesis_seed = self.parameters_seed()
+        self.genesis_seed = genesis_seed
+        self.genesis = Block(rng=SimulationRNG(genesis_seed), scenario=self)
+
+    def parameters_seed(self):
+        """Returns a seed derived from the parameters of the scenario."""
+        parameters = (self.num_validators, self.validator_ids, self.initial_validators,
+                      self.block_proposal_time, self.epoch_size, self.avg_latency)
+        # random.Random hashes a string seed with SHA-512, unlike the salted
+        # hash() of Python
+        return random.Random('genesis:{!r}'.format(parameters)).getrandbits(63)
+
+    @classmethod
+    def from_parameters(cls):
+        """Returns the scenario of the values of parameters.py."""
+        return cls(NUM_VALIDATORS, VALIDATOR_IDS, INITIAL_VALIDATORS,
+                   BLOCK_PROPOSAL_TIME, EPOCH_SIZE, AVG_LATENCY)
+
+    def __reduce_ex__(self, protocol):
+        # The default scenario is pickled by name, so that it stays the same
+        # object in the processes which unpickle it
+        if self is DEFAULT_SCENARIO:
+            return 'DEFAULT_SCENARIO'
+        return object.__reduce_ex__(self, protocol)
+
+    def __repr__(self):
+        return ('Scenario(num_validators={}, block_proposal_time={}, epoch_size={}, '
+                'avg_latency={})'.format(self.num_validators, self.block_proposal_time,
+                                         self.epoch_size, self.avg_latency))
+
+
+DEFAULT_SCENARIO = Scenario.from_parameters()
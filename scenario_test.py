@@ -0,0 +1,65 @@
+"""Test that simulations of different scenarios can run in the same process."""
+
+import pickle
+
+from metrics import run_simulation
+from network import Network
+from rng import SimulationRNG
+from scenario import DEFAULT_SCENARIO, Scenario
+from utils import exponential_latency
+from validator import ROOT, VoteValidator
+
+
+def new_network(scenario, seed):
+    rng = SimulationRNG(seed)
+    network = Network(exponential_latency(scenario.avg_latency, rng), batched=True, rng=rng,
+                      scenario=scenario)
+    for i in scenario.validator_ids:
+        VoteValidator(network, i)
+    return network
+
+
+def state(network):
+    return [(val.head.hash, sorted(val.justified), sorted(val.finalized)) for val in network.nodes]
+
+
+def test_interleaved_scenarios():
+    small = Scenario(num_validators=4, epoch_size=5, avg_latency=5, genesis_seed=1)
+    large = Scenario(num_validators=8, block_proposal_time=50, avg_latency=20, genesis_seed=2)
+    assert small.genesis.hash != large.genesis.hash
+
+    # Run both scenarios one epoch at a time, alternately
+    networks = [new_network(small, 3), new_network(large, 3)]
+    for epoch in range(1, 4):
+        for network in networks:
+            network.run(network.scenario.epoch_ticks * epoch)
+
+    for network in networks:
+        alone = new_network(network.scenario, 3)
+        alone.run(network.time)
+        assert state(alone) == state(network)
+        assert all(val.scenario is network.scenario for val in network.nodes)
+        assert network.nodes[0].head.epoch > 0
+
+
+def test_pickle_scenario():
+    assert pickle.loads(pickle.dumps(DEFAULT_SCENARIO)) is DEFAULT_SCENARIO
+    assert DEFAULT_SCENARIO.genesis is ROOT
+
+    scenario = Scenario(num_validators=4, epoch_size=5)
+    copy = pickle.loads(pickle.dumps(scenario))
+    assert copy.genesis.scenario is copy
+    assert copy.genesis.hash == scenario.genesis.hash
+    assert (run_simulation(10, seed=0, num_epochs=3, scenario=copy) ==
+            run_simulation(10, seed=0, num_epochs=3, scenario=scenario))
+
+
+def test_default_genesis_seed():
+    small = Scenario(num_validators=4, epoch_size=5)
+    assert Scenario(num_validators=4, epoch_size=5).genesis.hash == small.genesis.hash
+    assert Scenario(num_validators=4, epoch_size=10).genesis.hash != small.genesis.hash
+    assert Scenario(num_validators=4, epoch_size=5, avg_latency=20).genesis.hash != \
+        small.genesis.hash
+    assert Scenario(num_validators=4, epoch_size=5, genesis_seed=1).genesis.hash != \
+        small.genesis.hash
+    assert Scenario.from_parameters().genesis.hash == DEFAULT_SCENARIO.genesis.hash
@@ -1,6 +1,15 @@
 """Simulator function for running the validators and network.
+
+Options:
+    --report FILE: write a per-epoch report of the instrumentation of the
+        network and the validators (JSON, or CSV if FILE ends with .csv)
+    --profile FILE: run the main loop under cProfile and save the profile
+    --no-plot: do not plot the blockchains at every epoch
+    --headless: write the checkpoint trees as JSON at every epoch, instead
+        of plotting them
 """
 
+import argparse
 import os
 import time
 
@@ -9,24 +18,81 @@ from utils import exponential_latency
 from network import Network
 from message import Vote
 from validator import VoteValidator
-from plot_graph import plot_node_blockchains
+from rng import SimulationRNG
+from scenario import DEFAULT_SCENARIO
+from instrumentation import Instrumentation, profile
+from plot_graph import PlotWorker, checkpoint_views, write_views
 from parameters import *
 
 
+def main_loop(network, validators, num_epochs, plot=None):
+    """Runs the simulation epoch by epoch.
+
+    Args:
+        network: network of the validators, whose scenario gives the length
+            of the epochs
+        plot: if given, called with the validators and the time right after
+            the first tick of each epoch
+    """
+    epoch_ticks = network.scenario.epoch_ticks
+    for epoch in range(num_epochs):
+        t = epoch * epoch_ticks
+        start = time.time()
+        # Plot the blockchains right after the first tick of the epoch
+        network.run(1)
+        if plot is not None:
+            plot(validators, t)
+
+        # Jump through the rest of the epoch event by event
+        network.run(epoch_ticks - 1)
+        print("Took {} seconds for epoch {}".format(time.time() - start, epoch))
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--report', help='per-epoch instrumentation report (.json or .csv)')
+    parser.add_argument('--profile', help='file where the cProfile profile is saved')
+    parser.add_argument('--no-plot', action='store_true', help='do not plot the blockchains')
+    parser.add_argument('--headless', action='store_true',
+                        help='write the checkpoint trees as JSON instead of plotting them')
+    args = parser.parse_args()
+
     LOG_DIR = "plot"
-    if not os.path.exists(LOG_DIR):
+    if not args.no_plot and not os.path.exists(LOG_DIR):
         os.makedirs(LOG_DIR)
 
-    network = Network(exponential_latency(AVG_LATENCY))
-    validators = [VoteValidator(network, i) for i in VALIDATOR_IDS]
+    scenario = DEFAULT_SCENARIO
+    rng = SimulationRNG(SEED)
+    network = Network(exponential_latency(scenario.avg_latency, rng), rng=rng, scenario=scenario)
+    validators = [VoteValidator(network, i) for i in scenario.validator_ids]
+    instrumentation = Instrumentation(network) if args.report else None
+
+    # The plots are drawn by a background process, so the simulation does
+    # not wait for matplotlib
+    worker = None
+    if args.no_plot:
+        plot = None
+    elif args.headless:
+        plot = lambda nodes, t: write_views(
+            checkpoint_views(nodes), os.path.join(LOG_DIR, "graph_{:03d}.json".format(t)))
+    else:
+        worker = PlotWorker()
+        plot = lambda nodes, t: worker.plot(
+            nodes, os.path.join(LOG_DIR, "plot_{:03d}.png".format(t)))
 
     num_epochs = 50
-    for t in range(BLOCK_PROPOSAL_TIME * EPOCH_SIZE * num_epochs):
-        start = time.time()
-        network.tick()
-        print("Took {} seconds for one tick".format(time.time() - start))
+    run = lambda: main_loop(network, validators, num_epochs, plot)
+    if args.profile:
+        profile(run, args.profile)
+    else:
+        run()
+    if worker is not None:
+        worker.close()
 
-        if t % (BLOCK_PROPOSAL_TIME * EPOCH_SIZE) == 0:
-            filename = os.path.join(LOG_DIR, "plot_{:03d}.png".format(t))
-            plot_node_blockchains(validators, filename)
+    if instrumentation is not None:
+        instrumentation.finish()
+        if args.report.endswith('.csv'):
+            instrumentation.write_csv(args.report)
+        else:
+            instrumentation.write_json(args.report)
@@ -0,0 +1,19 @@
+"""Test that the main loop of the simulator follows the scenario of the network."""
+
+from network import Network
+from rng import SimulationRNG
+from scenario import Scenario
+from simulator import main_loop
+from utils import exponential_latency
+from validator import VoteValidator
+
+
+def test_main_loop_uses_the_scenario():
+    scenario = Scenario(num_validators=4, epoch_size=3, block_proposal_time=7, genesis_seed=1)
+    rng = SimulationRNG(1)
+    network = Network(exponential_latency(5, rng), rng=rng, scenario=scenario)
+    validators = [VoteValidator(network, i) for i in scenario.validator_ids]
+    times = []
+    main_loop(network, validators, 4, lambda nodes, t: times.append((t, network.time)))
+    assert times == [(epoch * 21, epoch * 21 + 1) for epoch in range(4)]
+    assert network.time == 4 * 21
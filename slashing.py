@@ -0,0 +1,110 @@
+import bisect
+
+
+class SlashingEvidence(object):
+    """Proof that a validator broke one of the two slashing conditions.
+
+    Args:
+        kind: DOUBLE_VOTE or SURROUND_VOTE
+        vote: the vote which was just received
+        conflicting_vote: the past vote of the same sender it conflicts with
+    """
+    DOUBLE_VOTE = 'double_vote'
+    SURROUND_VOTE = 'surround_vote'
+
+    def __init__(self, kind, vote, conflicting_vote):
+        self.kind = kind
+        self.vote = vote
+        self.conflicting_vote = conflicting_vote
+
+    @property
+    def sender(self):
+        return self.vote.sender
+
+    def __repr__(self):
+        return 'SlashingEvidence({}, sender={}, ({} -> {}) vs ({} -> {}))'.format(
+            self.kind, self.sender, self.vote.epoch_source, self.vote.epoch_target,
+            self.conflicting_vote.epoch_source, self.conflicting_vote.epoch_target)
+
+
+class SenderVotes(object):
+    """Index of the votes accepted from one sender, to check the slashing
+    conditions in O(log n).
+
+    - double votes: map {epoch_target -> vote}
+    - surround votes: the accepted votes sorted by (epoch_source, epoch_target).
+      They can't surround each other, so they are also sorted by epoch_target:
+      the votes with a lower source have a lower target, and a new vote
+      only needs to be compared with its neighbours in the list.
+    - pruned votes (see `prune`): only the pruned vote with the highest
+      source is kept
+    """
+    def __init__(self):
+        self.by_target = {}
+        self.keys = []
+        self.votes = []
+        self.pruned_vote = None
+
+    def __len__(self):
+        return len(self.votes)
+
+    def __iter__(self):
+        return iter(self.votes)
+
+    def check(self, vote):
+        """Returns the SlashingEvidence if `vote` breaks a slashing condition,
+        or None otherwise.
+        """
+        if vote.epoch_target in self.by_target:
+            if self.by_target[vote.epoch_target].hash == vote.hash:
+                # The same vote, received again
+                return None
+            return SlashingEvidence(SlashingEvidence.DOUBLE_VOTE, vote,
+                                    self.by_target[vote.epoch_target])
+
+        # A vote whose target is above the pruned votes surrounds one of
+        # them if and only if it surrounds the one with the highest source
+        pruned = self.pruned_vote
+        if (pruned is not None and vote.epoch_source < pruned.epoch_source and
+                vote.epoch_target > pruned.epoch_target):
+            return SlashingEvidence(SlashingEvidence.SURROUND_VOTE, vote, pruned)
+
+        # Highest target among the votes with a lower source
+        i = bisect.bisect_left(self.keys, (vote.epoch_source, -1))
+        if i > 0 and self.votes[i - 1].epoch_target > vote.epoch_target:
+            return SlashingEvidence(SlashingEvidence.SURROUND_VOTE, vote, self.votes[i - 1])
+
+        # Lowest target among the votes with a higher source
+        j = bisect.bisect_right(self.keys, (vote.epoch_source, float('inf')))
+        if j < len(self.votes) and self.votes[j].epoch_target < vote.epoch_target:
+            return SlashingEvidence(SlashingEvidence.SURROUND_VOTE, vote, self.votes[j])
+        return None
+
+    def add(self, vote):
+        """Adds a vote which passed `check`."""
+        key = (vote.epoch_source, vote.epoch_target)
+        i = bisect.bisect(self.keys, key)
+        self.keys.insert(i, key)
+        self.votes.insert(i, vote)
+        self.by_target[vote.epoch_target] = vote
+
+    def prune(self, epoch):
+        """Removes the votes whose target is lower than `epoch`.
+
+        The votes checked afterwards must have a target of at least `epoch`:
+        such a vote can't have the target of a pruned vote, nor be surrounded
+        by one, so only the pruned vote with the highest source is kept, to
+        find the votes surrounding a pruned vote.
+        """
+        # The votes are sorted by target, so the pruned votes are a prefix
+        i = 0
+        while i < len(self.votes) and self.votes[i].epoch_target < epoch:
+            i += 1
+        if i == 0:
+            return
+        if self.pruned_vote is None or self.votes[i - 1].epoch_source > self.pruned_vote.epoch_source:
+            self.pruned_vote = self.votes[i - 1]
+        for vote in self.votes[:i]:
+            del self.by_target[vote.epoch_target]
+        del self.keys[:i]
+        del self.votes[:i]
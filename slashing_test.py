@@ -0,0 +1,66 @@
+"""Test the index of the votes against the two slashing conditions.
+"""
+import random
+
+from message import Vote
+from slashing import SenderVotes, SlashingEvidence
+
+
+def is_slashable(past_votes, vote):
+    """Reference check: compare the vote with every past vote of the sender."""
+    for past_vote in past_votes:
+        if past_vote.epoch_target == vote.epoch_target:
+            return True
+        if ((past_vote.epoch_source < vote.epoch_source and
+             past_vote.epoch_target > vote.epoch_target) or
+           (past_vote.epoch_source > vote.epoch_source and
+             past_vote.epoch_target < vote.epoch_target)):
+            return True
+    return False
+
+
+def test_check_matches_reference():
+    for _ in range(100):
+        index = SenderVotes()
+        past_votes = []
+        for _ in range(30):
+            epoch_source = random.randint(0, 20)
+            epoch_target = random.randint(epoch_source + 1, 21)
+            vote = Vote(0, 0, epoch_source, epoch_target, 0)
+
+            evidence = index.check(vote)
+            assert (evidence is not None) == is_slashable(past_votes, vote)
+            if evidence is None:
+                index.add(vote)
+                past_votes.append(vote)
+            else:
+                assert evidence.conflicting_vote in past_votes
+        assert len(index) == len(past_votes)
+
+
+def test_evidence_kind():
+    index = SenderVotes()
+    index.add(Vote(0, 0, 1, 4, 7))
+
+    evidence = index.check(Vote(0, 0, 2, 4, 7))
+    assert evidence.kind == SlashingEvidence.DOUBLE_VOTE
+    evidence = index.check(Vote(0, 0, 2, 3, 7))
+    assert evidence.kind == SlashingEvidence.SURROUND_VOTE
+    evidence = index.check(Vote(0, 0, 0, 5, 7))
+    assert evidence.kind == SlashingEvidence.SURROUND_VOTE
+    assert evidence.sender == 7
+    assert index.check(Vote(0, 0, 4, 5, 7)) is None
+
+
+def test_prune_keeps_surround_votes():
+    index = SenderVotes()
+    for epoch in range(1, 6):
+        index.add(Vote(0, 0, epoch - 1, epoch, 7))
+    index.prune(4)
+    assert len(index) == 2
+    # Surrounds the pruned vote (2 -> 3)
+    evidence = index.check(Vote(0, 0, 1, 6, 7))
+    assert evidence.kind == SlashingEvidence.SURROUND_VOTE
+    assert evidence.conflicting_vote.epoch_source == 2
+    assert index.check(Vote(0, 0, 3, 6, 7)).kind == SlashingEvidence.SURROUND_VOTE
+    assert index.check(Vote(0, 0, 5, 6, 7)) is None
@@ -0,0 +1,182 @@
+"""Snapshot and restore the whole state of a simulation.
+
+A snapshot contains the network (time, messages in flight, random streams,
+latency model and the store of the blocks and votes) and every validator
+(processed objects, dependencies, votes, justified and finalized
+checkpoints, tails, ...). The blocks and votes are shared by the
+validators, and pickle writes each of them once.
+
+The genesis block of the default scenario is not written: it is the
+module-level ROOT of validator.py, the same in every process, and the
+restored validators point to it again. Other scenarios are written with
+their genesis block.
+
+A sweep can warm up a simulation once, and branch many scenarios from the
+snapshot, with another latency, other seeds or disconnected validators (see
+`run_branch`). Run `python3 snapshot.py` for an example.
+
+The listeners of the network (see collector.py) are not saved, and
+instrumented networks (see instrumentation.py) cannot be saved.
+"""
+
+import io
+import pickle
+import zlib
+
+from collector import OnlineMetrics
+from network import Network
+from parameters import *
+from rng import SimulationRNG
+from scenario import DEFAULT_SCENARIO
+from utils import exponential_latency
+import validator
+from validator import VoteValidator
+
+# Compression level of the snapshots: fast, and most of the size of a
+# snapshot is the repeated structure of the blocks and votes
+COMPRESSION_LEVEL = 1
+
+
+class SnapshotPickler(pickle.Pickler):
+    """Pickler which refers to the genesis block by name."""
+    def persistent_id(self, obj):
+        if obj is validator.ROOT:
+            return ('ROOT', obj.hash)
+        return None
+
+
+class SnapshotUnpickler(pickle.Unpickler):
+    """Unpickler which points the genesis block to validator.ROOT."""
+    def persistent_load(self, pid):
+        name, root_hash = pid
+        assert name == 'ROOT'
+        assert root_hash == validator.ROOT.hash, "The snapshot has another genesis block"
+        return validator.ROOT
+
+
+def dumps(network):
+    """Returns the snapshot of a network and its validators, as bytes."""
+    listeners = network.listeners
+    network.listeners = []
+    try:
+        buf = io.BytesIO()
+        SnapshotPickler(buf, pickle.HIGHEST_PROTOCOL).dump(network)
+    finally:
+        network.listeners = listeners
+    return zlib.compress(buf.getvalue(), COMPRESSION_LEVEL)
+
+
+def loads(data):
+    """Restores a network and its validators from a snapshot.
+
+    Every call returns a new copy, so many scenarios can branch from the
+    same snapshot.
+
+    Returns:
+        the network; its validators are network.nodes
+    """
+    return SnapshotUnpickler(io.BytesIO(zlib.decompress(data))).load()
+
+
+def save_snapshot(network, filename):
+    with open(filename, 'wb') as f:
+        f.write(dumps(network))
+
+
+def load_snapshot(filename):
+    with open(filename, 'rb') as f:
+        return loads(f.read())
+
+
+def disconnect(network, num_connected):
+    """Disconnects all the validators of the network except the first `num_connected`.
+
+    The messages in flight to the disconnected validators are dropped.
+    """
+    network.nodes = network.nodes[:num_connected]
+    for arrival_time, arrivals in network.msg_arrivals.items():
+        if network.batched:
+            arrivals = [(receivers[receivers < num_connected], msg) for receivers, msg in arrivals]
+            arrivals = [(receivers, msg) for receivers, msg in arrivals if len(receivers)]
+        else:
+            arrivals = [(node_index, msg) for node_index, msg in arrivals
+                        if node_index < num_connected]
+        network.msg_arrivals[arrival_time] = arrivals
+
+
+def warm_up(latency, validator_set=None, seed=None, num_epochs=20, scenario=None):
+    """Runs the first epochs of a simulation, as metrics.run_simulation does,
+    and returns its snapshot."""
+    scenario = scenario or DEFAULT_SCENARIO
+    rng = SimulationRNG(seed)
+    network = Network(exponential_latency(latency, rng), batched=True, rng=rng,
+                      scenario=scenario)
+    for i in validator_set or scenario.validator_ids:
+        VoteValidator(network, i)
+    network.run(scenario.epoch_ticks * num_epochs)
+    return dumps(network)
+
+
+def run_branch(snapshot, latency=None, seed=None, num_connected=None, num_epochs=30):
+    """Restores a snapshot, changes the scenario, and runs it further.
+
+    This is a top-level function so that it can be sent to worker processes
+    (see sweep.run_sweep).
+
+    Args:
+        snapshot: snapshot returned by `dumps` or `warm_up`
+        latency: new average latency of the network (unchanged if None)
+        seed: new seed of the random streams (unchanged if None)
+        num_connected: number of validators which stay connected (all if None)
+        num_epochs: number of epochs to run after the snapshot
+
+    Returns:
+        dict {metric name -> value}, as metrics.run_simulation
+    """
+    network = loads(snapshot)
+    if seed is not None:
+        rng = SimulationRNG(seed)
+        # Keep sampling the dynasties with the key of the snapshot
+        rng.dynasty_key = network.rng.dynasty_key
+        network.rng = rng
+        network.latency_fn.rng = rng
+    if latency is not None:
+        network.latency_fn = exponential_latency(latency, network.rng)
+    if num_connected is not None:
+        disconnect(network, num_connected)
+
+    scenario = network.scenario
+    collector = OnlineMetrics(network)
+    network.run(scenario.epoch_ticks * num_epochs)
+
+    result = collector.summary()
+    del result['reorgs']
+    total_epochs = network.time // scenario.epoch_ticks
+    result['main_chain_fraction'] = (result['main_chain_size'] /
+                                     (scenario.epoch_size * total_epochs + 1))
+    return result
+
+
+if __name__ == '__main__':
+    import time
+
+    from metrics import METRIC_NAMES
+    from sweep import run_sweep
+
+    # Warm up once with a low latency, then try higher latencies from epoch 20
+    start = time.time()
+    snapshot = warm_up(10, seed=0, num_epochs=20)
+    print('Warm-up: {:.1f} seconds, snapshot of {:.1f} KB'.format(
+        time.time() - start, len(snapshot) / 1024.0))
+
+    latencies = [10, 100, 300]
+    num_tries = 4
+    tasks = [{'snapshot': snapshot, 'latency': latency, 'seed': i, 'num_epochs': 30}
+             for latency in latencies for i in range(num_tries)]
+    results = dict(run_sweep(tasks, function=run_branch))
+    for index, latency in enumerate(latencies):
+        print('Latency from epoch 20: {}'.format(latency))
+        group = [results[index * num_tries + i] for i in range(num_tries)]
+        for key, name in METRIC_NAMES:
+            print('{}: {}'.format(name, sum(r[key] for r in group) / num_tries))
+        print('')
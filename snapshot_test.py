@@ -0,0 +1,37 @@
+"""Test that a restored snapshot continues exactly like the original simulation."""
+
+from network import Network
+from parameters import *
+from rng import SimulationRNG
+import snapshot
+from utils import exponential_latency
+from validator import ROOT, VoteValidator
+
+EPOCH_TICKS = BLOCK_PROPOSAL_TIME * EPOCH_SIZE
+
+
+def state(network):
+    return [(val.head.hash, sorted(val.justified), sorted(val.finalized), len(val.processed),
+             sorted(val.dependencies), val.vote_count)
+            for val in network.nodes]
+
+
+def test_restore_continues_the_simulation():
+    rng = SimulationRNG(6)
+    network = Network(exponential_latency(AVG_LATENCY, rng), batched=True, rng=rng)
+    for i in VALIDATOR_IDS:
+        VoteValidator(network, i)
+    network.run(2 * EPOCH_TICKS)
+
+    data = snapshot.dumps(network)
+    first = snapshot.loads(data)
+    second = snapshot.loads(data)
+    assert first.time == network.time
+    assert first.nodes[0].processed[ROOT.hash] is ROOT
+    assert first.nodes[0].processed.store is first.store
+
+    network.run(EPOCH_TICKS)
+    first.run(EPOCH_TICKS)
+    second.run(EPOCH_TICKS)
+    assert state(first) == state(network)
+    assert state(second) == state(network)
@@ -0,0 +1,164 @@
+import numpy as np
+
+# Size of the store under which it is never compacted
+MIN_COMPACTION_SIZE = 1024
+
+
+class ObjectStore(object):
+    """Content-addressed store of the blocks and votes of a simulation,
+    shared by all the validators of a network.
+
+    Every object gets a compact integer id, in order of arrival in the store.
+    Each validator keeps track of the objects it processed with a bitset over
+    these ids (see ProcessedView), instead of its own dict of references.
+
+    Data derived from the chain, which is the same for every validator, is
+    computed once:
+    self.tail_membership: map {block hash -> hash of its closest checkpoint ancestor}
+
+    When the validators prune their history (see VoteValidator.prune), the
+    objects which are in no view any more are removed by `compact`.
+    """
+    def __init__(self):
+        # Map {hash -> id}
+        self.ids = {}
+        # List of the objects, indexed by id
+        self.objects = []
+        self.tail_membership = {}
+        # Views over the ids, updated when the store is compacted
+        self.views = []
+        # Size of the store after the last compaction
+        self.compacted_size = 0
+
+    def __len__(self):
+        return len(self.objects)
+
+    def add(self, obj):
+        """Adds an object to the store if it is not already there, and returns its id."""
+        id_ = self.ids.get(obj.hash)
+        if id_ is None:
+            id_ = len(self.objects)
+            self.ids[obj.hash] = id_
+            self.objects.append(obj)
+        return id_
+
+    def view(self):
+        """Returns an empty view of the store, for a new validator."""
+        view = ProcessedView(self)
+        self.views.append(view)
+        return view
+
+    def needs_compaction(self):
+        """The store doubled since the last compaction, so compacting takes
+        amortized O(1) per object."""
+        return len(self.objects) >= max(2 * self.compacted_size, MIN_COMPACTION_SIZE)
+
+    def compact(self):
+        """Removes the objects which are in no view, and renumbers the others.
+
+        The ids keep the order of arrival, and the bitsets of the views are
+        remapped to the new ids.
+        """
+        num_bytes = (len(self.objects) + 7) >> 3
+        live = np.zeros(num_bytes, dtype=np.uint8)
+        view_bits = []
+        for view in self.views:
+            bits = np.zeros(num_bytes, dtype=np.uint8)
+            # The bitsets grow by doubling, so they may be longer than the store
+            view_bytes = bytes(view.bits[:num_bytes])
+            bits[:len(view_bytes)] = np.frombuffer(view_bytes, dtype=np.uint8)
+            view_bits.append(bits)
+            live |= bits
+        kept = np.flatnonzero(np.unpackbits(live, bitorder='little')[:len(self.objects)])
+
+        kept_set = set(kept.tolist())
+        for id_, obj in enumerate(self.objects):
+            if id_ not in kept_set:
+                self.tail_membership.pop(obj.hash, None)
+        self.objects = [self.objects[id_] for id_ in kept.tolist()]
+        self.ids = {obj.hash: id_ for id_, obj in enumerate(self.objects)}
+        for view, bits in zip(self.views, view_bits):
+            view.bits = bytearray(np.packbits(
+                np.unpackbits(bits, bitorder='little')[kept], bitorder='little').tobytes())
+        self.compacted_size = len(self.objects)
+
+
+class ProcessedView(object):
+    """Set of objects processed by a validator, as a bitset over the ids of an ObjectStore.
+
+    Behaves like a dict {hash -> object}.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.bits = bytearray()
+        self.count = 0
+
+    def has_id(self, id_):
+        byte = id_ >> 3
+        return byte < len(self.bits) and (self.bits[byte] >> (id_ & 7)) & 1 == 1
+
+    # __contains__ and __getitem__ are on the hot path of the validators,
+    # so they don't call has_id
+    def __contains__(self, hash_):
+        id_ = self.store.ids.get(hash_)
+        if id_ is None:
+            return False
+        byte = id_ >> 3
+        return byte < len(self.bits) and (self.bits[byte] >> (id_ & 7)) & 1 == 1
+
+    def __getitem__(self, hash_):
+        id_ = self.store.ids.get(hash_)
+        if id_ is not None:
+            byte = id_ >> 3
+            if byte < len(self.bits) and (self.bits[byte] >> (id_ & 7)) & 1:
+                return self.store.objects[id_]
+        raise KeyError(hash_)
+
+    def get(self, hash_, default=None):
+        try:
+            return self[hash_]
+        except KeyError:
+            return default
+
+    def __setitem__(self, hash_, obj):
+        assert hash_ == obj.hash
+        id_ = self.store.add(obj)
+        if self.has_id(id_):
+            return
+        byte = id_ >> 3
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(max(byte + 1 - len(self.bits), len(self.bits))))
+        self.bits[byte] |= 1 << (id_ & 7)
+        self.count += 1
+
+    def __delitem__(self, hash_):
+        id_ = self.store.ids.get(hash_)
+        if id_ is None or not self.has_id(id_):
+            raise KeyError(hash_)
+        self.bits[id_ >> 3] &= ~(1 << (id_ & 7)) & 0xff
+        self.count -= 1
+
+    def __len__(self):
+        return self.count
+
+    def ids(self):
+        """Iterates over the ids of the processed objects."""
+        for byte_index, byte in enumerate(self.bits):
+            if byte:
+                for bit in range(8):
+                    if (byte >> bit) & 1:
+                        yield (byte_index << 3) | bit
+
+    def values(self):
+        for id_ in self.ids():
+            yield self.store.objects[id_]
+
+    def items(self):
+        for obj in self.values():
+            yield obj.hash, obj
+
+    def keys(self):
+        for obj in self.values():
+            yield obj.hash
+
+    __iter__ = keys
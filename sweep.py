@@ -0,0 +1,289 @@
+"""Run sweeps of simulations in parallel, on a pool of worker processes.
+
+Each simulation is seeded by its task, so a parallel sweep gives the same
+results as running the same tasks one after another (see
+metrics.print_metrics_latency).
+
+`python3 sweep.py --adaptive` runs an adaptive sweep instead (see
+adaptive_sweep): each point gets tries until the confidence intervals of its
+metrics are under a tolerance. Each try runs all the epochs, as in a fixed
+sweep, unless `--steady-tolerance` also stops the simulations once they
+reach a steady state.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import math
+import random
+
+import numpy as np
+
+from metrics import METRIC_NAMES, run_simulation, try_seed
+from parameters import *
+
+# Two-sided 95% quantiles of the Student t distribution, by degrees of freedom
+T_95 = [None, 12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+
+def make_tasks(latencies, num_tries, validator_set=None, seed=SEED, num_epochs=50,
+               scenarios=None):
+    """List the simulations of a sweep, with the same seeds as print_metrics_latency.
+
+    Each task is a dict of arguments of metrics.run_simulation.
+
+    Args:
+        scenarios: list of scenarios to run for each latency (only the
+            default scenario if None). The scenarios are sent to the
+            workers with the tasks, so one pool runs all of them.
+    """
+    if seed is None:
+        # Pick the seed of the sweep, so that every task is still reproducible
+        seed = random.randrange(2**32)
+    tasks = []
+    for scenario in scenarios or [None]:
+        for latency in latencies:
+            for i in range(num_tries):
+                tasks.append({'latency': latency,
+                              'validator_set': validator_set,
+                              'seed': try_seed(seed, i),
+                              'num_epochs': num_epochs,
+                              'scenario': scenario})
+    return tasks
+
+
+def run_sweep(tasks, num_workers=None, function=run_simulation):
+    """Run the simulations on a pool of `num_workers` processes.
+
+    Args:
+        tasks: list of dicts of arguments of `function`
+        num_workers: number of processes (the number of cores if None)
+        function: top-level function running one simulation, such as
+            metrics.run_simulation or snapshot.run_branch
+
+    Yields:
+        (index of the task, metrics of the simulation), as they finish
+    """
+    with ProcessPoolExecutor(num_workers) as executor:
+        futures = {executor.submit(function, **task): index
+                   for index, task in enumerate(tasks)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def run_serial(tasks):
+    """Same as run_sweep, in the current process."""
+    for index, task in enumerate(tasks):
+        yield index, run_simulation(**task)
+
+
+def confidence_interval(values):
+    """Returns the mean of the values and the half width of its 95% confidence interval."""
+    # Same summation as print_metrics_latency, to get the same means
+    mean = sum(values) / len(values)
+    if len(values) < 2:
+        return mean, float('inf')
+    dof = len(values) - 1
+    t = T_95[dof] if dof < len(T_95) else 1.96
+    return mean, t * float(np.std(values, ddof=1)) / math.sqrt(len(values))
+
+
+def aggregate(tasks, results, keys=('scenario', 'latency')):
+    """Aggregate the metrics of the simulations sharing the same `keys`.
+
+    The results are aggregated in the order of the tasks, so that the means
+    do not depend on the order in which the simulations finished.
+
+    Args:
+        tasks: list of tasks
+        results: dict {index of the task -> metrics of the simulation}
+        keys: arguments of the tasks to group by. By default, the tries of
+            different scenarios with the same latency stay apart.
+
+    Returns:
+        dict {tuple of the values of the keys -> {metric -> (mean, half width of the 95% CI)}}
+    """
+    groups = {}
+    for index, task in enumerate(tasks):
+        if index in results:
+            groups.setdefault(tuple(task.get(key) for key in keys), []).append(results[index])
+
+    stats = {}
+    for value, group in groups.items():
+        stats[value] = {metric: confidence_interval([r[metric] for r in group])
+                        for metric, _ in METRIC_NAMES}
+    return stats
+
+
+# Metrics whose confidence intervals decide when an adaptive sweep stops
+TARGET_METRICS = ['justified', 'finalized', 'main_chain_fraction']
+
+
+def tries_needed(group, tolerance):
+    """Estimates the number of tries for the 95% CIs of the TARGET_METRICS to be
+    under `tolerance`.
+
+    The half width of a confidence interval shrinks as 1 / sqrt(n), so a
+    point with n tries and a half width h needs about n * (h / tolerance)**2.
+
+    Args:
+        group: list of the metrics of the tries of one point (at least 2)
+        tolerance: absolute half width wanted for every target metric
+    """
+    ratio = max(confidence_interval([r[metric] for r in group])[1] / tolerance
+                for metric in TARGET_METRICS)
+    return int(math.ceil(len(group) * ratio ** 2))
+
+
+def adaptive_sweep(latencies, tolerance=0.02, min_tries=3, max_tries=30,
+                   validator_set=None, seed=SEED, num_epochs=50, scenario=None,
+                   steady_tolerance=None, num_workers=None, callback=None):
+    """Sweep which runs tries until the confidence intervals are under `tolerance`.
+
+    The sweep runs in rounds: every point starts with `min_tries` tries, and
+    after each round the points whose 95% CIs of the TARGET_METRICS are still
+    too wide get the number of tries they are estimated to need (at most
+    twice their number of tries per round, since the variance of a few tries
+    is itself noisy). The budget goes to the high-variance points, and the
+    points which converge early stop getting tries.
+
+    Try i of a point has the same seed as in print_metrics_latency, and a
+    round only starts once the previous one is over, so an adaptive sweep
+    is reproducible whatever the number of workers.
+
+    Args:
+        latencies: latencies of the sweep
+        tolerance: absolute half width of the 95% CIs of the target metrics
+        min_tries: number of tries of every point (at least 2)
+        max_tries: maximum number of tries of a point
+        steady_tolerance: if given, tolerance of the steady state after which
+            a simulation stops before `num_epochs` (see
+            metrics.run_simulation). By default every try runs `num_epochs`
+            epochs, so the means estimate the same quantities as a fixed
+            sweep. The metrics are cumulative, so a simulation stopped early
+            still weighs its first epochs more: a larger tolerance saves more
+            epochs but moves the means of the slow points (high latencies)
+            further
+        num_workers: number of processes (the number of cores if None)
+        callback: function called with (task, result) when a try finishes
+
+    Returns:
+        (tasks, results), to be given to `aggregate`
+    """
+    if seed is None:
+        seed = random.randrange(2**32)
+    min_tries = max(min_tries, 2)
+    tasks = []
+    results = {}
+    num_tries = {latency: 0 for latency in latencies}
+    new_tries = {latency: min_tries for latency in latencies}
+    while new_tries:
+        round_tasks = []
+        for latency in latencies:
+            for i in range(num_tries[latency], num_tries[latency] + new_tries.get(latency, 0)):
+                round_tasks.append({'latency': latency,
+                                    'validator_set': validator_set,
+                                    'seed': try_seed(seed, i),
+                                    'num_epochs': num_epochs,
+                                    'scenario': scenario,
+                                    'steady_tolerance': steady_tolerance})
+            num_tries[latency] += new_tries.get(latency, 0)
+        for index, result in run_sweep(round_tasks, num_workers):
+            results[len(tasks) + index] = result
+            if callback is not None:
+                callback(round_tasks[index], result)
+        tasks.extend(round_tasks)
+
+        groups = {}
+        for index, task in enumerate(tasks):
+            groups.setdefault(task['latency'], []).append(results[index])
+        new_tries = {}
+        for latency in latencies:
+            n = num_tries[latency]
+            needed = min(tries_needed(groups[latency], tolerance), max_tries, 2 * n)
+            if needed > n:
+                new_tries[latency] = needed - n
+    return tasks, results
+
+
+def print_metrics_adaptive(latencies, tolerance=0.02, validator_set=None, seed=SEED,
+                           num_epochs=50, num_workers=None, scenario=None, **kwargs):
+    """Adaptive version of print_metrics_sweep (see adaptive_sweep)."""
+    def epochs(result):
+        return result.get('epochs', num_epochs)
+
+    def report(task, result):
+        print('latency {}, seed {}: {} epochs, justified {:.3f}, finalized {:.3f}'.format(
+            task['latency'], task['seed'], epochs(result), result['justified'],
+            result['finalized']))
+    tasks, results = adaptive_sweep(latencies, tolerance, validator_set=validator_set,
+                                    seed=seed, num_epochs=num_epochs, scenario=scenario,
+                                    num_workers=num_workers, callback=report, **kwargs)
+    print('')
+
+    stats = aggregate(tasks, results)
+    for latency in latencies:
+        group = [results[i] for i, task in enumerate(tasks) if task['latency'] == latency]
+        print('Latency: {} ({} tries, {} epochs)'.format(
+            latency, len(group), sum(epochs(r) for r in group)))
+        for metric, name in METRIC_NAMES:
+            mean, half_width = stats[(scenario, latency)][metric]
+            print('{}: {} +/- {}'.format(name, mean, half_width))
+        print('')
+    print('Total: {} tries, {} epochs'.format(
+        len(tasks), sum(epochs(r) for r in results.values())))
+
+
+def print_metrics_sweep(latencies, num_tries, validator_set=None, seed=SEED,
+                        num_workers=None):
+    """Parallel version of metrics.print_metrics_latency, with confidence intervals."""
+    tasks = make_tasks(latencies, num_tries, validator_set, seed)
+    results = {}
+    for index, result in run_sweep(tasks, num_workers):
+        results[index] = result
+        print('[{}/{}] latency {}, seed {}: justified {:.3f}, finalized {:.3f}'.format(
+            len(results), len(tasks), tasks[index]['latency'], tasks[index]['seed'],
+            result['justified'], result['finalized']))
+    print('')
+
+    stats = aggregate(tasks, results)
+    for latency in latencies:
+        print('Latency: {}'.format(latency))
+        for metric, name in METRIC_NAMES:
+            mean, half_width = stats[(None, latency)][metric]
+            print('{}: {} +/- {}'.format(name, mean, half_width))
+        print('')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--adaptive', action='store_true',
+                        help='run tries until the 95%% CIs are under the tolerance')
+    parser.add_argument('--tolerance', type=float, default=0.02,
+                        help='half width of the CIs of an adaptive sweep (default: 0.02)')
+    parser.add_argument('--steady-tolerance', type=float, default=None,
+                        help='stop the tries of an adaptive sweep at a steady state with '
+                             'this tolerance (biases the means; default: run every epoch)')
+    args = parser.parse_args()
+
+    # Uncomment to have fractions of disconnected nodes
+    # fractions = np.arange(0.0, 0.4, 0.05)
+    fractions = [0.0]
+    for fraction_disconnected in fractions:
+        num_validators = int((1.0 - fraction_disconnected) * NUM_VALIDATORS)
+        validator_set = VALIDATOR_IDS[:num_validators]
+
+        print("Total height of nodes: {}".format(NUM_VALIDATORS))
+        print("height of connected of nodes: {}".format(len(validator_set)))
+
+        # Uncomment to have different latencies
+        #latencies = [i for i in range(10, 300, 20)] + [500, 750, 1000]
+        latencies = [100]
+        num_tries = 10  # number of samples for each set of parameters
+
+        if args.adaptive:
+            print_metrics_adaptive(latencies, args.tolerance, validator_set,
+                                   steady_tolerance=args.steady_tolerance)
+        else:
+            print_metrics_sweep(latencies, num_tries, validator_set)
@@ -0,0 +1,68 @@
+"""Test the steady state detection and the adaptive sweep."""
+
+from metrics import is_steady, run_simulation
+from scenario import Scenario
+from sweep import adaptive_sweep, aggregate, make_tasks, run_serial
+
+SCENARIO = Scenario(num_validators=4, epoch_size=5)
+
+
+def test_is_steady():
+    history = [{'justified': 0.5, 'finalized': 0.4, 'main_chain_fraction': 0.9 + 0.001 * i}
+               for i in range(5)]
+    assert is_steady(history, 0.01)
+    history[0]['finalized'] = 0.3
+    assert not is_steady(history, 0.01)
+
+
+def test_steady_state_stops_early():
+    full = run_simulation(10, seed=0, num_epochs=30, scenario=SCENARIO)
+    steady = run_simulation(10, seed=0, num_epochs=30, scenario=SCENARIO,
+                            steady_tolerance=0.01, min_epochs=5)
+    assert steady['epochs'] < 30
+    # Without a steady state, the simulation runs all the epochs
+    assert run_simulation(10, seed=0, num_epochs=30, scenario=SCENARIO,
+                          steady_tolerance=0.0)['epochs'] == 30
+    assert abs(steady['justified'] - full['justified']) < 0.05
+
+
+def test_adaptive_sweep():
+    tasks, results = adaptive_sweep([10, 200], tolerance=0.05, min_tries=2, max_tries=6,
+                                    seed=0, num_epochs=10, scenario=SCENARIO, num_workers=1)
+    tries = [sum(task['latency'] == latency for task in tasks) for latency in [10, 200]]
+    assert all(2 <= n <= 6 for n in tries)
+    # Each point has the seeds 0 to n - 1, as print_metrics_latency
+    for latency, n in zip([10, 200], tries):
+        assert sorted(task['seed'] for task in tasks if task['latency'] == latency) == list(range(n))
+    stats = aggregate(tasks, results)
+    for latency, n in zip([10, 200], tries):
+        if n < 6:
+            assert stats[(SCENARIO, latency)]['justified'][1] <= 0.05
+
+
+def test_aggregate_keeps_scenarios_apart():
+    other = Scenario(num_validators=6, epoch_size=5)
+    tasks = make_tasks([10], 2, seed=0, num_epochs=3, scenarios=[SCENARIO, other])
+    results = dict(run_serial(tasks))
+    stats = aggregate(tasks, results)
+    assert sorted(stats, key=lambda k: k[0].num_validators) == [(SCENARIO, 10), (other, 10)]
+    for scenario in [SCENARIO, other]:
+        group = [results[i] for i, task in enumerate(tasks) if task['scenario'] is scenario]
+        assert stats[(scenario, 10)]['justified'][0] == sum(r['justified'] for r in group) / 2
+    assert list(aggregate(tasks, results, keys=('latency',))) == [(10,)]
+
+
+def test_adaptive_means_within_fixed_ci():
+    latencies = [10, 100]
+    fixed_tasks = make_tasks(latencies, 10, seed=0, num_epochs=10, scenarios=[SCENARIO])
+    fixed = aggregate(fixed_tasks, dict(run_serial(fixed_tasks)))
+    tasks, results = adaptive_sweep(latencies, tolerance=0.05, min_tries=3, max_tries=10,
+                                    seed=0, num_epochs=10, scenario=SCENARIO, num_workers=1)
+    # Every try runs all the epochs by default
+    assert all('epochs' not in result for result in results.values())
+    adaptive = aggregate(tasks, results)
+    for latency in latencies:
+        for metric in ['justified', 'finalized', 'main_chain_fraction']:
+            mean, half_width = fixed[(SCENARIO, latency)][metric]
+            # (up to the rounding of the sums of the means)
+            assert abs(adaptive[(SCENARIO, latency)][metric][0] - mean) <= half_width + 1e-9
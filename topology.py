@@ -0,0 +1,119 @@
+"""Topologies of the gossip network (see network.GossipNetwork).
+
+Each topology is a connected undirected networkx graph over the node indices
+0..n-1, built from a number of nodes, a degree (the fan-out of the gossip)
+and a random generator:
+    random_regular: every node has `degree` peers chosen at random
+    small_world: ring where each node is linked to its `degree` nearest
+        nodes, with a fraction of the links rewired at random (Watts-Strogatz)
+    clustered: ring of cliques of `degree + 1` nodes (connected caveman)
+
+Run `python3 topology.py` to measure the message overhead and the finality
+delay as functions of the fan-out.
+"""
+
+import time
+
+import networkx as nx
+
+from collector import FinalityDelay, OnlineMetrics
+from network import GossipNetwork
+from parameters import *
+from rng import SimulationRNG
+from utils import exponential_latency
+from validator import VoteValidator
+
+
+def random_regular(num_nodes, degree, rng):
+    """Random `degree`-regular graph (num_nodes * degree must be even)."""
+    while True:
+        graph = nx.random_regular_graph(degree, num_nodes, seed=rng)
+        if nx.is_connected(graph):
+            return graph
+
+
+def small_world(num_nodes, degree, rng, rewiring=0.1):
+    """Connected Watts-Strogatz graph."""
+    return nx.connected_watts_strogatz_graph(num_nodes, degree, rewiring, seed=rng)
+
+
+def clustered(num_nodes, degree, rng):
+    """Ring of cliques of degree + 1 nodes; the last clique takes the remaining nodes.
+
+    One link of each clique is moved to the next clique, so every node but
+    two per clique has `degree` peers.
+    """
+    clique_size = degree + 1
+    num_cliques = max(num_nodes // clique_size, 1)
+    graph = nx.connected_caveman_graph(num_cliques, clique_size)
+    # Attach the remaining nodes to random nodes of the last clique
+    last_clique = range((num_cliques - 1) * clique_size, num_cliques * clique_size)
+    for node in range(num_cliques * clique_size, num_nodes):
+        graph.add_edge(node, rng.choice(last_clique))
+    return graph
+
+
+TOPOLOGIES = {
+    'random_regular': random_regular,
+    'small_world': small_world,
+    'clustered': clustered,
+}
+
+
+def run_gossip(num_validators, degree, kind='random_regular', latency=AVG_LATENCY,
+               num_epochs=10, seed=None, scenario=None):
+    """Run a simulation on a gossip network.
+
+    The latency of each link is drawn once from an exponential distribution.
+
+    Returns:
+        dict with the messages sent per epoch, the overhead (messages sent
+        per message and per receiving node, 1 for a perfect spanning tree),
+        the fraction of duplicate receptions, the mean justification and
+        finalization delays (in ticks), the metrics of OnlineMetrics and
+        the wall time
+    """
+    rng = SimulationRNG(seed)
+    topology = TOPOLOGIES[kind](num_validators, degree, rng.stream('topology'))
+    network = GossipNetwork(topology, exponential_latency(latency, rng), rng=rng,
+                            scenario=scenario)
+    for i in range(num_validators):
+        VoteValidator(network, i)
+    collector = OnlineMetrics(network)
+    delays = FinalityDelay(network)
+
+    start = time.time()
+    network.run(network.scenario.epoch_ticks * num_epochs)
+    wall_time = time.time() - start
+
+    justification_delay, finalization_delay = delays.mean_delays()
+    result = collector.summary()
+    result.update({
+        'messages_per_epoch': float(network.num_sent) / num_epochs,
+        'overhead': float(network.num_sent) / (network.num_broadcasts * (num_validators - 1)),
+        'duplicates': float(network.num_duplicates) / network.num_sent,
+        'justification_delay': justification_delay,
+        'finalization_delay': finalization_delay,
+        'wall_time': wall_time,
+    })
+    return result
+
+
+def print_fanout(num_validators, degrees, kind='random_regular', latency=AVG_LATENCY,
+                 num_epochs=10, seed=None):
+    """Print the message overhead and the finality delay for each fan-out."""
+    print('Topology: {}, validators: {}, average link latency: {}'.format(
+        kind, num_validators, latency))
+    print('Degree | messages/epoch | overhead | duplicates | justification delay | '
+          'finalization delay | finalized | seconds')
+    for degree in degrees:
+        r = run_gossip(num_validators, degree, kind, latency, num_epochs, seed)
+        print('{:6d} | {:14.0f} | {:8.2f} | {:10.2f} | {:19.1f} | {:18.1f} | {:9.2f} | {:7.1f}'.format(
+            degree, r['messages_per_epoch'], r['overhead'], r['duplicates'],
+            r['justification_delay'], r['finalization_delay'], r['finalized'], r['wall_time']))
+    print('')
+
+
+if __name__ == '__main__':
+    for kind in ['random_regular', 'small_world', 'clustered']:
+        print_fanout(1000, [4, 8, 16], kind, num_epochs=3, seed=0)
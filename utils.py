@@ -1,7 +1,75 @@
-import random
+import numpy as np
 
+from rng import DEFAULT_RNG
 
-def exponential_latency(avg_latency):
+
+class ExponentialLatency(object):
+    """Exponentially distributed latency, with a minimum of 1 tick.
+
+    Calling the object draws one delay. `sample(n)` draws n delays at once,
+    which is used by the batched broadcast of `Network`.
+
+    Args:
+        avg_latency: average latency of the network (in number of ticks)
+        rng: SimulationRNG drawing the delays (DEFAULT_RNG if None)
+    """
+    def __init__(self, avg_latency, rng=None):
+        self.avg_latency = avg_latency
+        self.rng = rng or DEFAULT_RNG
+
+    def __call__(self):
+        return 1 + int(self.rng.latency.expovariate(1) * self.avg_latency)
+
+    def sample(self, n):
+        return 1 + (self.rng.latency_np.exponential(1, n) * self.avg_latency).astype(np.int64)
+
+
+class UniformLatency(object):
+    """Latency drawn uniformly between `low` and `high` ticks (both included).
+
+    Args:
+        low: minimum latency, at least 1
+        high: maximum latency
+        rng: SimulationRNG drawing the delays (DEFAULT_RNG if None)
+    """
+    def __init__(self, low, high, rng=None):
+        assert 1 <= low <= high, "latencies need to be at least 1"
+        self.low = low
+        self.high = high
+        self.rng = rng or DEFAULT_RNG
+
+    def __call__(self):
+        return self.rng.latency.randint(self.low, self.high)
+
+    def sample(self, n):
+        return self.rng.latency_np.integers(self.low, self.high + 1, n, dtype=np.int64)
+
+
+class EmpiricalLatency(object):
+    """Latency drawn from a list of measured delays, read from a file.
+
+    The file contains one delay (in number of ticks) per line.
+
+    Args:
+        filename: file containing the measured delays
+        rng: SimulationRNG drawing the delays (DEFAULT_RNG if None)
+    """
+    def __init__(self, filename, rng=None):
+        self.rng = rng or DEFAULT_RNG
+        with open(filename) as f:
+            self.delays = np.array([int(line) for line in f if line.strip()],
+                                   dtype=np.int64)
+        assert len(self.delays) > 0, "no delay in {}".format(filename)
+        assert self.delays.min() >= 1, "latencies need to be at least 1"
+
+    def __call__(self):
+        return int(self.delays[self.rng.latency.randrange(len(self.delays))])
+
+    def sample(self, n):
+        return self.delays[self.rng.latency_np.integers(0, len(self.delays), n)]
+
+
+def exponential_latency(avg_latency, rng=None):
     """Represents the latency to transfer messages
     """
-    return lambda: 1 + int(random.expovariate(1) * avg_latency)
+    return ExponentialLatency(avg_latency, rng)
@@ -1,16 +1,26 @@
+from ancestry import CheckpointAncestry
 from block import Block, Dynasty
-from message import Vote
-from parameters import *
+from chain_index import ChainIndex
+from message import CheckpointHeader, Vote
+from scenario import DEFAULT_SCENARIO
+from slashing import SenderVotes
 
-# Root of the blockchain
-ROOT = Block()
+# Root of the blockchain of the default scenario, the same in every process
+ROOT = DEFAULT_SCENARIO.genesis
 
 class Validator(object):
     """Abstract class for validators."""
 
+    # Light validators only get the checkpoints (see LightValidator)
+    light = False
+
     def __init__(self, network, id):
-        # processed blocks
-        self.processed = {ROOT.hash: ROOT}
+        # Parameters of the simulation, and genesis block
+        self.scenario = network.scenario
+        root = self.scenario.genesis
+        # processed blocks, as a view of the store shared by the network
+        self.processed = network.store.view()
+        self.processed[root.hash] = root
         # Messages that are not processed yet, and require another message
         # to be processed
         # Dict from hash of dependency to object that can be processed
@@ -21,7 +31,7 @@ class Validator(object):
         self.dependencies = {}
         # Set of finalized dynasties
         self.finalized_dynasties = set()
-        self.finalized_dynasties.add(Dynasty(INITIAL_VALIDATORS))
+        self.finalized_dynasties.add(Dynasty(self.scenario.initial_validators))
         # My current epoch
         self.current_epoch = 0
         # Network I am connected to
@@ -29,9 +39,16 @@ class Validator(object):
         network.nodes.append(self)
         # Tails are for checkpoint blocks, the tail is the last block
         # (before the next checkpoint) following the checkpoint
-        self.tails = {ROOT.hash: ROOT}
-        # Closest checkpoint ancestor for each block
-        self.tail_membership = {ROOT.hash: ROOT.hash}
+        self.tails = {root.hash: root}
+        # Closest checkpoint ancestor for each block, shared by the network
+        self.tail_membership = network.store.tail_membership
+        self.tail_membership[root.hash] = root.hash
+        # Index over the checkpoint tree to answer ancestor queries quickly
+        self.ancestry = CheckpointAncestry(root)
+        # Blocks by height, checkpoints by epoch, children and votes by link
+        self.index = ChainIndex(root)
+        # Oldest checkpoint of the history kept (see VoteValidator.prune)
+        self.horizon = root
         self.id = id
 
     # If we processed an object but did not receive some dependencies
@@ -41,6 +58,23 @@ class Validator(object):
             self.dependencies[hash_] = []
         self.dependencies[hash_].append(obj)
 
+    def is_stale(self, obj):
+        """Is an object below the horizon, so that it can't be processed any more?
+
+        The blocks at the height of the horizon or lower are either its
+        ancestors or in forks which were pruned, and the votes from a source
+        below the horizon can't be checked.
+        """
+        if isinstance(obj, CheckpointHeader):
+            obj = obj.block
+        if isinstance(obj, Block):
+            return obj.height <= self.horizon.height
+        return obj.epoch_source < self.horizon.epoch
+
+    def get_parent(self, block):
+        """Returns the parent of a block, in the blocks processed."""
+        return self.processed[block.prev_hash]
+
     # Get the checkpoint immediately before a given checkpoint
     def get_checkpoint_parent(self, block):
         if block.height == 0:
@@ -53,15 +87,26 @@ class Validator(object):
             anc: ancestor block (or block hash)
             desc: descendant block (or block hash)
         """
-        # if anc or desc are block hashes, we can get the blocks from self.processed
-        # TODO: but what if they are not in processed? BUG?
+        # TODO: what if they are not in processed? BUG?
+        if isinstance(anc, Block):
+            anc = anc.hash
+        if isinstance(desc, Block):
+            desc = desc.hash
+        # Check that the blocks are both processed checkpoints
+        assert anc in self.ancestry
+        assert desc in self.ancestry
+        return self.ancestry.is_ancestor(anc, desc)
+
+    def is_ancestor_walk(self, anc, desc):
+        """Reference implementation of `is_ancestor`, which walks the
+        checkpoint parents one at a time from `desc` back to genesis.
+        """
         if not isinstance(anc, Block):
             anc = self.processed[anc]
         if not isinstance(desc, Block):
             desc = self.processed[desc]
-        # Check that the blocks are both checkpoints
-        assert anc.height % EPOCH_SIZE == 0
-        assert desc.height % EPOCH_SIZE == 0
+        assert anc.height % self.scenario.epoch_size == 0
+        assert desc.height % self.scenario.epoch_size == 0
         while True:
             if desc is None:
                 return False
@@ -72,39 +117,61 @@ class Validator(object):
     # Called every round
     def tick(self, time):
         # At time 0: validator 0
-        # At time BLOCK_PROPOSAL_TIME: validator 1
-        # .. At time NUM_VALIDATORS * BLOCK_PROPOSAL_TIME: validator 0
-        if self.id == (time // BLOCK_PROPOSAL_TIME) % NUM_VALIDATORS and time % BLOCK_PROPOSAL_TIME == 0:
+        # At time block_proposal_time: validator 1
+        # .. At time num_validators * block_proposal_time: validator 0
+        proposal_time = self.scenario.block_proposal_time
+        if self.id == (time // proposal_time) % self.scenario.num_validators and \
+                time % proposal_time == 0:
             # One node is authorized to create a new block and broadcast it
-            new_block = Block(self.head, self.finalized_dynasties)
-            self.network.broadcast(new_block)
+            new_block = Block(self.head, self.finalized_dynasties, self.network.node_rng(self.id))
+            self.network.broadcast(new_block, self.id)
             self.on_receive(new_block)  # immediately "receive" the new block (no network latency)
 
 class VoteValidator(Validator):
-    """Add the vote messages + slashing conditions capability"""
+    """Add the vote messages + slashing conditions capability
 
-    def __init__(self, network, id):
+    Args:
+        network: network of the validator
+        id: id of the validator
+        prune_lag: if given, the history is pruned below the checkpoint
+            `prune_lag` epochs under the last finalized checkpoint (see
+            `maybe_prune`), so that the memory stays flat on long simulations
+    """
+
+    def __init__(self, network, id, prune_lag=None):
         super(VoteValidator, self).__init__(network, id)
+        root = self.scenario.genesis
         # the head is the latest block processed descendant of the highest
         # justified checkpoint
-        self.head = ROOT
-        self.highest_justified_checkpoint = ROOT
+        self.head = root
+        self.highest_justified_checkpoint = root
         self.main_chain_size = 1
+        # Highest tail among the descendants of the highest justified
+        # checkpoint, maintained incrementally by check_head
+        self.best_descendant = root
 
         # Set of justified block hashes
-        self.justified = {ROOT.hash}
+        self.justified = {root.hash}
 
         # Set of finalized block hashes
-        self.finalized = {ROOT.hash}
+        self.finalized = {root.hash}
 
-        # Map {sender -> votes}
+        # Map {sender -> SenderVotes}
         # Contains all the votes, and allow us to see who voted for whom
-        # Used to check for the slashing conditions
+        # Indexed to check for the slashing conditions
         self.votes = {}
 
-        # Map {source_hash -> {target_hash -> count}} to count the votes
-        # ex: self.vote_count[source][target] will be between 0 and NUM_VALIDATORS
-        self.vote_count = {}
+        # List of SlashingEvidence, for the votes breaking a slashing condition
+        self.slashings = []
+
+        # Map {source_hash -> votes} of the votes waiting for their source to
+        # be justified
+        self.pending_votes = {}
+
+        self.prune_lag = prune_lag
+        # Number of justified and finalized checkpoints removed by `prune`
+        self.num_pruned_justified = 0
+        self.num_pruned_finalized = 0
 
     # TODO: we could write function is_justified only based on self.processed and self.votes
     #       (note that the votes are also stored in self.processed)
@@ -116,7 +183,7 @@ class VoteValidator(Validator):
         """
         # Check that the function is called only on checkpoints
         assert _hash in self.processed, "Couldn't find block hash %d" % _hash
-        assert self.processed[_hash].height % EPOCH_SIZE == 0, "Block is not a checkpoint"
+        assert self.processed[_hash].height % self.scenario.epoch_size == 0, "Block is not a checkpoint"
 
         return _hash in self.justified
 
@@ -128,10 +195,18 @@ class VoteValidator(Validator):
         """
         # Check that the function is called only on checkpoints
         assert _hash in self.processed, "Couldn't find block hash %d" % _hash
-        assert self.processed[_hash].height % EPOCH_SIZE == 0, "Block is not a checkpoint"
+        assert self.processed[_hash].height % self.scenario.epoch_size == 0, "Block is not a checkpoint"
 
         return _hash in self.finalized
 
+    @property
+    def vote_count(self):
+        """Map {source_hash -> {target_hash -> count}} of the votes accepted,
+        counted by self.index.
+        ex: self.vote_count[source][target] will be between 0 and num_validators
+        """
+        return self.index.vote_count()
+
     @property
     def head(self):
         return self._head
@@ -149,6 +224,10 @@ class VoteValidator(Validator):
         Returns:
             True if block was accepted or False if we are missing dependencies
         """
+        # Blocks below the horizon can't be attached to the history kept
+        if block.height <= self.horizon.height:
+            return False
+
         # If we didn't receive the block's parent yet, wait
         if block.prev_hash not in self.processed:
             self.add_dependency(block.prev_hash, block)
@@ -156,14 +235,12 @@ class VoteValidator(Validator):
 
         # We receive the block
         self.processed[block.hash] = block
+        is_checkpoint = block.height % self.scenario.epoch_size == 0
+        self.index.add_block(block, is_checkpoint)
 
         # If it's an epoch block (in general)
-        if block.height % EPOCH_SIZE == 0:
-            #  Start a tail object for it
-            self.tail_membership[block.hash] = block.hash
-            self.tails[block.hash] = block
-            # Maybe vote
-            self.maybe_vote_last_checkpoint(block)
+        if is_checkpoint:
+            self.add_checkpoint(block, self.tail_membership[block.prev_hash])
 
         # Otherwise...
         else:
@@ -177,8 +254,20 @@ class VoteValidator(Validator):
 
         # Reorganize the head
         self.check_head(block)
+        if self.network.listeners:
+            self.network.emit('block_accepted', self, block)
         return True
 
+    def add_checkpoint(self, block, parent_hash):
+        """Adds an accepted checkpoint, given the hash of its checkpoint parent."""
+        #  Start a tail object for it
+        self.tail_membership[block.hash] = block.hash
+        self.tails[block.hash] = block
+        # Add it to the checkpoint tree, under its checkpoint parent
+        self.ancestry.add(block.hash, parent_hash)
+        # Maybe vote
+        self.maybe_vote_last_checkpoint(block)
+
     def check_head(self, block):
         """Reorganize the head to stay on the chain with the highest
         justified checkpoint.
@@ -188,32 +277,52 @@ class VoteValidator(Validator):
 
         Args:
             block: latest block processed."""
+        old_head = self.head
 
         # we are on the right chain, the head is simply the latest block
         if self.is_ancestor(self.highest_justified_checkpoint,
                             self.tail_membership[block.hash]):
             self.head = block
             self.main_chain_size += 1
+            # Keep track of the highest descendant of the highest justified checkpoint
+            if block.height > self.best_descendant.height:
+                self.best_descendant = block
 
         # otherwise, we are not on the right chain
         else:
-            # Find the highest descendant of the highest justified checkpoint
-            # and set it as head
+            # Set the highest descendant of the highest justified checkpoint
+            # as head
             # print('Wrong chain, reset the chain to be a descendant of the '
                   # 'highest justified checkpoint.')
-            max_height = self.highest_justified_checkpoint.height
-            max_descendant = self.highest_justified_checkpoint.hash
-            for _hash in self.tails:
-                # if the tail is descendant to the highest justified checkpoint
-                # TODO: bug with is_ancestor? see higher
-                if self.is_ancestor(self.highest_justified_checkpoint, _hash):
-                    new_height = self.processed[_hash].height
-                    if new_height > max_height:
-                        max_height = new_height
-                        max_descendant = _hash
-
-            self.main_chain_size = max_height
-            self.head = self.processed[max_descendant]
+            self.main_chain_size = self.best_descendant.height
+            self.head = self.best_descendant
+
+        # The head moved to another branch than the one of the old head
+        if (self.network.listeners and self.head is not old_head and
+                self.head.prev_hash != old_head.hash):
+            self.network.emit('head_reorg', self, old_head, self.head)
+
+    def highest_descendant_scan(self):
+        """Reference implementation of the fork choice: scans all the tails
+        to find the highest descendant of the highest justified checkpoint.
+        """
+        max_descendant = self.highest_justified_checkpoint
+        for _hash in self.tails:
+            # if the tail is descendant to the highest justified checkpoint
+            if self.is_ancestor(self.highest_justified_checkpoint, _hash):
+                if self.tails[_hash].height > max_descendant.height:
+                    max_descendant = self.tails[_hash]
+        return max_descendant
+
+    def set_highest_justified_checkpoint(self, checkpoint):
+        """Moves the highest justified checkpoint, and finds the highest block
+        among its descendants in the children of self.index.
+
+        The highest justified checkpoint only moves to higher epochs, so its
+        subtree only contains the blocks of the few most recent epochs.
+        """
+        self.highest_justified_checkpoint = checkpoint
+        self.best_descendant = self.index.highest_descendant(checkpoint)
 
     def maybe_vote_last_checkpoint(self, block):
         """Called after receiving a block.
@@ -226,7 +335,7 @@ class VoteValidator(Validator):
         Args:
             block: last block we processed
         """
-        assert block.height % EPOCH_SIZE == 0, (
+        assert block.height % self.scenario.epoch_size == 0, (
             "Block {} is not a checkpoint.".format(block.hash))
 
         # BNO: The target will be block (which is a checkpoint)
@@ -257,23 +366,51 @@ class VoteValidator(Validator):
                             target_block.hash,
                             source_block.epoch,
                             target_block.epoch,
-                            self.id)
-                self.network.broadcast(vote)
+                            self.id,
+                            self.network.node_rng(self.id))
+                self.network.broadcast(vote, self.id)
                 assert self.processed[target_block.hash]
 
+    def in_dynasty(self, validator_id, target):
+        """Returns True if the votes of `validator_id` for `target` count.
+
+        Only the validators of the current and previous dynasties of the
+        target can vote for it: accept_vote ignores the votes of the other
+        validators (which still vote).
+
+        Args:
+            validator_id: id of the voter
+            target: target checkpoint of the vote
+        """
+        return (validator_id in target.current_dynasty.validators or
+                validator_id in target.prev_dynasty.validators)
+
     def accept_vote(self, vote):
         """Called on receiving a vote message.
         """
         # print('Node %d: got a vote' % self.id, source.view, prepare.view_source,
               # prepare.blockhash, vote.blockhash in self.processed)
 
+        # The source of the vote was pruned: the vote can't count, but it is
+        # still checked against the slashing conditions if its target is
+        # above the horizon (see SenderVotes.prune)
+        if vote.epoch_source < self.horizon.epoch:
+            if vote.epoch_target >= self.horizon.epoch and vote.sender in self.votes:
+                evidence = self.votes[vote.sender].check(vote)
+                if evidence is not None:
+                    self.slashings.append(evidence)
+            return False
+
        # If the block has not yet been processed, wait
         if vote.source not in self.processed:
             self.add_dependency(vote.source, vote)
+            return False
 
-        # Check that the source is processed and justified
-        # TODO: If the source is not justified, add to dependencies?
+        # If the source is not justified yet, wait until it is
         if vote.source not in self.justified:
+            if vote.source not in self.pending_votes:
+                self.pending_votes[vote.source] = []
+            self.pending_votes[vote.source].append(vote)
             return False
 
         # If the target has not yet been processed, wait
@@ -288,65 +425,271 @@ class VoteValidator(Validator):
         # If the sender is not in the block's dynasty, ignore the vote
         # TODO: is it really vote.target? (to check dynasties)
         # TODO: reorganize dynasties like the paper
-        if vote.sender not in self.processed[vote.target].current_dynasty.validators and \
-            vote.sender not in self.processed[vote.target].prev_dynasty.validators:
+        target = self.processed[vote.target]
+        if not self.in_dynasty(vote.sender, target):
             return False
 
         # Initialize self.votes[vote.sender] if necessary
         if vote.sender not in self.votes:
-            self.votes[vote.sender] = []
+            self.votes[vote.sender] = SenderVotes()
 
         # Check the slashing conditions
-        for past_vote in self.votes[vote.sender]:
-            if past_vote.epoch_target == vote.epoch_target:
-                # TODO: SLASH
-                print('You just got slashed.')
-                return False
-
-            if ((past_vote.epoch_source < vote.epoch_source and
-                 past_vote.epoch_target > vote.epoch_target) or
-               (past_vote.epoch_source > vote.epoch_source and
-                 past_vote.epoch_target < vote.epoch_target)):
-                print('You just got slashed.')
-                return False
+        # TODO: SLASH
+        evidence = self.votes[vote.sender].check(vote)
+        if evidence is not None:
+            self.slashings.append(evidence)
+            return False
 
         # Add the vote to the map of votes
-        self.votes[vote.sender].append(vote)
+        self.votes[vote.sender].add(vote)
 
-        # Add to the vote count
-        if vote.source not in self.vote_count:
-            self.vote_count[vote.source] = {}
-        self.vote_count[vote.source][vote.target] = self.vote_count[
-            vote.source].get(vote.target, 0) + 1
+        # Add to the votes of its link, and count them
+        count = self.index.add_vote(vote)
 
         # TODO: we do not deal with finalized dynasties (the pool of validator
         # is always the same right now)
         # If there are enough votes, process them
-        if (self.vote_count[vote.source][vote.target] > (NUM_VALIDATORS * 2) // 3):
+        if count > self.scenario.threshold:
             # Mark the target as justified
+            newly_justified = vote.target not in self.justified
             self.justified.add(vote.target)
             if vote.epoch_target > self.highest_justified_checkpoint.epoch:
-                self.highest_justified_checkpoint = self.processed[vote.target]
+                self.set_highest_justified_checkpoint(target)
 
             # If the source was a direct parent of the target, the source
             # is finalized
+            newly_finalized = False
             if vote.epoch_source == vote.epoch_target - 1:
+                newly_finalized = vote.source not in self.finalized
                 self.finalized.add(vote.source)
+
+            # Emit the events once the state is updated
+            if self.network.listeners:
+                if newly_justified:
+                    self.network.emit('checkpoint_justified', self, target)
+                if newly_finalized:
+                    self.network.emit('checkpoint_finalized', self,
+                                      self.processed[vote.source])
+            if newly_finalized and self.prune_lag is not None:
+                self.maybe_prune(vote.source)
         return True
 
+    def maybe_prune(self, finalized_hash):
+        """Prunes the history below the checkpoint `prune_lag` epochs under a
+        newly finalized checkpoint, if it is on the chain of the highest
+        justified checkpoint.
+
+        The horizon moves by at least `prune_lag` epochs at a time, so the
+        cost of pruning is amortized over the epochs, and the validator keeps
+        between `prune_lag` and `2 * prune_lag` epochs under its last
+        finalized checkpoint.
+        """
+        depth = self.ancestry.depth[finalized_hash] - self.prune_lag
+        if depth < self.ancestry.depth[self.horizon.hash] + self.prune_lag:
+            return
+        if not self.is_ancestor(finalized_hash, self.highest_justified_checkpoint):
+            return
+        self.prune(self.processed[self.ancestry.ancestor(finalized_hash, depth)])
+
+    def prune(self, horizon):
+        """Drops the history which is not in the subtree of the checkpoint `horizon`.
+
+        The blocks of the forks below the horizon, the votes linking pruned
+        checkpoints and their counts, and the objects waiting for pruned
+        dependencies are removed. The accepted votes are compacted to what
+        the slashing conditions still need (see SenderVotes.prune), and the
+        objects received later below the horizon are ignored (see
+        `is_stale`). The network compacts its store once the validators
+        dropped enough objects (see Network.maybe_compact).
+
+        Args:
+            horizon: checkpoint which is an ancestor of the highest justified
+                checkpoint, and the new root of the history
+        """
+        if self.network.listeners:
+            self.network.emit('history_pruned', self, horizon)
+        keep = set(self.ancestry.descendants(horizon.hash))
+        for obj in list(self.processed.values()):
+            if isinstance(obj, Block):
+                if self.tail_membership[obj.hash] not in keep:
+                    del self.processed[obj.hash]
+            elif obj.source not in keep or obj.target not in keep:
+                del self.processed[obj.hash]
+        self.horizon = horizon
+
+        self.tails = {h: b for h, b in self.tails.items() if h in keep}
+        self.ancestry.prune(keep)
+        tail_membership = self.tail_membership
+        self.index.prune(lambda block: tail_membership[block.hash] in keep, keep.__contains__)
+        pruned_justified = self.justified - keep
+        self.num_pruned_justified += len(pruned_justified)
+        self.justified -= pruned_justified
+        pruned_finalized = self.finalized - keep
+        self.num_pruned_finalized += len(pruned_finalized)
+        self.finalized -= pruned_finalized
+
+        self.pending_votes = {source: votes for source, votes in self.pending_votes.items()
+                              if source in keep}
+        dependencies = {}
+        for hash_, objs in self.dependencies.items():
+            objs = [obj for obj in objs if not self.is_stale(obj)]
+            if objs:
+                dependencies[hash_] = objs
+        self.dependencies = dependencies
+        for sender_votes in self.votes.values():
+            sender_votes.prune(horizon.epoch)
+
+        self.network.maybe_compact()
+
     # Called on processing any object
     def on_receive(self, obj):
+        """Processes an object, then the objects which were waiting for it.
+
+        The waiting objects are processed with a worklist, in the same order
+        as a depth-first recursion, to avoid deep recursions on long chains of
+        blocks received out of order.
+
+        Returns:
+            True if `obj` was processed
+        """
         if obj.hash in self.processed:
             return False
-        if isinstance(obj, Block):
-            o = self.accept_block(obj)
-        elif isinstance(obj, Vote):
-            o = self.accept_vote(obj)
-        # If the object was successfully processed
-        # (ie. not flagged as having unsatisfied dependencies)
-        if o:
-            self.processed[obj.hash] = obj
-            if obj.hash in self.dependencies:
-                for d in self.dependencies[obj.hash]:
-                    self.on_receive(d)
-                del self.dependencies[obj.hash]
+        worklist = [obj]
+        while worklist:
+            o = worklist.pop()
+            if o.hash in self.processed:
+                continue
+            if isinstance(o, Block):
+                accepted = self.accept_block(o)
+            elif isinstance(o, Vote):
+                accepted = self.accept_vote(o)
+            # If the object was successfully processed
+            # (ie. not flagged as having unsatisfied dependencies)
+            if not accepted:
+                continue
+            self.processed[o.hash] = o
+            if o.hash in self.dependencies:
+                worklist.extend(reversed(self.dependencies.pop(o.hash)))
+            # If the vote justified its target, the votes waiting for this
+            # source to be justified can be processed
+            if isinstance(o, Vote) and o.target in self.pending_votes and \
+                    o.target in self.justified:
+                worklist.extend(reversed(self.pending_votes.pop(o.target)))
+        return obj.hash in self.processed
+
+    # Called on receiving all the messages delivered at the same time
+    def on_receive_batch(self, objs):
+        for obj in objs:
+            self.on_receive(obj)
+
+
+class LightValidator(VoteValidator):
+    """Validator which only follows the checkpoints.
+
+    The network sends it the headers of the checkpoints (see
+    Network.light_filter) and none of the other blocks. The votes and the
+    slashing conditions are the same as for VoteValidator, since they only
+    use checkpoints, so the light validators justify and finalize the same
+    checkpoints for a fraction of the cost per block.
+
+    Its head is the highest checkpoint descending from the highest
+    justified checkpoint, and the blocks it counts are the checkpoints (see
+    collector.OnlineMetrics). It can't propose blocks without the chain:
+    its proposal slots stay empty, so the light validators are usually the
+    validators with ids above num_validators, which only vote.
+
+    A header only carries the hash of the checkpoint parent, and the blocks
+    in between are not checked: the hashes of the blocks are random numbers
+    rather than digests of their contents, so they couldn't be checked
+    without the blocks themselves. What the validator checks is that the
+    checkpoint parent is a checkpoint of the previous epoch, once it has it
+    (see accept_block).
+
+    Only Network sends the headers: GossipNetwork relays the blocks, and
+    LoopbackNetwork and KeyedNetwork send the blocks to every node,
+    so a LightValidator would never accept a block on these networks (see
+    Network.sends_headers).
+
+    Raises:
+        ValueError if the network doesn't send checkpoint headers
+    """
+
+    light = True
+
+    def __init__(self, network, id, prune_lag=None):
+        if not getattr(network, 'sends_headers', False):
+            raise ValueError('{} does not send checkpoint headers to light validators'.format(
+                type(network).__name__))
+        super(LightValidator, self).__init__(network, id, prune_lag)
+        # Map {checkpoint hash -> hash of its checkpoint parent} of the
+        # checkpoints received and not accepted yet
+        self.checkpoint_parents = {}
+
+    def tick(self, time):
+        pass
+
+    def get_parent(self, block):
+        """The parent of a checkpoint is its checkpoint parent."""
+        return self.get_checkpoint_parent(block)
+
+    def get_checkpoint_parent(self, block):
+        if block.height == 0:
+            return None
+        return self.processed[self.ancestry.jumps[block.hash][0]]
+
+    def accept_block(self, block):
+        """Called on receiving a checkpoint, whose header was checked by `on_receive`.
+
+        Returns:
+            True if the checkpoint was accepted or False if we are missing
+            its checkpoint parent
+        """
+        # Only the checkpoints with a header can be linked to the tree
+        parent_hash = self.checkpoint_parents.get(block.hash)
+        if parent_hash is None or block.height <= self.horizon.height:
+            return False
+
+        # If we didn't receive the checkpoint parent yet, wait
+        if parent_hash not in self.processed:
+            self.add_dependency(parent_hash, block)
+            return False
+
+        # The checkpoint parent of a checkpoint is the checkpoint of the
+        # previous epoch (all the blocks processed are checkpoints)
+        del self.checkpoint_parents[block.hash]
+        if self.processed[parent_hash].epoch != block.epoch - 1:
+            return False
+        self.processed[block.hash] = block
+        self.index.add_block(block, True, parent_hash)
+        self.add_checkpoint(block, parent_hash)
+
+        # Reorganize the head
+        self.check_head(block)
+        if self.network.listeners:
+            self.network.emit('block_accepted', self, block)
+        return True
+
+    def prune(self, horizon):
+        super(LightValidator, self).prune(horizon)
+        # Keep the parents of the checkpoints still waiting for them
+        waiting = set(obj.hash for objs in self.dependencies.values() for obj in objs)
+        self.checkpoint_parents = {h: parent for h, parent in self.checkpoint_parents.items()
+                                   if h in waiting}
+
+    def on_receive(self, obj):
+        """Processes the checkpoint of a checkpoint header.
+
+        The header is ignored if its block is not a checkpoint, or (with
+        one block per epoch) if its checkpoint parent is not the parent of
+        the block. Its checkpoint parent is checked by accept_block.
+        """
+        if isinstance(obj, CheckpointHeader):
+            block = obj.block
+            if block.hash in self.processed or self.is_stale(block):
+                return False
+            if (block.height % self.scenario.epoch_size or
+                    (self.scenario.epoch_size == 1 and obj.parent_hash != block.prev_hash)):
+                return False
+            self.checkpoint_parents[block.hash] = obj.parent_hash
+            obj = block
+        return super(LightValidator, self).on_receive(obj)